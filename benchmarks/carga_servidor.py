@@ -0,0 +1,423 @@
+# benchmarks/carga_servidor.py
+"""
+Teste de carga do servidor MCP.
+
+Para cada tamanho de base pedido:
+  1) popula um SQLite próprio via `center_car.gerar_dados_ficticios` (reaproveita se já existir);
+  2) sobe `servidor.servidor_mcp` num subprocesso, numa porta livre;
+  3) dispara requisições `search_cars` com N threads durante X segundos, sorteando
+     o tipo de consulta de um mix configurável;
+  4) mede vazão, p50/p95/p99 (geral e por tipo) e RSS do servidor.
+
+Cada requisição é a listagem completa: respostas truncadas em MAX_LINHAS_RESPOSTA
+seguem o cursor até a última página, e a latência cobre todas elas. O número de
+páginas sai no resultado, para comparar rodadas de antes e depois da paginação.
+
+Os resultados vão para um JSON, que pode ser comparado com uma rodada anterior:
+
+    python -m benchmarks.carga_servidor --tamanhos 1000 100000 --saida atual.json --comparar base.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from center_car.config import N_SHARDS
+from center_car.gerar_dados_ficticios import COMBUSTIVEIS, MARCAS
+from center_car.protocolo import codifica, decodifica, le_frame
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+TAMANHOS_PADRAO: List[int] = [1_000, 100_000, 1_000_000]
+MIX_PADRAO: str = "todos=1,marca=4,modelo=3,faixas=2"
+TIMEOUT_REQUISICAO: float = 120.0  # listagens completas em bases de 1M são lentas
+INTERVALO_RSS: float = 0.2  # s entre amostras de RSS do servidor
+TIMEOUT_SUBIDA: float = 30.0
+
+
+# ------------------------ Consultas ------------------------ #
+
+
+def _q_todos(rng: random.Random) -> Dict[str, Any]:
+    return {}
+
+
+def _q_marca(rng: random.Random) -> Dict[str, Any]:
+    return {"marca": rng.choice(MARCAS)}
+
+
+def _q_modelo(rng: random.Random) -> Dict[str, Any]:
+    # substring curta: força o LIKE '%..%' a varrer a tabela
+    return {"modelo": rng.choice("aeiou") + rng.choice("rstnl")}
+
+
+def _q_faixas(rng: random.Random) -> Dict[str, Any]:
+    ano_min = rng.randint(2000, 2020)
+    return {
+        "ano_min": ano_min,
+        "ano_max": ano_min + rng.randint(0, 5),
+        "preco_max": float(rng.randint(20_000, 300_000)),
+        "tipo_combustivel": rng.choice(COMBUSTIVEIS),
+    }
+
+
+CONSULTAS: Dict[str, Callable[[random.Random], Dict[str, Any]]] = {
+    "todos": _q_todos,
+    "marca": _q_marca,
+    "modelo": _q_modelo,
+    "faixas": _q_faixas,
+}
+
+
+def parse_mix(texto: str) -> Dict[str, int]:
+    """Converte "todos=1,marca=4" em {"todos": 1, "marca": 4}, validando os nomes."""
+    mix: Dict[str, int] = {}
+    for parte in filter(None, (p.strip() for p in texto.split(","))):
+        nome, _, peso = parte.partition("=")
+        if nome not in CONSULTAS:
+            raise ValueError(f"consulta desconhecida no mix: {nome!r} (use {', '.join(CONSULTAS)})")
+        mix[nome] = int(peso or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("mix vazio")
+    return mix
+
+
+# ------------------------ Cliente mínimo ------------------------ #
+
+
+def requisicao(host: str, porta: int, filtros: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    Faz um `search_cars`, seguindo o cursor enquanto a resposta vier truncada,
+    e devolve (quantidade de veículos, páginas lidas).
+    Diferente de `cliente_mcp.envia_filtros`, propaga erros (precisamos contá-los).
+    """
+    args = filtros
+    linhas = paginas = 0
+    while True:
+        with socket.create_connection((host, porta), timeout=TIMEOUT_REQUISICAO) as sock:
+            sock.sendall(codifica({"tool": "search_cars", "args": args}))
+            corpo = le_frame(sock)
+        if corpo is None:
+            raise ConnectionError("servidor fechou a conexão sem responder")
+        resposta = decodifica(corpo)
+        if not resposta.get("ok"):
+            raise RuntimeError(resposta.get("error"))
+        linhas += len(resposta["result"])
+        paginas += 1
+        if resposta.get("truncado") is not True:
+            return linhas, paginas
+        args = {**filtros, "cursor": resposta["cursor"]}
+
+
+# ------------------------ Estatística ------------------------ #
+
+
+def percentil(amostras: List[float], p: float) -> Optional[float]:
+    """Percentil por rank mais próximo (amostras já em qualquer ordem)."""
+    if not amostras:
+        return None
+    ordenadas = sorted(amostras)
+    idx = max(0, min(len(ordenadas) - 1, math.ceil(p / 100 * len(ordenadas)) - 1))
+    return ordenadas[idx]
+
+
+def _resumo_latencias(lat: List[float]) -> Dict[str, Any]:
+    return {
+        "n": len(lat),
+        "p50_ms": _ms(percentil(lat, 50)),
+        "p95_ms": _ms(percentil(lat, 95)),
+        "p99_ms": _ms(percentil(lat, 99)),
+        "max_ms": _ms(max(lat) if lat else None),
+    }
+
+
+def _ms(seg: Optional[float]) -> Optional[float]:
+    return None if seg is None else round(seg * 1000, 3)
+
+
+# ------------------------ Servidor / base ------------------------ #
+
+
+def _porta_livre() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _env(caminho_bd: str, porta: int) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({"CENTERCAR_BD": caminho_bd, "CENTERCAR_HOST": "127.0.0.1", "CENTERCAR_PORTA": str(porta)})
+    env["PYTHONPATH"] = RAIZ + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def _arquivos(caminho_bd: str) -> List[str]:
+    """O arquivo do banco ou, com CENTERCAR_SHARDS > 1, os dos shards (mesma regra de banco_dados.caminho_shard)."""
+    if N_SHARDS <= 1:
+        return [caminho_bd]
+    base, ext = os.path.splitext(caminho_bd)
+    return [f"{base}_shard{i}{ext or '.db'}" for i in range(N_SHARDS)]
+
+
+def _contagem(caminho_bd: str) -> int:
+    total = 0
+    for arquivo in _arquivos(caminho_bd):
+        if not os.path.exists(arquivo):
+            return -1
+        try:
+            with sqlite3.connect(arquivo) as c:
+                total += c.execute("SELECT COUNT(*) FROM veiculos").fetchone()[0]
+        except sqlite3.Error:
+            return -1
+    return total
+
+
+def prepara_base(diretorio: str, tamanho: int) -> str:
+    """Garante um banco com exatamente `tamanho` veículos em `diretorio`; recria se divergir."""
+    caminho = os.path.join(diretorio, f"bench_{tamanho}.db")
+    if _contagem(caminho) == tamanho:
+        return caminho
+    for arquivo in [caminho, *_arquivos(caminho)]:
+        if os.path.exists(arquivo):
+            os.remove(arquivo)
+
+    print(f"  populando {tamanho} veículos em {caminho}...", flush=True)
+    subprocess.run(
+        [sys.executable, "-m", "center_car.gerar_dados_ficticios", str(tamanho)],
+        env=_env(caminho, 0),
+        cwd=RAIZ,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return caminho
+
+
+def _rss_kb(pid: int) -> Optional[int]:
+    """RSS atual do processo em KiB (Linux, via /proc). None onde não houver /proc."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for linha in f:
+                if linha.startswith("VmRSS:"):
+                    return int(linha.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _aguarda_porta(porta: int, proc: subprocess.Popen) -> None:
+    limite = time.monotonic() + TIMEOUT_SUBIDA
+    while time.monotonic() < limite:
+        if proc.poll() is not None:
+            raise RuntimeError("servidor encerrou durante a subida")
+        try:
+            with socket.create_connection(("127.0.0.1", porta), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.02)
+    raise RuntimeError("servidor não respondeu a tempo")
+
+
+# ------------------------ Execução ------------------------ #
+
+
+def roda_carga(
+    porta: int, mix: Dict[str, int], concorrencia: int, duracao: float, semente: int, pid: Optional[int] = None
+) -> Dict[str, Any]:
+    """Dispara a carga contra um servidor já no ar e devolve as métricas agregadas."""
+    latencias: Dict[str, List[float]] = {nome: [] for nome in mix}
+    erros: Dict[str, int] = {nome: 0 for nome in mix}
+    paginas: Dict[str, int] = {nome: 0 for nome in mix}
+    linhas = [0]
+    trava = threading.Lock()
+    nomes, pesos = list(mix), list(mix.values())
+
+    rss: List[int] = []
+    parar = threading.Event()
+
+    def amostra_rss() -> None:
+        while pid is not None and not parar.is_set():
+            kb = _rss_kb(pid)
+            if kb is not None:
+                rss.append(kb)
+            parar.wait(INTERVALO_RSS)
+
+    def trabalhador(i: int) -> None:
+        rng = random.Random(semente + i)
+        local: Dict[str, List[float]] = {nome: [] for nome in mix}
+        falhas: Dict[str, int] = {nome: 0 for nome in mix}
+        lidas: Dict[str, int] = {nome: 0 for nome in mix}
+        total_linhas = 0
+        while time.monotonic() < fim:
+            nome = rng.choices(nomes, pesos)[0]
+            filtros = CONSULTAS[nome](rng)
+            t0 = time.perf_counter()
+            try:
+                n, p = requisicao("127.0.0.1", porta, filtros)
+            except Exception:
+                falhas[nome] += 1
+                continue
+            local[nome].append(time.perf_counter() - t0)
+            total_linhas += n
+            lidas[nome] += p
+        with trava:
+            for nome in mix:
+                latencias[nome].extend(local[nome])
+                erros[nome] += falhas[nome]
+                paginas[nome] += lidas[nome]
+            linhas[0] += total_linhas
+
+    amostrador = threading.Thread(target=amostra_rss, daemon=True)
+    amostrador.start()
+    inicio = time.monotonic()
+    fim = inicio + duracao
+    threads = [threading.Thread(target=trabalhador, args=(i,)) for i in range(concorrencia)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    decorrido = time.monotonic() - inicio
+    parar.set()
+
+    todas = [lat for lst in latencias.values() for lat in lst]
+    return {
+        "concorrencia": concorrencia,
+        "duracao_s": round(decorrido, 3),
+        "requisicoes": len(todas),
+        "erros": sum(erros.values()),
+        "paginas": sum(paginas.values()),
+        "vazao_rps": round(len(todas) / decorrido, 2) if decorrido else 0.0,
+        "linhas_por_s": round(linhas[0] / decorrido, 2) if decorrido else 0.0,
+        "latencia": _resumo_latencias(todas),
+        "por_tipo": {
+            nome: {**_resumo_latencias(latencias[nome]), "erros": erros[nome], "paginas": paginas[nome]} for nome in mix
+        },
+        "rss_kb": {"pico": max(rss) if rss else None, "final": rss[-1] if rss else None},
+    }
+
+
+def benchmark_tamanho(diretorio: str, tamanho: int, args: argparse.Namespace, mix: Dict[str, int]) -> Dict[str, Any]:
+    caminho = prepara_base(diretorio, tamanho)
+    porta = _porta_livre()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "servidor.servidor_mcp"],
+        env=_env(caminho, porta),
+        cwd=RAIZ,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _aguarda_porta(porta, proc)
+        rss_ocioso = _rss_kb(proc.pid)
+        resultado = roda_carga(porta, mix, args.concorrencia, args.duracao, args.semente, proc.pid)
+        resultado["rss_kb"]["ocioso"] = rss_ocioso
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {"tamanho": tamanho, **resultado}
+
+
+def compara(atual: Dict[str, Any], anterior: Dict[str, Any]) -> List[str]:
+    """Linhas de texto com a variação de vazão e p99 por tamanho entre duas rodadas."""
+    antes = {r["tamanho"]: r for r in anterior.get("resultados", [])}
+    linhas = []
+    for r in atual.get("resultados", []):
+        a = antes.get(r["tamanho"])
+        if a is None:
+            continue
+        linhas.append(
+            f"  {r['tamanho']:>9}: vazão {_delta(a['vazao_rps'], r['vazao_rps'])}, "
+            f"p99 {_delta(a['latencia']['p99_ms'], r['latencia']['p99_ms'])}, "
+            f"páginas/req {_delta(_paginas_por_req(a), _paginas_por_req(r))}"
+        )
+    return linhas
+
+
+def _paginas_por_req(r: Dict[str, Any]) -> Optional[float]:
+    """Páginas por requisição; None em rodadas anteriores à contagem (liam só a primeira página)."""
+    if "paginas" not in r or not r["requisicoes"]:
+        return None
+    return round(r["paginas"] / r["requisicoes"], 2)
+
+
+def _delta(antes: Optional[float], depois: Optional[float]) -> str:
+    if not antes or depois is None:
+        return f"{antes} -> {depois}"
+    return f"{antes} -> {depois} ({(depois - antes) / antes * 100:+.1f}%)"
+
+
+def _imprime(r: Dict[str, Any]) -> None:
+    lat = r["latencia"]
+    print(
+        f"  {r['tamanho']:>9} veículos | {r['vazao_rps']:>9.1f} req/s | "
+        f"p50 {lat['p50_ms']} ms p95 {lat['p95_ms']} ms p99 {lat['p99_ms']} ms | "
+        f"erros {r['erros']} | RSS pico {r['rss_kb']['pico']} KiB"
+    )
+    for nome, t in r["por_tipo"].items():
+        print(
+            f"      {nome:<7} n={t['n']:<6} p50 {t['p50_ms']} ms p99 {t['p99_ms']} ms "
+            f"páginas {t.get('paginas')} erros {t['erros']}"
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Teste de carga do servidor MCP do CenterCar")
+    parser.add_argument("--tamanhos", nargs="+", type=int, default=TAMANHOS_PADRAO, help="Tamanhos de base")
+    parser.add_argument("--concorrencia", type=int, default=8, help="Clientes simultâneos (threads)")
+    parser.add_argument("--duracao", type=float, default=10.0, help="Segundos de carga por tamanho")
+    parser.add_argument("--mix", default=MIX_PADRAO, help=f"Pesos por tipo de consulta (padrão: {MIX_PADRAO})")
+    parser.add_argument("--semente", type=int, default=42, help="Semente dos sorteios de consulta")
+    parser.add_argument("--dir-bancos", default=os.path.join(RAIZ, ".bench"), help="Onde guardar as bases geradas")
+    parser.add_argument("--saida", default=None, help="Arquivo JSON de resultados")
+    parser.add_argument("--comparar", default=None, help="JSON de uma rodada anterior para comparar")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    mix = parse_mix(args.mix)
+    os.makedirs(args.dir_bancos, exist_ok=True)
+
+    resultados = []
+    for tamanho in args.tamanhos:
+        print(f"▶ {tamanho} veículos, {args.concorrencia} clientes, {args.duracao:.0f}s", flush=True)
+        r = benchmark_tamanho(args.dir_bancos, tamanho, args, mix)
+        _imprime(r)
+        resultados.append(r)
+
+    rodada = {
+        "quando": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "parametros": {
+            "concorrencia": args.concorrencia,
+            "duracao_s": args.duracao,
+            "mix": mix,
+            "semente": args.semente,
+        },
+        "resultados": resultados,
+    }
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(rodada, f, ensure_ascii=False, indent=2)
+        print(f"Resultados salvos em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anterior = json.load(f)
+        print(f"Comparação com {args.comparar}:")
+        print("\n".join(compara(rodada, anterior)) or "  (nenhum tamanho em comum)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,49 @@
 # center_car/banco_dados.py
 
 import os
+import zlib
+from typing import Any, Dict, List
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func
 from sqlalchemy.orm import sessionmaker
 
-# define o caminho do arquivo SQLite no diretório do projeto
-CAMINHO_BD = os.path.join(os.path.dirname(__file__), "..", "centercar.db")
+from center_car.config import CAMINHO_BD, N_SHARDS, PARTICAO_SHARDS
+
+# caminho do arquivo SQLite vem do config (padrão: centercar.db na raiz; CENTERCAR_BD sobrescreve)
 URL_BD = f"sqlite:///{CAMINHO_BD}"
 
+
+def caminho_shard(i: int) -> str:
+    """Arquivo do shard `i`: centercar.db -> centercar_shard0.db, centercar_shard1.db, ..."""
+    base, ext = os.path.splitext(CAMINHO_BD)
+    return f"{base}_shard{i}{ext or '.db'}"
+
+
+def _cria_engine(url: str):
+    return create_engine(url, echo=False, connect_args={"check_same_thread": False})
+
+
 # cria o engine e a sessão
-engine = create_engine(URL_BD, echo=False, connect_args={"check_same_thread": False})
+engine = _cria_engine(URL_BD)
 SessionLocal = sessionmaker(bind=engine)
 
+# layout particionado (só com N_SHARDS > 1): um engine/sessionmaker por arquivo
+engines_shards = [_cria_engine(f"sqlite:///{caminho_shard(i)}") for i in range(N_SHARDS)] if N_SHARDS > 1 else []
+SessoesShards = [sessionmaker(bind=e) for e in engines_shards]
+
 
 def criar_banco():
     """
-    Cria todas as tabelas no banco, de acordo com os modelos.
+    Cria todas as tabelas no banco, de acordo com os modelos (em cada shard, se houver),
+    e os índices que faltarem em tabelas já existentes.
     """
-    from center_car.modelo_veiculo import Base
+    from center_car.modelo_veiculo import Base, Veiculo
 
-    Base.metadata.create_all(bind=engine)
+    for e in [engine, *engines_shards]:
+        Base.metadata.create_all(bind=e)
+        # tabela que já existia (banco anterior a um índice novo) não passa pelo create_all: cria os que faltam
+        for indice in Veiculo.__table__.indexes:
+            indice.create(bind=e, checkfirst=True)
 
 
 def obter_sessao():
@@ -28,3 +51,80 @@ def obter_sessao():
     Retorna uma nova sessão
     """
     return SessionLocal()
+
+
+# ------------------------ Shards ------------------------ #
+
+
+def usa_shards() -> bool:
+    return len(SessoesShards) > 1
+
+
+def obter_sessao_shard(i: int):
+    """Sessão no arquivo do shard `i`."""
+    return SessoesShards[i]()
+
+
+def sessoes_de_dados() -> List[Any]:
+    """Uma sessão por arquivo de dados: o banco único ou cada shard (quem chama fecha)."""
+    if usa_shards():
+        return [obter_sessao_shard(i) for i in range(len(SessoesShards))]
+    return [obter_sessao()]
+
+
+def arquivos_de_dados() -> List[str]:
+    """Arquivos SQLite com os veículos, na ordem das sessões de `sessoes_de_dados`."""
+    if usa_shards():
+        return [caminho_shard(i) for i in range(len(SessoesShards))]
+    return [CAMINHO_BD]
+
+
+def shard_de(marca: str, id_: int) -> int:
+    """
+    Shard de um veículo. Por marca usa crc32 (estável entre processos, ao
+    contrário de hash()); por id, o resto da divisão.
+    """
+    if PARTICAO_SHARDS == "id":
+        return id_ % len(SessoesShards)
+    return zlib.crc32(marca.encode("utf-8")) % len(SessoesShards)
+
+
+def shards_da_consulta(filtros: Dict[str, Any]) -> List[int]:
+    """Shards que podem ter linhas para `filtros`: só um se a partição é por marca e a busca fixa a marca."""
+    if PARTICAO_SHARDS != "id" and isinstance(filtros.get("marca"), str):
+        return [shard_de(filtros["marca"], 0)]
+    return list(range(len(SessoesShards)))
+
+
+def shards_dos_ids(ids: List[int]) -> Dict[int, List[int]]:
+    """Onde procurar cada id: partição por id aponta o shard; por marca (que o id não diz), todos."""
+    if not usa_shards():
+        return {0: list(ids)}
+    if PARTICAO_SHARDS == "id":
+        grupos: Dict[int, List[int]] = {}
+        for id_ in ids:
+            grupos.setdefault(id_ % len(SessoesShards), []).append(id_)
+        return grupos
+    return {i: list(ids) for i in range(len(SessoesShards))}
+
+
+def proximo_id() -> int:
+    """
+    Próximo id livre somando todos os shards. Cada arquivo tem o próprio
+    autoincremento, então em modo particionado quem grava atribui o id.
+    """
+    from center_car.modelo_veiculo import Veiculo
+
+    maior = 0
+    for i in range(len(SessoesShards)):
+        with obter_sessao_shard(i) as sessao:
+            maior = max(maior, sessao.query(func.max(Veiculo.id)).scalar() or 0)
+    return maior + 1
+
+
+def por_shard(linhas: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    """Agrupa linhas (dicts com "marca" e "id") pelo shard de destino."""
+    grupos: Dict[int, List[Dict[str, Any]]] = {}
+    for linha in linhas:
+        grupos.setdefault(shard_de(linha["marca"], linha["id"]), []).append(linha)
+    return grupos
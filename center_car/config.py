@@ -9,3 +9,115 @@ PORTA = int(os.getenv("CENTERCAR_PORTA", "5000"))
 # Caminho do banco SQLite
 RAIZ_PROJETO = os.path.abspath(os.path.dirname(__file__) + os.sep + "..")
 CAMINHO_BD = os.getenv("CENTERCAR_BD", os.path.join(RAIZ_PROJETO, "centercar.db"))
+
+# Esquema da tabela veiculos: "texto" (marca/tipo_combustivel/transmissao/cor como texto em cada linha) ou
+# "dicionario" (tabelas de lookup pequenas + FKs inteiras; migre com `python -m center_car.migrar_dicionario`).
+ESQUEMA_BD = os.getenv("CENTERCAR_ESQUEMA", "texto")
+
+# Shards: com N_SHARDS > 1 os veículos ficam em N arquivos ("<CAMINHO_BD sem extensão>_shard<i>.db"),
+# particionados por "marca" (busca com marca consulta um shard só) ou "id" (id % N, distribuição uniforme).
+N_SHARDS = int(os.getenv("CENTERCAR_SHARDS", "1"))
+PARTICAO_SHARDS = os.getenv("CENTERCAR_PARTICAO", "marca")
+
+# Réplica de leitura em memória (search_cars): o arquivo é copiado para um SQLite em memória com a API de
+# backup e recopiado quando a versão dos dados muda (checada a cada REPLICA_INTERVALO s) ou, com
+# REPLICA_IDADE_MAX > 0, quando a cópia fica mais velha que isso (s).
+REPLICA_MEMORIA = os.getenv("CENTERCAR_REPLICA", "0") == "1"
+REPLICA_INTERVALO = float(os.getenv("CENTERCAR_REPLICA_INTERVALO", "1.0"))
+REPLICA_IDADE_MAX = float(os.getenv("CENTERCAR_REPLICA_IDADE_MAX", "0"))
+
+# Log de alterações (veiculos_alteracoes): cada arquivo mantém as RETENCAO_ALTERACOES entradas mais recentes
+# (0 = todas), podadas a cada PODA_INTERVALO s. Quem retoma o subscribe_cars de um `desde` que já saiu do log
+# recebe o snapshot completo de novo.
+RETENCAO_ALTERACOES = int(os.getenv("CENTERCAR_RETENCAO_ALTERACOES", "100000"))
+PODA_INTERVALO = float(os.getenv("CENTERCAR_PODA_INTERVALO", "60"))
+
+# Agente de terminal: réplica local do inventário (baixada pelo subscribe_cars e mantida em dia pelos deltas).
+# Com ela ligada, as buscas do agente não vão ao servidor; até a primeira sincronização, vão.
+REPLICA_LOCAL = os.getenv("CENTERCAR_REPLICA_LOCAL", "0") == "1"
+
+# get_cars_by_ids: máx. de linhas no cache LRU por id (JSON pronto, ~250 bytes cada); 0 desliga o cache
+CACHE_LINHAS_MAX = int(os.getenv("CENTERCAR_CACHE_LINHAS", "100000"))
+
+# Tools de escrita (upsert_cars, update_prices): desligadas por padrão. Uma thread só grava, juntando num commit
+# as escritas que chegam enquanto o commit anterior grava (group commit); ESCRITA_ATRASO_MS > 0 faz a primeira
+# esperar até isso por companhia. No máx. ESCRITA_MAX_ITENS itens por commit.
+ESCRITA_HABILITADA = os.getenv("CENTERCAR_ESCRITA", "0") == "1"
+ESCRITA_ATRASO_MS = float(os.getenv("CENTERCAR_ESCRITA_ATRASO_MS", "0"))
+ESCRITA_MAX_ITENS = int(os.getenv("CENTERCAR_ESCRITA_MAX_ITENS", "5000"))
+
+# Snapshot de subida quente (índice fuzzy, caches): arquivo gravado no desligamento e a cada SNAPSHOT_INTERVALO s
+# (0 = só no desligamento). Vazio desliga.
+SNAPSHOT_CAMINHO = os.getenv("CENTERCAR_SNAPSHOT", "")
+SNAPSHOT_INTERVALO = float(os.getenv("CENTERCAR_SNAPSHOT_INTERVALO", "300"))
+
+# Log de consultas lentas do servidor: limiar (ms), fração amostrada e teto de registros por minuto
+LIMIAR_CONSULTA_LENTA_MS = float(os.getenv("CENTERCAR_LIMIAR_LENTA_MS", "500"))
+AMOSTRA_CONSULTA_LENTA = float(os.getenv("CENTERCAR_AMOSTRA_LENTA", "1.0"))
+MAX_CONSULTAS_LENTAS_MIN = int(os.getenv("CENTERCAR_LENTAS_POR_MIN", "10"))
+
+# Profiling sob demanda no servidor (cProfile). Desligado por padrão.
+#  - PERFIL_AMOSTRA_N: perfila 1 a cada N requisições elegíveis (0 = só por tool/filtro/token)
+#  - PERFIL_TOOL / PERFIL_FILTRO: padrões fnmatch para a tool e para os args (JSON com chaves ordenadas)
+#  - PERFIL_TOKEN: se definido, envelopes com "perfilar": <token> são sempre perfilados
+PERFIL_ATIVO = os.getenv("CENTERCAR_PERFIL", "0") == "1"
+PERFIL_DIR = os.getenv("CENTERCAR_PERFIL_DIR", os.path.join(RAIZ_PROJETO, "perfis"))
+PERFIL_AMOSTRA_N = int(os.getenv("CENTERCAR_PERFIL_AMOSTRA_N", "0"))
+PERFIL_TOOL = os.getenv("CENTERCAR_PERFIL_TOOL", "")
+PERFIL_FILTRO = os.getenv("CENTERCAR_PERFIL_FILTRO", "")
+PERFIL_TOKEN = os.getenv("CENTERCAR_PERFIL_TOKEN", "")
+MAX_PERFIS_MIN = int(os.getenv("CENTERCAR_PERFIS_POR_MIN", "6"))
+
+# Log do servidor: nível, fração amostrada da linha por requisição e tamanho máx. da fila (excedente é descartado)
+LOG_NIVEL = os.getenv("CENTERCAR_LOG_NIVEL", "INFO")
+LOG_AMOSTRA_REQUISICAO = float(os.getenv("CENTERCAR_LOG_AMOSTRA", "1.0"))
+LOG_TAMANHO_FILA = int(os.getenv("CENTERCAR_LOG_FILA", "10000"))
+
+# O tamanho de um frame vai nos 28 bits baixos do header (os 4 altos são flags de compressão, ver
+# center_car/protocolo.py): nenhum frame passa disso, e os limites em bytes abaixo são cortados nele.
+TAMANHO_MAX_FRAME = (1 << 28) - 1
+
+# Guardas de memória do search_cars: máx. de linhas e de bytes por resposta.
+# LIMITE_MODO "truncar" devolve a página com {"truncado": true, "cursor": <último id>};
+# "erro" responde RESULT_TOO_LARGE. RASTREAR_MEMORIA liga o tracemalloc (pico por requisição).
+MAX_LINHAS_RESPOSTA = int(os.getenv("CENTERCAR_MAX_LINHAS", "10000"))
+MAX_BYTES_RESPOSTA = min(int(os.getenv("CENTERCAR_MAX_BYTES", str(16 * 1024 * 1024))), TAMANHO_MAX_FRAME)
+LIMITE_MODO = os.getenv("CENTERCAR_LIMITE_MODO", "truncar")
+RASTREAR_MEMORIA = os.getenv("CENTERCAR_RASTREAR_MEMORIA", "0") == "1"
+
+# Coalescência (single-flight) de search_cars idênticos e simultâneos
+COALESCER_CONSULTAS = os.getenv("CENTERCAR_COALESCER", "1") == "1"
+
+# Prazo das consultas do search_cars (ms). O cliente pode pedir menos via "prazo_ms" no envelope,
+# nunca mais que PRAZO_MAX_MS.
+PRAZO_PADRAO_MS = int(os.getenv("CENTERCAR_PRAZO_MS", "5000"))
+PRAZO_MAX_MS = int(os.getenv("CENTERCAR_PRAZO_MAX_MS", "30000"))
+
+# Tamanho máximo de um frame do protocolo (bytes); acima disso a conexão é recusada
+MAX_FRAME_BYTES = min(int(os.getenv("CENTERCAR_MAX_FRAME", str(64 * 1024 * 1024))), TAMANHO_MAX_FRAME)
+# Teto menor para o que o servidor aceita receber (requisições são pequenas)
+MAX_REQUISICAO_BYTES = int(os.getenv("CENTERCAR_MAX_REQUISICAO", str(8 * 1024 * 1024)))
+
+# Compressão negociada de frames (zlib/lzma da stdlib). O servidor só comprime respostas a partir de
+# COMPRESSAO_LIMIAR_BYTES; COMPRESSAO_NIVEL troca CPU de encode por bytes na rede (zlib 1-9, lzma preset 0-9).
+COMPRESSAO_SERVIDOR = [a for a in os.getenv("CENTERCAR_COMPRESSAO_SERVIDOR", "zlib,lzma").split(",") if a]
+COMPRESSAO_CLIENTE = [a for a in os.getenv("CENTERCAR_COMPRESSAO", "zlib").split(",") if a]
+COMPRESSAO_LIMIAR_BYTES = int(os.getenv("CENTERCAR_COMPRESSAO_LIMIAR", str(16 * 1024)))
+COMPRESSAO_NIVEL = int(os.getenv("CENTERCAR_COMPRESSAO_NIVEL", "1"))
+
+# Justiça entre clientes. Cliente = "api_key" do envelope, se ela estiver em CHAVES_CLIENTES; senão o IP de origem
+# (chave fora da lista não vale: trocar de chave a cada requisição não pode render um balde novo).
+# TAXA_POR_CLIENTE (req/s, token bucket com RAJADA_POR_CLIENTE de folga); 0 desliga o limite.
+# WORKERS_CONSULTA: pool que executa os search_cars, com fila justa (round-robin) por cliente; 0 = sem pool.
+TAXA_POR_CLIENTE = float(os.getenv("CENTERCAR_TAXA_CLIENTE", "0"))
+RAJADA_POR_CLIENTE = float(os.getenv("CENTERCAR_RAJADA_CLIENTE", "20"))
+WORKERS_CONSULTA = int(os.getenv("CENTERCAR_WORKERS", "4"))
+# Chaves aceitas pelo servidor como identidade de cliente, separadas por vírgula (vazio = só IP)
+CHAVES_CLIENTES = frozenset(c for c in os.getenv("CENTERCAR_CHAVES_CLIENTES", "").split(",") if c)
+# Chave que o cliente envia no envelope (opcional)
+API_KEY = os.getenv("CENTERCAR_API_KEY", "")
+
+# Busca fuzzy (tool suggest e search_cars com "fuzzy": true): score mínimo (Jaccard de bigramas, 0-1)
+# para aceitar um candidato e intervalo (s) entre checagens de versão dos dados para reconstruir o índice.
+FUZZY_MINIMO = float(os.getenv("CENTERCAR_FUZZY_MINIMO", "0.35"))
+FUZZY_INTERVALO = float(os.getenv("CENTERCAR_FUZZY_INTERVALO", "1.0"))
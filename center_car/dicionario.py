@@ -0,0 +1,55 @@
+# center_car/dicionario.py
+"""
+Ponte entre a API de texto (filtros e linhas com "marca": "Ford") e o
+esquema dicionário (marca_id -> marcas.nome).
+
+No esquema "texto" as funções são transparentes: `igual` compara a coluna de
+texto e `codifica_linhas` devolve as linhas como vieram.
+"""
+
+from typing import Any, Dict, List
+
+from sqlalchemy import insert, select
+
+from center_car.modelo_veiculo import LOOKUPS, Veiculo
+
+
+def igual(campo: str, valor: str):
+    """
+    Condição `Veiculo.<campo> == valor`. No esquema dicionário compara o id inteiro;
+    a subconsulta do id não é correlacionada, então o SQLite a avalia uma vez só.
+    """
+    lookup = LOOKUPS.get(campo)
+    if lookup is None:
+        return getattr(Veiculo, campo) == valor
+    return getattr(Veiculo, f"{campo}_id") == select(lookup.id).where(lookup.nome == valor).scalar_subquery()
+
+
+def codifica_linhas(sessao, linhas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Prepara linhas com os campos de texto para `insert(Veiculo)` (ou `update`):
+    no esquema dicionário troca cada texto pelo id do lookup, criando as
+    entradas novas. Campo ausente da linha (update parcial) fica de fora.
+    """
+    if not LOOKUPS or not linhas:
+        return linhas
+    ids: Dict[str, Dict[str, int]] = {}
+    for campo, lookup in LOOKUPS.items():
+        valores = {linha[campo] for linha in linhas if campo in linha}
+        if not valores:
+            continue
+        conhecidos = dict(sessao.execute(select(lookup.nome, lookup.id).where(lookup.nome.in_(valores))).all())
+        novos = sorted(valores - conhecidos.keys())
+        if novos:
+            sessao.execute(insert(lookup), [{"nome": v} for v in novos])
+            conhecidos.update(sessao.execute(select(lookup.nome, lookup.id).where(lookup.nome.in_(novos))).all())
+        ids[campo] = conhecidos
+
+    codificadas = []
+    for linha in linhas:
+        nova = {k: v for k, v in linha.items() if k not in LOOKUPS}
+        for campo in LOOKUPS:
+            if campo in linha:
+                nova[f"{campo}_id"] = ids[campo][linha[campo]]
+        codificadas.append(nova)
+    return codificadas
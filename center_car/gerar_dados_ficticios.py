@@ -1,26 +1,29 @@
 import argparse
+from contextlib import ExitStack
 from random import choice, randint, uniform
 from typing import Final
 
 from faker import Faker
 from faker.exceptions import UniquenessException
+from sqlalchemy import insert
 
-from center_car.banco_dados import engine, obter_sessao
-from center_car.modelo_veiculo import Base, Veiculo
+from center_car.banco_dados import criar_banco, obter_sessao, obter_sessao_shard, por_shard, proximo_id, usa_shards
+from center_car.dicionario import codifica_linhas
+from center_car.modelo_veiculo import Veiculo
 
 # Constantes de configuração
 DEFAULT_QTD: Final[int] = 100
 MARCAS: Final[list[str]] = ["Ford", "Chevrolet", "Toyota", "Honda", "Volkswagen", "BMW", "Jeep", "Jaguar"]
 COMBUSTIVEIS: Final[list[str]] = ["Gasolina", "Etanol", "Diesel", "Flex", "Elétrico"]
 TRANSMISSOES: Final[list[str]] = ["Manual", "Automática", "CVT"]
-FLUSH_INTERVAL: Final[int] = 50
+FLUSH_INTERVAL: Final[int] = 5_000
 
 
 def create_tables() -> None:
     """
-    Garante que todas as tabelas declaradas nos modelos existam no banco.
+    Garante que todas as tabelas declaradas nos modelos existam no banco (e em cada shard).
     """
-    Base.metadata.create_all(bind=engine)
+    criar_banco()
 
 
 def popula_bd(qtd: int = DEFAULT_QTD) -> None:
@@ -29,39 +32,72 @@ def popula_bd(qtd: int = DEFAULT_QTD) -> None:
 
     - Usa Faker em pt_BR para nomes e cores.
     - Garante unicidade de `modelo` até esgotar o pool e, então,
-      volta a nomes repetidos.
-    - Faz flush a cada `FLUSH_INTERVAL` objetos para controlar uso de memória.
+      volta a nomes repetidos (sem tentar o pool único de novo, o que
+      deixaria cargas grandes — 100k, 1M — quadráticas).
+    - Insere em lotes de `FLUSH_INTERVAL` linhas (executemany), para
+      controlar uso de memória sem hidratar um objeto ORM por veículo.
+    - Com shards, atribui os ids (únicos entre os arquivos) e grava cada
+      linha no shard da sua marca/id.
     """
     faker = Faker("pt_BR")
     faker.unique.clear()
-
-    # Context manager assegura commit/rollback e fechamento da sessão
-    with obter_sessao() as session:
-        for i in range(qtd):
-            try:
-                modelo = faker.unique.word().title()
-            except UniquenessException:
+    pool_unico = True
+    shards = usa_shards()
+    proximo = proximo_id() if shards else 0
+
+    # Context manager assegura o fechamento das sessões
+    with ExitStack() as pilha:
+        session = pilha.enter_context(obter_sessao()) if not shards else None
+        sessoes_shard: dict = {}
+
+        def grava(linhas: list[dict]) -> None:
+            # codifica_linhas: no esquema dicionário, textos viram ids dos lookups (por arquivo)
+            if session is not None:
+                session.execute(insert(Veiculo), codifica_linhas(session, linhas))
+                return
+            for i, grupo in por_shard(linhas).items():
+                if i not in sessoes_shard:
+                    sessoes_shard[i] = pilha.enter_context(obter_sessao_shard(i))
+                sessoes_shard[i].execute(insert(Veiculo), codifica_linhas(sessoes_shard[i], grupo))
+
+        lote: list[dict] = []
+        for _ in range(qtd):
+            modelo = None
+            if pool_unico:
+                try:
+                    modelo = faker.unique.word().title()
+                except UniquenessException:
+                    pool_unico = False
+            if modelo is None:
                 modelo = faker.word().title()
 
-            veic = Veiculo(
-                marca=choice(MARCAS),
-                modelo=modelo,
-                ano=randint(2000, 2025),
-                motorizacao=f"{randint(1, 4)}.0",
-                tipo_combustivel=choice(COMBUSTIVEIS),
-                cor=faker.color_name(),
-                quilometragem=round(uniform(0, 200_000), 2),
-                numero_portas=choice([2, 4, 5]),
-                transmissao=choice(TRANSMISSOES),
-                preco=round(uniform(10_000, 300_000), 2),
-            )
-            session.add(veic)
-
-            if (i + 1) % FLUSH_INTERVAL == 0:
-                session.flush()
+            linha = {
+                "marca": choice(MARCAS),
+                "modelo": modelo,
+                "ano": randint(2000, 2025),
+                "motorizacao": f"{randint(1, 4)}.0",
+                "tipo_combustivel": choice(COMBUSTIVEIS),
+                "cor": faker.color_name(),
+                "quilometragem": round(uniform(0, 200_000), 2),
+                "numero_portas": choice([2, 4, 5]),
+                "transmissao": choice(TRANSMISSOES),
+                "preco": round(uniform(10_000, 300_000), 2),
+            }
+            if shards:
+                linha["id"] = proximo
+                proximo += 1
+            lote.append(linha)
+
+            if len(lote) >= FLUSH_INTERVAL:
+                grava(lote)
+                lote = []
+
+        if lote:
+            grava(lote)
 
         # Commit ao final de todas as inserções
-        session.commit()
+        for sessao in [session] if session is not None else sessoes_shard.values():
+            sessao.commit()
 
     print(f"{qtd} veículos inseridos com sucesso!")
 
@@ -0,0 +1,94 @@
+# center_car/indice_ngramas.py
+"""
+Índice de n-gramas para busca tolerante a erros de digitação, compartilhado
+pelo servidor (servidor/indice_fuzzy.py) e pela réplica local do cliente
+(cliente/replica_local.py).
+
+Cada valor normalizado (minúsculas, sem acento) vira o conjunto dos seus
+bigramas, e a lista invertida bigrama -> valores permite pontuar só os
+candidatos que dividem algum bigrama com a entrada (similaridade de Jaccard).
+Bigramas toleram melhor que trigramas as trocas de letra típicas em nomes
+curtos ("pegeout" -> "Peugeot"). Com alguns milhares de valores distintos a
+consulta fica na casa das dezenas de µs.
+"""
+
+import unicodedata
+from typing import Dict, Iterable, List, Tuple
+
+from center_car.config import FUZZY_MINIMO
+
+CAMPOS_FUZZY: Tuple[str, ...] = ("marca", "modelo")
+N_GRAMA = 2
+
+
+def normaliza(texto: str) -> str:
+    """Minúsculas, sem acentos e com espaços colapsados ("  Citroën  C4 " -> "citroen c4")."""
+    sem_acento = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+    return " ".join(sem_acento.lower().split())
+
+
+def ngramas(texto: str, n: int = N_GRAMA) -> frozenset:
+    """N-gramas do texto normalizado, com borda (" a" marca o começo da palavra)."""
+    t = f" {texto} "
+    return frozenset(t[i : i + n] for i in range(max(1, len(t) - n + 1)))
+
+
+class IndiceNgramas:
+    """Índice de n-gramas sobre um conjunto de valores (imutável depois de construído)."""
+
+    def __init__(self, valores: Iterable[str]) -> None:
+        self.valores: List[str] = []
+        self.normalizados: List[str] = []
+        self._gramas: List[int] = []  # quantos n-gramas cada valor tem
+        self._exatos: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = {}
+        self._conhecidos = frozenset(valores)  # valores exatos, como estão no banco
+        for valor in sorted(self._conhecidos):
+            norm = normaliza(valor)
+            if not norm or norm in self._exatos:
+                continue
+            idx = len(self.valores)
+            self.valores.append(valor)
+            self.normalizados.append(norm)
+            self._exatos[norm] = idx
+            gramas = ngramas(norm)
+            self._gramas.append(len(gramas))
+            for g in gramas:
+                self._postings.setdefault(g, []).append(idx)
+
+    def candidatos(self, termo: str, limite: int = 5, minimo: float = FUZZY_MINIMO) -> List[Tuple[str, float]]:
+        """Até `limite` valores mais parecidos com `termo` (score de 0 a 1), do melhor para o pior."""
+        norm = normaliza(termo)
+        if not norm:
+            return []
+        exato = self._exatos.get(norm)
+        gramas = ngramas(norm)
+        comuns: Dict[int, int] = {}
+        for g in gramas:
+            for idx in self._postings.get(g, ()):
+                comuns[idx] = comuns.get(idx, 0) + 1
+        pontuados = []
+        for idx, c in comuns.items():
+            score = 1.0 if idx == exato else c / (len(gramas) + self._gramas[idx] - c)
+            if score >= minimo:
+                pontuados.append((score, self.valores[idx]))
+        pontuados.sort(key=lambda sv: (-sv[0], sv[1]))
+        return [(valor, round(score, 3)) for score, valor in pontuados[:limite]]
+
+    def contem(self, termo: str) -> bool:
+        """
+        Algum valor contém `termo` (normalizado)? É o que o LIKE do search_cars já encontraria.
+        Só confere os valores que têm todos os n-gramas de dentro do termo (listas invertidas).
+        """
+        norm = normaliza(termo)
+        internos = {norm[i : i + N_GRAMA] for i in range(len(norm) - N_GRAMA + 1)}
+        if not internos:
+            # termo menor que um n-grama: não há lista para cruzar
+            return any(norm in v for v in self.normalizados)
+        listas = sorted((self._postings.get(g, ()) for g in internos), key=len)
+        candidatos = set(listas[0]).intersection(*listas[1:])
+        return any(norm in self.normalizados[idx] for idx in candidatos)
+
+    def tem(self, valor: str) -> bool:
+        """`valor` (exato, sem normalizar) é um dos valores indexados?"""
+        return valor in self._conhecidos
@@ -0,0 +1,127 @@
+# center_car/migrar_dicionario.py
+"""
+Migra bancos do esquema "texto" para o esquema "dicionario".
+
+Para cada arquivo (o banco único ou cada shard):
+  1) cria as tabelas de lookup (marcas, combustiveis, transmissoes, cores) com os valores distintos;
+  2) recria `veiculos` com FKs inteiras, copiando as linhas com os mesmos ids;
+  3) recria os índices de cobertura (com as colunas <campo>_id) e reinstala os gatilhos do log de
+     alterações (a cópia não gera entradas no log);
+  4) VACUUM, para o arquivo encolher de fato.
+
+Tudo numa transação por arquivo; arquivos já migrados são pulados. Depois, suba
+servidor e seed com CENTERCAR_ESQUEMA=dicionario.
+
+    python -m center_car.migrar_dicionario            # usa CENTERCAR_BD / CENTERCAR_SHARDS
+    python -m center_car.migrar_dicionario a.db b.db  # arquivos explícitos
+"""
+
+import argparse
+import os
+import sqlite3
+from typing import List, Tuple
+
+from center_car.config import CAMINHO_BD, N_SHARDS
+from center_car.modelo_veiculo import (
+    GATILHOS_ALTERACOES,
+    INDICES_COBERTURA,
+    MAX_LEN_MARCA,
+    MAX_LEN_MODELO,
+    MAX_LEN_MOTORIZACAO,
+    TABELAS_LOOKUP,
+    colunas_do_indice,
+)
+
+# Mesmo DDL que o create_all gera para o modelo no esquema dicionário
+DDL_VEICULOS = f"""
+CREATE TABLE veiculos_novo (
+    id INTEGER NOT NULL,
+    marca_id INTEGER NOT NULL,
+    modelo VARCHAR({MAX_LEN_MODELO}) NOT NULL,
+    ano INTEGER NOT NULL,
+    motorizacao VARCHAR({MAX_LEN_MOTORIZACAO}) NOT NULL,
+    tipo_combustivel_id INTEGER NOT NULL,
+    cor_id INTEGER NOT NULL,
+    quilometragem FLOAT NOT NULL,
+    numero_portas INTEGER NOT NULL,
+    transmissao_id INTEGER NOT NULL,
+    preco FLOAT NOT NULL,
+    PRIMARY KEY (id),
+    FOREIGN KEY(marca_id) REFERENCES marcas (id),
+    FOREIGN KEY(tipo_combustivel_id) REFERENCES combustiveis (id),
+    FOREIGN KEY(cor_id) REFERENCES cores (id),
+    FOREIGN KEY(transmissao_id) REFERENCES transmissoes (id)
+)
+"""
+
+COPIA_VEICULOS = """
+INSERT INTO veiculos_novo
+SELECT v.id, m.id, v.modelo, v.ano, v.motorizacao, c.id, co.id, v.quilometragem, v.numero_portas, t.id, v.preco
+FROM veiculos v
+JOIN marcas m ON m.nome = v.marca
+JOIN combustiveis c ON c.nome = v.tipo_combustivel
+JOIN cores co ON co.nome = v.cor
+JOIN transmissoes t ON t.nome = v.transmissao
+"""
+
+
+def ja_migrado(conn: sqlite3.Connection) -> bool:
+    colunas = {linha[1] for linha in conn.execute("PRAGMA table_info(veiculos)")}
+    return "marca_id" in colunas
+
+
+def migra_arquivo(caminho: str) -> Tuple[int, int]:
+    """Migra um arquivo; devolve (bytes antes, bytes depois). Arquivo já migrado fica como está."""
+    antes = os.path.getsize(caminho)
+    conn = sqlite3.connect(caminho, isolation_level=None)
+    try:
+        if ja_migrado(conn):
+            return antes, antes
+        conn.execute("BEGIN")
+        try:
+            for coluna, tabela in TABELAS_LOOKUP.items():
+                conn.execute(
+                    f"CREATE TABLE {tabela} (id INTEGER NOT NULL, nome VARCHAR({MAX_LEN_MARCA}) NOT NULL, "
+                    "PRIMARY KEY (id), UNIQUE (nome))"
+                )
+                conn.execute(f"INSERT INTO {tabela} (nome) SELECT DISTINCT {coluna} FROM veiculos ORDER BY {coluna}")
+            conn.execute(DDL_VEICULOS)
+            conn.execute(COPIA_VEICULOS)
+            # DROP leva junto os gatilhos da tabela antiga
+            conn.execute("DROP TABLE veiculos")
+            conn.execute("ALTER TABLE veiculos_novo RENAME TO veiculos")
+            for nome, campos in INDICES_COBERTURA.items():
+                conn.execute(f"CREATE INDEX {nome} ON veiculos ({', '.join(colunas_do_indice(campos, True))})")
+            for gatilho in GATILHOS_ALTERACOES:
+                conn.execute(gatilho)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return antes, os.path.getsize(caminho)
+
+
+def arquivos_configurados() -> List[str]:
+    if N_SHARDS > 1:
+        from center_car.banco_dados import caminho_shard
+
+        return [caminho_shard(i) for i in range(N_SHARDS)]
+    return [CAMINHO_BD]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migra o banco para o esquema dicionário (tabelas de lookup)")
+    parser.add_argument("arquivos", nargs="*", help="Arquivos SQLite (padrão: CENTERCAR_BD ou os shards)")
+    args = parser.parse_args()
+
+    for caminho in args.arquivos or arquivos_configurados():
+        antes, depois = migra_arquivo(caminho)
+        print(f"{caminho}: {antes / 1024:.0f} KiB -> {depois / 1024:.0f} KiB")
+    print("Pronto. Use CENTERCAR_ESQUEMA=dicionario ao subir servidor e seed.")
+
+
+if __name__ == "__main__":
+    main()
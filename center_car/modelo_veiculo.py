@@ -2,11 +2,26 @@
 """
 Modelo SQLAlchemy para veículos, com mixin de __repr__ e constantes de tamanho
 para facilitar manutenção e evitar “números mágicos”.
+
+Com CENTERCAR_ESQUEMA=dicionario, as colunas de baixa cardinalidade (marca,
+tipo_combustivel, transmissao, cor) viram FKs inteiras para tabelas de lookup;
+o atributo de texto continua existindo, então quem lê `v.marca` não percebe a
+diferença. Na instância ele é decodificado em Python, com um cache id -> nome
+por arquivo (o SELECT traz só inteiros); na classe é a subconsulta do nome,
+para quem monta SQL com `Veiculo.marca`. Filtros e escritas passam por
+`center_car/dicionario.py`.
+
+Também declara o log de alterações (`veiculos_alteracoes`), alimentado por
+gatilhos do SQLite a cada escrita em `veiculos`. Cada linha do log recebe um
+`seq` monotônico, usado pela tool `subscribe_cars` para enviar só o que mudou.
 """
 
-from sqlalchemy import Column, Float, Integer, String
+from sqlalchemy import DDL, Column, Float, ForeignKey, Index, Integer, String, event, select
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import declarative_base
 
+from center_car.config import ESQUEMA_BD
+
 Base = declarative_base()
 
 # Constantes de tamanho para evitar números mágicos
@@ -16,6 +31,7 @@ MAX_LEN_MOTORIZACAO = 50
 MAX_LEN_TIPO_COMBUSTIVEL = 30
 MAX_LEN_COR = 30
 MAX_LEN_TRANSMISSAO = 30
+MAX_LEN_OPERACAO = 10
 
 
 class ReprMixin:
@@ -31,32 +47,224 @@ class ReprMixin:
         return f"<{self.__class__.__name__}({', '.join(field_strings)})>"
 
 
-class Veiculo(ReprMixin, Base):
-    """
-    Entidade Veículo, representa a tabela 'veiculos' no banco de dados.
-    """
+# Coluna de texto -> tabela de lookup, no esquema "dicionario"
+TABELAS_LOOKUP: dict[str, str] = {
+    "marca": "marcas",
+    "tipo_combustivel": "combustiveis",
+    "transmissao": "transmissoes",
+    "cor": "cores",
+}
+
+# Execution option do engine com o arquivo de dados que ele lê, quando a URL não é o arquivo (réplica em memória)
+OPCAO_ARQUIVO = "centercar_arquivo"
 
-    __tablename__ = "veiculos"
-
-    # Colunas
-    id: int = Column(Integer, primary_key=True, autoincrement=True)
-    marca: str = Column(String(MAX_LEN_MARCA), nullable=False)
-    modelo: str = Column(String(MAX_LEN_MODELO), nullable=False)
-    ano: int = Column(Integer, nullable=False)
-    motorizacao: str = Column(String(MAX_LEN_MOTORIZACAO), nullable=False)
-    tipo_combustivel: str = Column(String(MAX_LEN_TIPO_COMBUSTIVEL), nullable=False)
-    cor: str = Column(String(MAX_LEN_COR), nullable=False)
-    quilometragem: float = Column(Float, nullable=False)
-    numero_portas: int = Column(Integer, nullable=False)
-    transmissao: str = Column(String(MAX_LEN_TRANSMISSAO), nullable=False)
-    preco: float = Column(Float, nullable=False)
-
-    # Campos incluídos no __repr__
-    _repr_fields = (
-        "id",
+# Índices de cobertura do search_cars: a primeira coluna é a da busca no índice (igualdade ou faixa) e as demais
+# cobrem os outros filtros, para a subconsulta de ids do servidor responder sem ler páginas da tabela.
+# numero_portas/transmissao/tipo_combustivel têm poucos valores: sozinhos casam com um terço da tabela (o SCAN
+# em ordem de id com LIMIT é o melhor plano), então só entram como cobertura.
+INDICES_COBERTURA: dict[str, tuple[str, ...]] = {
+    "ix_veiculos_busca_marca": (
         "marca",
-        "modelo",
+        "preco",
         "ano",
+        "quilometragem",
+        "numero_portas",
+        "transmissao",
         "tipo_combustivel",
-        "preco",
-    )
+        "modelo",
+    ),
+    "ix_veiculos_busca_preco": ("preco", "ano", "quilometragem"),
+    "ix_veiculos_busca_cor": ("cor", "preco"),
+}
+
+
+def colunas_do_indice(campos: tuple[str, ...], dicionario: bool) -> list[str]:
+    """Colunas reais de um índice: no esquema dicionário, os campos de lookup viram "<campo>_id"."""
+    return [f"{c}_id" if dicionario and c in TABELAS_LOOKUP else c for c in campos]
+
+
+def _indices_cobertura(dicionario: bool) -> tuple:
+    return tuple(Index(nome, *colunas_do_indice(campos, dicionario)) for nome, campos in INDICES_COBERTURA.items())
+
+
+if ESQUEMA_BD == "dicionario":
+
+    class _Lookup(ReprMixin):
+        # sem anotação de tipo: o declarative do SQLAlchemy 2 não aceita anotação simples em mixin
+        id = Column(Integer, primary_key=True)
+        nome = Column(String(MAX_LEN_MARCA), nullable=False, unique=True)
+
+        _repr_fields = ("id", "nome")
+
+    class Marca(_Lookup, Base):
+        __tablename__ = "marcas"
+
+    class Combustivel(_Lookup, Base):
+        __tablename__ = "combustiveis"
+
+    class Transmissao(_Lookup, Base):
+        __tablename__ = "transmissoes"
+
+    class Cor(_Lookup, Base):
+        __tablename__ = "cores"
+
+    # coluna de texto -> classe de lookup (usado por center_car/dicionario.py)
+    LOOKUPS: dict[str, type] = {
+        "marca": Marca,
+        "tipo_combustivel": Combustivel,
+        "transmissao": Transmissao,
+        "cor": Cor,
+    }
+
+    def _texto(campo: str, lookup) -> hybrid_property:
+        """Atributo de texto de uma coluna de lookup: dict na instância, subconsulta na classe."""
+        fk = f"{campo}_id"
+
+        def na_instancia(self):
+            return self._nomes[campo][getattr(self, fk)]
+
+        def na_classe(cls):
+            return select(lookup.nome).where(lookup.id == getattr(cls, fk)).scalar_subquery()
+
+        return hybrid_property(na_instancia, expr=na_classe)
+
+    class Veiculo(ReprMixin, Base):
+        """
+        Entidade Veículo no esquema dicionário: FKs inteiras para as tabelas de
+        lookup e os mesmos atributos de texto, somente leitura.
+        """
+
+        __tablename__ = "veiculos"
+        __table_args__ = _indices_cobertura(dicionario=True)
+
+        # Colunas
+        id: int = Column(Integer, primary_key=True, autoincrement=True)
+        marca_id: int = Column(Integer, ForeignKey("marcas.id"), nullable=False)
+        modelo: str = Column(String(MAX_LEN_MODELO), nullable=False)
+        ano: int = Column(Integer, nullable=False)
+        motorizacao: str = Column(String(MAX_LEN_MOTORIZACAO), nullable=False)
+        tipo_combustivel_id: int = Column(Integer, ForeignKey("combustiveis.id"), nullable=False)
+        cor_id: int = Column(Integer, ForeignKey("cores.id"), nullable=False)
+        quilometragem: float = Column(Float, nullable=False)
+        numero_portas: int = Column(Integer, nullable=False)
+        transmissao_id: int = Column(Integer, ForeignKey("transmissoes.id"), nullable=False)
+        preco: float = Column(Float, nullable=False)
+
+        # Texto decodificado dos lookups
+        marca = _texto("marca", Marca)
+        tipo_combustivel = _texto("tipo_combustivel", Combustivel)
+        cor = _texto("cor", Cor)
+        transmissao = _texto("transmissao", Transmissao)
+
+        # Campos incluídos no __repr__
+        _repr_fields = (
+            "id",
+            "marca",
+            "modelo",
+            "ano",
+            "tipo_combustivel",
+            "preco",
+        )
+
+    # id -> nome de cada lookup, por arquivo de dados (ids são por arquivo: shards têm lookups próprios).
+    # A chave é o arquivo, não o engine: as gerações da réplica em memória de um arquivo dividem a entrada dele.
+    _NOMES_POR_ARQUIVO: dict[str, dict[str, dict[int, str]]] = {}
+
+    def _carrega_nomes(conexao) -> dict[str, dict[int, str]]:
+        return {
+            c: dict(conexao.exec_driver_sql(f"SELECT id, nome FROM {tabela}").fetchall())
+            for c, tabela in TABELAS_LOOKUP.items()
+        }
+
+    @event.listens_for(Veiculo, "load")
+    def _decodifica_ao_carregar(veiculo, contexto) -> None:
+        # resolvido uma vez por consulta (contexto.attributes), não por linha
+        nomes = contexto.attributes.get("nomes_lookup")
+        if nomes is None or any(getattr(veiculo, f"{c}_id") not in nomes[c] for c in TABELAS_LOOKUP):
+            conexao = contexto.session.connection()
+            arquivo = conexao.get_execution_options().get(OPCAO_ARQUIVO) or str(conexao.engine.url.database)
+            nomes = _NOMES_POR_ARQUIVO.get(arquivo)
+            # ids só são criados, nunca trocados: id desconhecido significa lookup novo, recarrega
+            if nomes is None or any(getattr(veiculo, f"{c}_id") not in nomes[c] for c in TABELAS_LOOKUP):
+                nomes = _NOMES_POR_ARQUIVO[arquivo] = _carrega_nomes(conexao)
+            contexto.attributes["nomes_lookup"] = nomes
+        veiculo._nomes = nomes
+
+else:
+    LOOKUPS = {}
+
+    class Veiculo(ReprMixin, Base):  # type: ignore[no-redef]
+        """
+        Entidade Veículo, representa a tabela 'veiculos' no banco de dados.
+        """
+
+        __tablename__ = "veiculos"
+        __table_args__ = _indices_cobertura(dicionario=False)
+
+        # Colunas
+        id: int = Column(Integer, primary_key=True, autoincrement=True)
+        marca: str = Column(String(MAX_LEN_MARCA), nullable=False)
+        modelo: str = Column(String(MAX_LEN_MODELO), nullable=False)
+        ano: int = Column(Integer, nullable=False)
+        motorizacao: str = Column(String(MAX_LEN_MOTORIZACAO), nullable=False)
+        tipo_combustivel: str = Column(String(MAX_LEN_TIPO_COMBUSTIVEL), nullable=False)
+        cor: str = Column(String(MAX_LEN_COR), nullable=False)
+        quilometragem: float = Column(Float, nullable=False)
+        numero_portas: int = Column(Integer, nullable=False)
+        transmissao: str = Column(String(MAX_LEN_TRANSMISSAO), nullable=False)
+        preco: float = Column(Float, nullable=False)
+
+        # Campos incluídos no __repr__
+        _repr_fields = (
+            "id",
+            "marca",
+            "modelo",
+            "ano",
+            "tipo_combustivel",
+            "preco",
+        )
+
+
+class AlteracaoVeiculo(ReprMixin, Base):
+    """
+    Entrada do log de alterações da tabela 'veiculos'.
+    Preenchida apenas pelos gatilhos abaixo; o código nunca escreve aqui direto.
+    """
+
+    __tablename__ = "veiculos_alteracoes"
+    # AUTOINCREMENT garante que `seq` nunca é reutilizado, mesmo após deletes
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: int = Column(Integer, primary_key=True, autoincrement=True)
+    veiculo_id: int = Column(Integer, nullable=False)
+    operacao: str = Column(String(MAX_LEN_OPERACAO), nullable=False)  # insert | update | delete
+
+    _repr_fields = ("seq", "veiculo_id", "operacao")
+
+
+# Gatilhos que registram cada escrita em `veiculos` no log de alterações.
+# Ficam presos ao `create_all` do metadata (IF NOT EXISTS) para também serem
+# instalados em bancos já existentes, criados antes do log existir.
+GATILHOS_ALTERACOES: tuple[str, ...] = (
+    """
+    CREATE TRIGGER IF NOT EXISTS veiculos_alteracoes_insert AFTER INSERT ON veiculos
+    BEGIN
+        INSERT INTO veiculos_alteracoes (veiculo_id, operacao) VALUES (NEW.id, 'insert');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS veiculos_alteracoes_update AFTER UPDATE ON veiculos
+    BEGIN
+        INSERT INTO veiculos_alteracoes (veiculo_id, operacao) VALUES (NEW.id, 'update');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS veiculos_alteracoes_delete AFTER DELETE ON veiculos
+    BEGIN
+        INSERT INTO veiculos_alteracoes (veiculo_id, operacao) VALUES (OLD.id, 'delete');
+    END
+    """,
+)
+
+for _gatilho in GATILHOS_ALTERACOES:
+    event.listen(Base.metadata, "after_create", DDL(_gatilho).execute_if(dialect="sqlite"))
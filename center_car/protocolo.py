@@ -0,0 +1,164 @@
+# center_car/protocolo.py
+"""
+Framing do protocolo MCP, compartilhado por servidor e cliente.
+
+Cada mensagem é `4 bytes (big-endian)` com o tamanho + o JSON UTF-8.
+A leitura é feita sem cópias extras: o header é lido por inteiro (nada de
+`recv(4)` que pode voltar curto), o corpo vai direto para um `bytearray` do
+tamanho anunciado via `recv_into` + `memoryview`, e o JSON é decodificado a
+partir desse buffer (`json.loads` aceita bytes, sem `.decode()` intermediário).
+Frames acima de `MAX_FRAME_BYTES` são recusados antes de qualquer alocação.
+
+Compressão: os 4 bits altos do header são flags (bit 31 = zlib, bit 30 =
+lzma) e os 28 baixos, o tamanho. O cliente anuncia no envelope o que aceita
+("compressao": ["zlib", ...]); o servidor só comprime frames grandes e só se
+ficar menor. Sem negociação, nenhum bit de flag é usado — clientes antigos
+continuam lendo o header como tamanho puro.
+"""
+
+import json
+import lzma
+import zlib
+from typing import Any, Iterable, Optional, Union
+
+from center_car.config import (
+    COMPRESSAO_LIMIAR_BYTES,
+    COMPRESSAO_NIVEL,
+    COMPRESSAO_SERVIDOR,
+    MAX_FRAME_BYTES,
+    TAMANHO_MAX_FRAME,
+)
+
+TAMANHO_HEADER = 4
+
+FLAG_ZLIB = 1 << 31
+FLAG_LZMA = 1 << 30
+MASCARA_TAMANHO = TAMANHO_MAX_FRAME  # 28 bits
+FLAGS: dict[str, int] = {"zlib": FLAG_ZLIB, "lzma": FLAG_LZMA}
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class FrameInvalido(Exception):
+    """Header curto, conexão encerrada no meio do frame ou tamanho acima do máximo."""
+
+
+class FrameGrandeDemais(FrameInvalido):
+    """O header anuncia (ou a descompressão produziria) mais bytes que o máximo permitido."""
+
+
+def recv_exato(sock, n: int) -> bytearray:
+    """
+    Lê exatamente `n` bytes num buffer pré-alocado. Levanta FrameInvalido se a
+    conexão encerrar antes. Sockets sem `recv_into` (fakes de teste) caem no `recv`.
+    """
+    buf = bytearray(n)
+    view = memoryview(buf)
+    recv_into = getattr(sock, "recv_into", None)
+    lidos = 0
+    while lidos < n:
+        if recv_into is not None:
+            parte = recv_into(view[lidos:])
+        else:
+            pedaco = sock.recv(n - lidos)[: n - lidos]
+            parte = len(pedaco)
+            view[lidos : lidos + parte] = pedaco
+        if not parte:
+            raise FrameInvalido(f"conexão encerrada após {lidos} de {n} bytes")
+        lidos += parte
+    return buf
+
+
+def le_frame(sock, max_bytes: int = MAX_FRAME_BYTES) -> Optional[Buffer]:
+    """
+    Lê um frame completo e devolve o corpo (já descomprimido, se vier com flag).
+    Devolve None se a conexão fechar limpa antes do header (fim normal de um stream).
+    """
+    try:
+        header = recv_exato(sock, TAMANHO_HEADER)
+    except FrameInvalido:
+        return None
+    valor = int.from_bytes(header, "big")
+    flags, tamanho = valor & ~MASCARA_TAMANHO, valor & MASCARA_TAMANHO
+    if tamanho > max_bytes:
+        raise FrameGrandeDemais(f"frame de {tamanho} bytes excede o máximo de {max_bytes}")
+    corpo = recv_exato(sock, tamanho)
+    return descomprime(corpo, flags, max_bytes) if flags else corpo
+
+
+def frame(dados: Buffer, flags: int = 0) -> bytes:
+    """
+    Prefixa `dados` com o header de tamanho (+ flags). Levanta FrameGrandeDemais
+    se o tamanho não cabe nos bits do header (invadiria as flags).
+    """
+    if len(dados) > MASCARA_TAMANHO:
+        raise FrameGrandeDemais(f"frame de {len(dados)} bytes excede o máximo do header ({MASCARA_TAMANHO})")
+    return (len(dados) | flags).to_bytes(TAMANHO_HEADER, "big") + dados
+
+
+def codifica(obj: Any) -> bytes:
+    """JSON UTF-8 já enquadrado, pronto para sendall."""
+    return frame(json.dumps(obj).encode("utf-8"))
+
+
+def decodifica(corpo: Buffer) -> Any:
+    """Decodifica o JSON direto do buffer recebido (levanta ValueError se inválido)."""
+    return json.loads(corpo)
+
+
+# ------------------------ Compressão ------------------------ #
+
+
+def escolhe_compressao(pedidos: Any, habilitados: Iterable[str] = COMPRESSAO_SERVIDOR) -> Optional[str]:
+    """Primeiro algoritmo da lista do cliente que o servidor também aceita (None = sem compressão)."""
+    if not isinstance(pedidos, list):
+        return None
+    habilitados = set(habilitados)
+    return next((a for a in pedidos if isinstance(a, str) and a in FLAGS and a in habilitados), None)
+
+
+def comprime(dados: Buffer, algoritmo: str, nivel: int = COMPRESSAO_NIVEL) -> bytes:
+    if algoritmo == "zlib":
+        return zlib.compress(dados, max(1, min(nivel, 9)))
+    if algoritmo == "lzma":
+        return lzma.compress(dados, preset=max(0, min(nivel, 9)))
+    raise ValueError(f"algoritmo de compressão desconhecido: {algoritmo!r}")
+
+
+def descomprime(corpo: Buffer, flags: int, max_bytes: int = MAX_FRAME_BYTES) -> bytes:
+    """Descomprime limitando a saída a `max_bytes` (protege contra frames-bomba)."""
+    try:
+        if flags == FLAG_ZLIB:
+            d = zlib.decompressobj()
+            saida = d.decompress(corpo, max_bytes + 1)
+            estourou = len(saida) > max_bytes or bool(d.unconsumed_tail)
+        elif flags == FLAG_LZMA:
+            d = lzma.LZMADecompressor()
+            saida = d.decompress(corpo, max_length=max_bytes + 1)
+            estourou = len(saida) > max_bytes or not d.eof
+        else:
+            raise FrameInvalido(f"flags de frame desconhecidas: {flags:#x}")
+    except (zlib.error, lzma.LZMAError) as e:
+        raise FrameInvalido(f"corpo comprimido inválido: {e}") from e
+    if estourou:
+        raise FrameGrandeDemais(f"frame descomprimido excede o máximo de {max_bytes}")
+    return saida
+
+
+def recomprime_frame(
+    dados: bytes,
+    algoritmo: Optional[str],
+    limiar: int = COMPRESSAO_LIMIAR_BYTES,
+    nivel: int = COMPRESSAO_NIVEL,
+) -> bytes:
+    """
+    Recebe um frame pronto (sem flags) e devolve a versão comprimida, se valer a pena:
+    algoritmo negociado, corpo >= `limiar` e resultado menor que o original.
+    """
+    corpo = memoryview(dados)[TAMANHO_HEADER:]
+    if algoritmo is None or len(corpo) < limiar:
+        return dados
+    comprimido = comprime(corpo, algoritmo, nivel)
+    if len(comprimido) >= len(corpo):
+        return dados
+    return frame(comprimido, FLAGS[algoritmo])
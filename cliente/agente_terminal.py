@@ -1,7 +1,10 @@
 import sys
-from typing import Any, Dict, List
+import time
+from typing import Any, Dict, List, Optional
 
+from center_car.config import REPLICA_LOCAL
 from cliente.cliente_mcp import envia_filtros
+from cliente.replica_local import ReplicaLocal
 
 # Mensagens e constantes
 WELCOME_BANNER: str = "=== CenterCar ===\n"
@@ -26,7 +29,9 @@ FINAL_PROMPT_AGAIN: str = "Deseja fazer outra consulta com a gente? Vai ser rapi
 NO_MATCH_MSG: str = "\n😞 Desculpe, não encontrei nenhum veículo com esses critérios, " "vamos procurar mais?\n"
 FOUND_MSG_TEMPLATE: str = "\n👍 Encontrei {count} veículo(s) compatível(eis):\n"
 EMPTY_LIST_MSG: str = "\nNenhum veículo cadastrado.\n"
+READY_MSG_TEMPLATE: str = "⏱️  Pronto para a primeira pergunta em {ms:.0f} ms"
 FULL_LIST_MSG_TEMPLATE: str = "\nListagem completa: {count} veículo(s) no sistema:\n"
+RESOLVED_MSG_TEMPLATE: str = "\n🔎 Não encontrei {digitado}; mostrando resultados para {resolvido}."
 
 # Normalização “humanizada” de combustível (aceita variações do usuário)
 FUEL_MAP = {
@@ -105,6 +110,35 @@ def coletar_criterios() -> Dict[str, Any]:
     return filtros
 
 
+def buscar(
+    filtros: Dict[str, Any],
+    replica: Optional[ReplicaLocal],
+    fuzzy: bool = False,
+    resolvido: Optional[Dict[str, str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Busca na réplica local, se ela existir e já tiver sincronizado (responde
+    mesmo com o servidor fora do ar); senão, no servidor. Com `fuzzy`, marca e
+    modelo corrigidos vão para `resolvido`.
+    """
+    if replica is not None and replica.pronta:
+        return replica.busca(filtros, fuzzy=fuzzy, resolvido=resolvido)
+    return envia_filtros(filtros, fuzzy=True, resolvido=resolvido) if fuzzy else envia_filtros(filtros)
+
+
+def exibir_resolvido(filtros: Dict[str, Any], resolvido: Dict[str, str]) -> None:
+    """
+    Avisa quando a busca corrigiu marca/modelo digitados, para o usuário
+    saber que os resultados não são do que ele escreveu.
+    """
+    if not resolvido:
+        return
+    campos = [c for c in ("marca", "modelo") if c in resolvido]
+    digitado = " ".join(f'"{filtros.get(c)}"' for c in campos)
+    corrigido = " ".join(f'"{resolvido[c]}"' for c in campos)
+    print(RESOLVED_MSG_TEMPLATE.format(digitado=digitado, resolvido=corrigido))
+
+
 def exibir_resultados(veiculos: List[Dict[str, Any]]) -> None:
     """
     Exibe lista de veículos compatíveis com os critérios.
@@ -141,19 +175,28 @@ def exibir_listagem_completa(veiculos: List[Dict[str, Any]]) -> None:
     print()
 
 
-def main() -> None:
+def main(inicio: Optional[float] = None) -> None:
     """
     Loop principal do agente no terminal.
+    `inicio` (time.perf_counter() da subida do processo), se dado, faz o agente
+    mostrar quanto tempo levou até a primeira pergunta.
     """
     print(WELCOME_BANNER)
+    # a réplica sincroniza em segundo plano enquanto o usuário responde às perguntas
+    replica = ReplicaLocal().inicia() if REPLICA_LOCAL else None
+    if inicio is not None:
+        print(READY_MSG_TEMPLATE.format(ms=(time.perf_counter() - inicio) * 1000))
     while True:
         filtros = coletar_criterios()
         print("\nBuscando veículos...")
-        veiculos = envia_filtros(filtros)
+        # fuzzy: corrige erros de digitação em marca/modelo (e avisa o que trocou)
+        resolvido: Dict[str, str] = {}
+        veiculos = buscar(filtros, replica, fuzzy=True, resolvido=resolvido)
+        exibir_resolvido(filtros, resolvido)
         exibir_resultados(veiculos)
 
         if pergunta_simples(FINAL_PROMPT_LIST_ALL):
-            todos = envia_filtros({})
+            todos = buscar({}, replica)
             exibir_listagem_completa(todos)
 
         if not pergunta_simples(FINAL_PROMPT_AGAIN):
@@ -1,88 +1,254 @@
-import json
 import socket
-from typing import Any, Dict, List, Union
+import time
+from typing import Any, Dict, Iterator, List, Optional, Union
 
-from center_car.config import HOST, PORTA
+from center_car.config import API_KEY, COMPRESSAO_CLIENTE, HOST, PORTA, PRAZO_PADRAO_MS
+from center_car.protocolo import FrameInvalido, codifica, decodifica, le_frame
 
-BUFFER_SIZE: int = 64 * 1024  # 64 KiB para recv
 ENVELOPE_TOOL = "search_cars"
-
-
-def envia_filtros(filtros: Dict[str, Any]) -> List[Any]:
+SUBSCRIBE_TOOL = "subscribe_cars"
+IDS_TOOL = "get_cars_by_ids"
+UPSERT_TOOL = "upsert_cars"
+PRECOS_TOOL = "update_prices"
+# get_cars_by_ids aceita até 1000 ids por chamada; upsert_cars/update_prices, até 1000 itens
+LOTE_IDS: int = 1000
+LOTE_ESCRITA: int = 1000
+# o servidor manda heartbeat a cada 15 s; acima disso consideramos a conexão morta
+TIMEOUT_SUBSCRICAO: float = 45.0
+# folga (s) do timeout do socket sobre o prazo pedido ao servidor: rede, encode e envio da resposta
+MARGEM_PRAZO: float = 2.0
+# RATE_LIMITED: quantas vezes repetir a mesma página e espera máx. (s) aceita do retry_after_ms
+MAX_RETENTATIVAS: int = 3
+ESPERA_MAX_RETENTATIVA: float = 2.0
+
+
+class AssinaturaRecusada(Exception):
+    """O servidor respondeu ao subscribe_cars com erro (ex.: INVALID_REQUEST, servidor com shards)."""
+
+    def __init__(self, code: str, message: str) -> None:
+        super().__init__(f"{code}: {message}")
+        self.code = code
+
+
+def envia_filtros(
+    filtros: Dict[str, Any],
+    prazo_ms: Optional[int] = None,
+    fuzzy: bool = False,
+    resolvido: Optional[Dict[str, str]] = None,
+) -> List[Any]:
     """
     Envia filtros ao servidor no envelope MCP:
         {"tool": "search_cars", "args": {...}}
     Espera resposta MCP:
         {"ok": true, "result": [...]}
+    Se a resposta vier truncada pelo limite do servidor
+    ({"truncado": true, "cursor": N}), pede as páginas seguintes com
+    "cursor" e devolve tudo junto.
+    `prazo_ms` (opcional) pede ao servidor que aborte a consulta após esse tempo.
+    `fuzzy` pede ao servidor que corrija marca/modelo digitados com erro;
+    o que ele trocou ({"marca": "Volkswagen"}) é copiado para `resolvido`, se dado.
+    Anuncia os algoritmos de COMPRESSAO_CLIENTE; respostas comprimidas são
+    descomprimidas de forma transparente pelo le_frame.
+    Em RATE_LIMITED, espera o retry_after_ms indicado e tenta de novo (até MAX_RETENTATIVAS).
     Fallback: se vier uma lista (modo legado), retorna a lista.
-    Em qualquer erro, retorna [].
+    Em qualquer erro, retorna [] — tudo ou nada: se uma página falhar, as já
+    recebidas são descartadas, para o chamador nunca tomar uma lista parcial
+    pela resposta completa.
+    """
+    base = {**filtros, "fuzzy": True} if fuzzy else dict(filtros)
+    args = base
+    veiculos: List[Any] = []
+    retentativas = 0
+
+    while True:
+        envelope: Dict[str, Any] = {"tool": ENVELOPE_TOOL, "args": args}
+        if prazo_ms is not None:
+            envelope["prazo_ms"] = prazo_ms
+        if COMPRESSAO_CLIENTE:
+            envelope["compressao"] = COMPRESSAO_CLIENTE
+        if API_KEY:
+            envelope["api_key"] = API_KEY
+        data = _chama(envelope)
+
+        # Contrato MCP
+        if isinstance(data, dict):
+            espera = _espera_rate_limit(data)
+            if espera is not None and retentativas < MAX_RETENTATIVAS:
+                retentativas += 1
+                time.sleep(espera)
+                continue
+            if data.get("ok") is not True:
+                # ok:false ou inesperado
+                return []
+            result = data.get("result", [])
+            if not isinstance(result, list):
+                return []
+            veiculos.extend(result)
+            if resolvido is not None and isinstance(data.get("resolvido"), dict):
+                resolvido.update(data["resolvido"])
+
+            cursor = data.get("cursor")
+            if data.get("truncado") is True and isinstance(cursor, int):
+                args = {**base, "cursor": cursor}
+                continue
+            return veiculos
+
+        # Modo legado (lista direta)
+        if isinstance(data, list):
+            return data
+
+        return []
+
+
+def busca_por_ids(ids: List[int]) -> List[Any]:
     """
-    envelope = {"tool": ENVELOPE_TOOL, "args": filtros}
-    payload = json.dumps(envelope).encode("utf-8")
-    header = len(payload).to_bytes(4, "big")
+    Atualiza veículos já conhecidos (favoritos, carrinho) pelo id, via
+    {"tool": "get_cars_by_ids", "args": {"ids": [...]}}, em lotes de LOTE_IDS.
+    Devolve os que ainda existem, na ordem pedida. Em qualquer erro, retorna [].
+    """
+    veiculos: List[Any] = []
+    for k in range(0, len(ids), LOTE_IDS):
+        envelope: Dict[str, Any] = {"tool": IDS_TOOL, "args": {"ids": ids[k : k + LOTE_IDS]}}
+        if COMPRESSAO_CLIENTE:
+            envelope["compressao"] = COMPRESSAO_CLIENTE
+        if API_KEY:
+            envelope["api_key"] = API_KEY
+        for _ in range(MAX_RETENTATIVAS + 1):
+            data = _chama(envelope)
+            espera = _espera_rate_limit(data) if isinstance(data, dict) else None
+            if espera is None:
+                break
+            time.sleep(espera)
+        if not isinstance(data, dict) or data.get("ok") is not True or not isinstance(data.get("result"), list):
+            return []
+        veiculos.extend(data["result"])
+    return veiculos
+
+
+def grava_veiculos(itens: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Insere/atualiza veículos via {"tool": "upsert_cars", "args": {"itens": [...]}}:
+    item sem "id" é inserido (todos os campos); com "id", atualiza os campos enviados.
+    Devolve um ack por item, na ordem: {"id": ..., "status": "inserido" | "atualizado" |
+    "nao_encontrado" | "invalido", "erro"?}. Ver `_escreve` para falhas.
+    """
+    return _escreve(UPSERT_TOOL, itens)
+
+
+def atualiza_precos(precos: Dict[int, float]) -> List[Dict[str, Any]]:
+    """Troca o preço de cada id via update_prices; acks como em `grava_veiculos`."""
+    return _escreve(PRECOS_TOOL, [{"id": id_, "preco": preco} for id_, preco in precos.items()])
+
 
+def _escreve(tool: str, itens: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Envia os itens em lotes de LOTE_ESCRITA e junta os acks. Em RATE_LIMITED
+    espera e repete (nada foi gravado). Qualquer outro erro para o envio ali:
+    devolve só os acks recebidos até então — item sem ack não foi confirmado.
+    """
+    acks: List[Dict[str, Any]] = []
+    for k in range(0, len(itens), LOTE_ESCRITA):
+        envelope: Dict[str, Any] = {"tool": tool, "args": {"itens": itens[k : k + LOTE_ESCRITA]}}
+        if API_KEY:
+            envelope["api_key"] = API_KEY
+        for _ in range(MAX_RETENTATIVAS + 1):
+            data = _chama(envelope)
+            espera = _espera_rate_limit(data) if isinstance(data, dict) else None
+            if espera is None:
+                break
+            time.sleep(espera)
+        if not isinstance(data, dict) or data.get("ok") is not True or not isinstance(data.get("result"), list):
+            return acks
+        acks.extend(data["result"])
+    return acks
+
+
+def _espera_rate_limit(data: Dict[str, Any]) -> Optional[float]:
+    """Segundos a esperar se a resposta for RATE_LIMITED (None caso contrário)."""
+    erro = data.get("error")
+    if data.get("ok") is not False or not isinstance(erro, dict) or erro.get("code") != "RATE_LIMITED":
+        return None
+    retry_ms = erro.get("retry_after_ms")
+    if not isinstance(retry_ms, (int, float)) or retry_ms < 0:
+        retry_ms = 100
+    return min(retry_ms / 1000, ESPERA_MAX_RETENTATIVA)
+
+
+def _chama(envelope: Dict[str, Any]) -> Any:
+    """
+    Uma ida e volta com o servidor; devolve o JSON decodificado ou None em qualquer erro.
+    Espera pelo prazo enviado (o do servidor, sem "prazo_ms") mais MARGEM_PRAZO: desistir
+    antes jogaria fora uma resposta que o servidor ainda ia mandar dentro do prazo.
+    """
+    prazo_ms = envelope.get("prazo_ms", PRAZO_PADRAO_MS)
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             # tolera FakeSocket do teste (que pode não ter settimeout)
             try:
-                sock.settimeout(3.0)
+                sock.settimeout(prazo_ms / 1000 + MARGEM_PRAZO)
             except Exception:
                 pass
 
             try:
                 sock.connect((HOST, PORTA))
             except ConnectionRefusedError:
-                return []
+                return None
 
             # envia header + payload
-            sock.sendall(header + payload)
+            sock.sendall(codifica(envelope))
 
-            # lê header da resposta
-            tamanho_bytes = sock.recv(4)
-            if len(tamanho_bytes) < 4:
-                return []
+            # lê header + corpo completo direto num buffer do tamanho anunciado
+            recebido = le_frame(sock)
+            if not recebido:
+                return None
 
-            tamanho = int.from_bytes(tamanho_bytes, "big")
-            if tamanho <= 0:
-                return []
-
-            # lê corpo completo
-            recebido = _recv_all(sock, tamanho)
-
-        data = _parse_json(recebido)
-
-        # Contrato MCP
-        if isinstance(data, dict):
-            if data.get("ok") is True:
-                result = data.get("result", [])
-                return result if isinstance(result, list) else []
-            # ok:false ou inesperado
-            return []
-
-        # Modo legado (lista direta)
-        if isinstance(data, list):
-            return data
-
-        return []
+        return _parse_json(recebido)
     except Exception:
-        return []
+        return None
+
 
+def assina_alteracoes(desde: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Abre uma conexão persistente com `subscribe_cars` e devolve cada frame
+    recebido: {"ok": true, "result": [deltas...], "seq": N}.
+
+    Sem `desde`, o servidor começa com um snapshot completo (frames com
+    "seq": null até o último; o primeiro traz "reinicio": true). Para retomar
+    após cair, chame de novo com o último `seq` não nulo recebido; se ele já
+    saiu do log do servidor, vem um snapshot completo de novo (com "reinicio").
+    O gerador termina quando a conexão cai; se o servidor recusar a assinatura
+    com um erro MCP, levanta AssinaturaRecusada (com o `code` do erro).
+    """
+    args: Dict[str, Any] = {} if desde is None else {"desde": desde}
+    envelope: Dict[str, Any] = {"tool": SUBSCRIBE_TOOL, "args": args}
+    if COMPRESSAO_CLIENTE:
+        envelope["compressao"] = COMPRESSAO_CLIENTE
+    if API_KEY:
+        envelope["api_key"] = API_KEY
 
-def _recv_all(sock: socket.socket, total_bytes: int) -> bytes:
-    chunks: List[bytes] = []
-    bytes_lidos = 0
-    while bytes_lidos < total_bytes:
-        to_read = min(BUFFER_SIZE, total_bytes - bytes_lidos)
-        parte = sock.recv(to_read)
-        if not parte:
-            break
-        chunks.append(parte)
-        bytes_lidos += len(parte)
-    return b"".join(chunks)
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.settimeout(TIMEOUT_SUBSCRICAO)
+            sock.connect((HOST, PORTA))
+            sock.sendall(codifica(envelope))
+
+            while True:
+                recebido = le_frame(sock)
+                if recebido is None:
+                    return
+                data = _parse_json(recebido)
+                if isinstance(data, dict) and data.get("ok") is False and isinstance(data.get("error"), dict):
+                    erro = data["error"]
+                    raise AssinaturaRecusada(str(erro.get("code")), str(erro.get("message", "")))
+                if not isinstance(data, dict) or data.get("ok") is not True:
+                    return
+                yield data
+    except (OSError, FrameInvalido):
+        return
 
 
 def _parse_json(data: bytes) -> Union[Dict[str, Any], List[Any], Any]:
     try:
-        return json.loads(data.decode("utf-8"))
-    except json.JSONDecodeError:
+        return decodifica(data)
+    except ValueError:
         return []
@@ -0,0 +1,284 @@
+# cliente/replica_local.py
+"""
+Réplica local do inventário para o agente de terminal.
+
+O inventário inteiro cabe com folga na memória do cliente: em vez de uma ida
+e volta por busca, a réplica baixa tudo uma vez pelo `subscribe_cars` (o
+snapshot inicial, comprimido se o servidor negociar) e fica na mesma conexão
+recebendo os deltas do log de alterações. Se a conexão cair, reconecta com
+`desde` = último `seq` aplicado — só o que mudou no meio vem de novo.
+
+As linhas ficam num SQLite em memória (sqlite3 da stdlib) e `filtros_sql`
+traduz os filtros com o mesmo SQL que o `aplicar_filtros` do servidor gera:
+igualdade exata em marca, combustível, transmissão, cor e portas, faixas
+inclusivas em ano, preço e quilometragem e `lower(modelo) LIKE lower('%x%')`
+para o modelo — resultado em ordem de id, como o search_cars. Varrer 50 mil
+dicts em Python custava ~130 ms por busca; no SQLite, de ~6 a ~30 ms.
+
+O snapshot inicial é montado num banco à parte e troca de lugar no último
+frame (o único com `seq`); os deltas seguintes são aplicados numa transação
+por frame. Se a réplica ficou fora mais tempo do que o servidor guarda de log,
+ele responde à retomada com um snapshot novo ("reinicio"), montado à parte do
+mesmo jeito. Servidor lento ou fora do ar não trava a busca: ela usa o que já
+foi sincronizado. Só antes do primeiro snapshot completo a réplica não está
+`pronta` — quem usa cai para a busca pela rede. Se o servidor recusar a
+assinatura de vez (com shards não há `subscribe_cars`), a réplica desiste com
+um aviso e nunca fica pronta.
+
+Para a correção fuzzy, a réplica conta quantas linhas têm cada marca e cada
+modelo enquanto aplica os deltas: os índices de n-gramas só são refeitos
+(dessas contagens, sem varrer a tabela) quando um valor aparece ou some.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import cliente.cliente_mcp as cliente_mcp
+from center_car.indice_ngramas import CAMPOS_FUZZY, IndiceNgramas
+
+logger = logging.getLogger("centercar.replica_local")
+
+CAMPOS: Tuple[str, ...] = (
+    "id",
+    "marca",
+    "modelo",
+    "ano",
+    "tipo_combustivel",
+    "cor",
+    "quilometragem",
+    "numero_portas",
+    "transmissao",
+    "preco",
+)
+
+_DDL = (
+    "CREATE TABLE veiculos (id INTEGER PRIMARY KEY, marca TEXT, modelo TEXT, ano INTEGER, tipo_combustivel TEXT,"
+    " cor TEXT, quilometragem REAL, numero_portas INTEGER, transmissao TEXT, preco REAL)",
+    "CREATE INDEX ix_veiculos_marca ON veiculos (marca)",
+)
+_SQL_GRAVA = f"INSERT OR REPLACE INTO veiculos VALUES ({', '.join('?' * len(CAMPOS))})"
+_SQL_APAGA = "DELETE FROM veiculos WHERE id = ?"
+_SQL_MARCA_MODELO = "SELECT marca, modelo FROM veiculos WHERE id = ?"
+
+# filtro -> condição, na ordem do aplicar_filtros do servidor
+_CONDICOES: Tuple[Tuple[str, str], ...] = (
+    ("marca", "marca = ?"),
+    ("modelo", "lower(modelo) LIKE lower(?)"),
+    ("ano_min", "ano >= ?"),
+    ("ano_max", "ano <= ?"),
+    ("tipo_combustivel", "tipo_combustivel = ?"),
+    ("preco_min", "preco >= ?"),
+    ("preco_max", "preco <= ?"),
+    ("quilometragem_max", "quilometragem <= ?"),
+    ("numero_portas", "numero_portas = ?"),
+    ("transmissao", "transmissao = ?"),
+    ("cor", "cor = ?"),
+    ("cursor", "id > ?"),
+)
+
+# espera entre reconexões do subscribe_cars (s): dobra a cada tentativa sem frame, até o máximo
+ESPERA_RECONEXAO: float = 0.5
+ESPERA_RECONEXAO_MAX: float = 30.0
+# erros do subscribe_cars que tentar de novo não resolve: a réplica desiste e o agente segue pela rede
+ERROS_PERMANENTES = frozenset({"INVALID_REQUEST", "UNKNOWN_TOOL", "FORBIDDEN"})
+
+# campo fuzzy -> valor -> quantas linhas da réplica têm esse valor
+Contagens = Dict[str, Dict[str, int]]
+
+
+def filtros_sql(filtros: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """(SELECT em ordem de id, parâmetros) equivalente ao aplicar_filtros com os mesmos filtros."""
+    condicoes: List[str] = []
+    params: List[Any] = []
+    for chave, condicao in _CONDICOES:
+        if chave in filtros:
+            condicoes.append(condicao)
+            params.append(f"%{filtros[chave]}%" if chave == "modelo" else filtros[chave])
+    where = f" WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    return f"SELECT {', '.join(CAMPOS)} FROM veiculos{where} ORDER BY id", params
+
+
+def _novas_contagens() -> Contagens:
+    return {campo: {} for campo in CAMPOS_FUZZY}
+
+
+def _novo_banco() -> sqlite3.Connection:
+    # usado pela thread de sincronização e por quem busca, sempre sob a trava da réplica
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    for ddl in _DDL:
+        conn.execute(ddl)
+    return conn
+
+
+class ReplicaLocal:
+    """
+    Inventário sincronizado pelo `subscribe_cars`. `inicia()` sobe a thread de
+    sincronização; `busca(filtros)` responde da memória assim que `pronta`.
+    """
+
+    def __init__(self, espera_reconexao: float = ESPERA_RECONEXAO) -> None:
+        self.espera_reconexao = espera_reconexao
+        self._trava = threading.Lock()
+        self._banco = _novo_banco()
+        self._contagens = _novas_contagens()
+        # índices de marca/modelo; None = um valor apareceu ou sumiu, refazer na próxima busca fuzzy
+        self._fuzzy: Optional[Dict[str, IndiceNgramas]] = None
+        self._pronta = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # último seq aplicado (None até o fim do primeiro snapshot) e se a assinatura está de pé agora
+        self.seq: Optional[int] = None
+        self.conectada = False
+
+    @property
+    def pronta(self) -> bool:
+        return self._pronta.is_set()
+
+    def __len__(self) -> int:
+        with self._trava:
+            return self._banco.execute("SELECT count(*) FROM veiculos").fetchone()[0]
+
+    def inicia(self) -> "ReplicaLocal":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sincroniza_sempre, name="centercar-replica", daemon=True)
+            self._thread.start()
+        return self
+
+    def espera_pronta(self, timeout: Optional[float] = None) -> bool:
+        return self._pronta.wait(timeout)
+
+    def busca(
+        self, filtros: Dict[str, Any], fuzzy: bool = False, resolvido: Optional[Dict[str, str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Como o `envia_filtros`, mas da memória: todos os veículos que passam nos
+        filtros, em ordem de id. Com `fuzzy`, o que foi trocado vai para `resolvido`.
+        """
+        if fuzzy:
+            filtros = dict(filtros)
+            trocados = self._resolve_fuzzy(filtros)
+            if resolvido is not None:
+                resolvido.update(trocados)
+        sql, params = filtros_sql(filtros)
+        with self._trava:
+            linhas = self._banco.execute(sql, params).fetchall()
+        return [dict(zip(CAMPOS, linha)) for linha in linhas]
+
+    # ---- sincronização ----
+
+    def _sincroniza_sempre(self) -> None:
+        espera = self.espera_reconexao
+        while True:
+            try:
+                if self._assina():
+                    espera = self.espera_reconexao
+            except cliente_mcp.AssinaturaRecusada as e:
+                if e.code in ERROS_PERMANENTES:
+                    self.conectada = False
+                    logger.warning("réplica local desligada, as buscas seguem pela rede: servidor recusou (%s)", e)
+                    return
+                logger.info("subscribe_cars recusado (%s); tentando de novo", e)
+            except Exception:
+                logger.exception("falha sincronizando a réplica local")
+            self.conectada = False
+            time.sleep(espera)
+            espera = min(espera * 2, ESPERA_RECONEXAO_MAX)
+
+    def _assina(self) -> bool:
+        """Uma assinatura, até a conexão cair. True se chegou algum frame."""
+        # sem réplica pronta, (re)começa pelo snapshot completo, montado à parte (com as contagens dele)
+        novo: Optional[sqlite3.Connection] = None if self.pronta else _novo_banco()
+        novas = _novas_contagens()
+        recebeu = False
+        # lido na hora da chamada, como o obter_sessao do servidor: os testes trocam a função do módulo
+        for frame in cliente_mcp.assina_alteracoes(self.seq if novo is None else None):
+            self.conectada = recebeu = True
+            seq = frame.get("seq")
+            if frame.get("reinicio") is True and novo is None:
+                # `desde` já saiu do log do servidor: a cópia inteira vem de novo
+                novo, novas = _novo_banco(), _novas_contagens()
+            if novo is not None:
+                _aplica(novo, frame.get("result", []), novas)
+                if seq is None:
+                    continue
+                with self._trava:
+                    antigo, self._banco = self._banco, novo
+                    self._contagens, self._fuzzy = novas, None
+                antigo.close()
+                novo = None
+            else:
+                with self._trava:
+                    if _aplica(self._banco, frame.get("result", []), self._contagens):
+                        self._fuzzy = None
+            if seq is not None:
+                self.seq = seq
+                self._pronta.set()
+        return recebeu
+
+    # ---- fuzzy ----
+
+    def _resolve_fuzzy(self, filtros: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Mesma regra do servidor: troca marca/modelo pelo melhor candidato; modelo
+        contido em algum valor fica. Devolve só o que foi trocado, como o "resolvido".
+        """
+        indices = self._indices_fuzzy()
+        resolvido: Dict[str, str] = {}
+        for campo in CAMPOS_FUZZY:
+            termo = filtros.get(campo)
+            if not isinstance(termo, str):
+                continue
+            if campo == "modelo" and indices[campo].contem(termo):
+                continue
+            melhores = indices[campo].candidatos(termo, 1)
+            if melhores and melhores[0][0] != termo:
+                filtros[campo] = resolvido[campo] = melhores[0][0]
+        return resolvido
+
+    def _indices_fuzzy(self) -> Dict[str, IndiceNgramas]:
+        """Índices de marca/modelo da réplica, refeitos das contagens só quando um valor apareceu ou sumiu."""
+        with self._trava:
+            if self._fuzzy is None:
+                # poucas centenas de valores distintos: rápido o bastante para fazer sob a trava
+                self._fuzzy = {campo: IndiceNgramas(list(self._contagens[campo])) for campo in CAMPOS_FUZZY}
+            return self._fuzzy
+
+
+def _aplica(banco: sqlite3.Connection, deltas: List[Dict[str, Any]], contagens: Contagens) -> bool:
+    """
+    Aplica os deltas de um frame numa transação, mantendo `contagens` em dia.
+    Devolve True se alguma marca/modelo apareceu ou sumiu da réplica.
+    """
+    mudou = False
+    with banco:
+        for delta in deltas:
+            antigo = banco.execute(_SQL_MARCA_MODELO, (delta["id"],)).fetchone()
+            novo: Optional[Tuple[Any, ...]] = None
+            if delta.get("op") == "delete":
+                banco.execute(_SQL_APAGA, (delta["id"],))
+            else:
+                veiculo = delta["veiculo"]
+                banco.execute(_SQL_GRAVA, [veiculo.get(c) for c in CAMPOS])
+                novo = tuple(veiculo.get(c) for c in CAMPOS_FUZZY)
+            if antigo == novo:
+                continue  # update que não mexeu em marca/modelo (preço, km...)
+            if antigo is not None:
+                mudou |= _conta(contagens, antigo, -1)
+            if novo is not None:
+                mudou |= _conta(contagens, novo, 1)
+    return mudou
+
+
+def _conta(contagens: Contagens, valores: Tuple[Any, ...], passo: int) -> bool:
+    """Soma `passo` à contagem de cada valor (na ordem de CAMPOS_FUZZY); True se algum passou a existir ou sumiu."""
+    mudou = False
+    for campo, valor in zip(CAMPOS_FUZZY, valores):
+        n = contagens[campo].get(valor, 0) + passo
+        if n > 0:
+            contagens[campo][valor] = n
+        else:
+            contagens[campo].pop(valor, None)
+        mudou |= n == 0 or n == passo
+    return mudou
@@ -1,14 +1,29 @@
 # principal.py
 
 import argparse
+import sys
 import threading
 import time
 
-from cliente.agente_terminal import main as iniciar_agente
-from servidor.servidor_mcp import iniciar_servidor
+# Tempo máximo (s) aguardando o servidor sinalizar que está escutando no modo --tudo
+TEMPO_MAX_PRONTIDAO: float = 10.0
+
+
+def _aguarda_servidor(thread: threading.Thread, pronto: threading.Event) -> bool:
+    """
+    Espera o servidor sinalizar prontidão. Desiste cedo se a thread morrer
+    (ex.: porta ocupada) ou se estourar `TEMPO_MAX_PRONTIDAO`.
+    """
+    limite = time.perf_counter() + TEMPO_MAX_PRONTIDAO
+    while not pronto.wait(0.01):
+        if not thread.is_alive() or time.perf_counter() > limite:
+            return False
+    return True
 
 
 def main():
+    inicio = time.perf_counter()
+
     parser = argparse.ArgumentParser(description="CenterCar: servidor e/ou agente de terminal MCP")
     parser.add_argument("--servidor", action="store_true", help="Inicia apenas o servidor MCP")
     parser.add_argument("--cliente", action="store_true", help="Inicia apenas o agente de terminal")
@@ -16,19 +31,31 @@ def main():
 
     args = parser.parse_args()
 
+    # Imports tardios: cada modo carrega só o que usa (o agente não precisa do SQLAlchemy)
     if args.servidor:
+        from servidor.servidor_mcp import iniciar_servidor
+
         iniciar_servidor()
 
     elif args.cliente:
-        iniciar_agente()
+        from cliente.agente_terminal import main as iniciar_agente
+
+        iniciar_agente(inicio)
 
     elif args.tudo:
-        # sobe servidor em thread
-        t = threading.Thread(target=iniciar_servidor, daemon=True)
+        from cliente.agente_terminal import main as iniciar_agente
+        from servidor.servidor_mcp import iniciar_servidor
+
+        # sobe servidor em thread e espera o sinal de "socket escutando"
+        pronto = threading.Event()
+        t = threading.Thread(target=iniciar_servidor, kwargs={"pronto": pronto}, daemon=True)
         t.start()
-        # dá uma pausa rápida pra garantir que o servidor esteja aceitando conexões
-        time.sleep(1)
-        iniciar_agente()
+        if not _aguarda_servidor(t, pronto):
+            print("❌ Servidor MCP não ficou pronto a tempo; verifique host/porta.", file=sys.stderr)
+            sys.exit(1)
+
+        # o agente mede até a primeira pergunta; o servidor aquece em segundo plano
+        iniciar_agente(inicio)
 
     else:
         parser.print_help()
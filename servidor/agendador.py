@@ -0,0 +1,162 @@
+# servidor/agendador.py
+"""
+Justiça entre clientes: limite de taxa por cliente + fila justa para o pool de workers.
+
+- `LimitadorTaxa`: um token bucket por cliente (endereço IP ou "api_key"
+  conhecida do envelope). Sem token, a requisição é recusada na hora com o tempo até o
+  próximo token (vira RATE_LIMITED + retry_after_ms).
+- `AgendadorJusto`: as consultas vão para um pool fixo de workers, com uma
+  fila FIFO por cliente servida em round-robin — cada cliente com trabalho
+  pendente leva uma vez por rodada. Um job em lote com 50 consultas
+  enfileiradas não atrasa a consulta de um agente interativo em mais que uma
+  consulta por worker.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+
+class BaldeTokens:
+    """Token bucket: `taxa` tokens/s, acumulando no máximo `capacidade`."""
+
+    __slots__ = ("taxa", "capacidade", "tokens", "ultimo")
+
+    def __init__(self, taxa: float, capacidade: float, agora: float) -> None:
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = capacidade
+        self.ultimo = agora
+
+    def consome(self, agora: float) -> float:
+        """Gasta um token; devolve 0 se conseguiu ou os segundos até haver um token."""
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.ultimo) * self.taxa)
+        self.ultimo = agora
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.taxa
+
+
+class LimitadorTaxa:
+    """
+    Um BaldeTokens por cliente. `taxa` <= 0 desliga o limite.
+    Guarda no máximo `max_clientes` baldes (LRU): cliente sumido há muito tempo
+    volta com o balde cheio, o que é o mesmo que ele teria de qualquer forma.
+    """
+
+    def __init__(
+        self,
+        taxa: float,
+        rajada: float,
+        max_clientes: int = 10_000,
+        relogio: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.taxa = taxa
+        self.rajada = max(rajada, 1.0)
+        self.max_clientes = max_clientes
+        self._relogio = relogio
+        self._trava = threading.Lock()
+        self._baldes: "OrderedDict[str, BaldeTokens]" = OrderedDict()
+
+    def verifica(self, cliente: str) -> float:
+        """0 se a requisição pode seguir; senão, segundos até o cliente poder tentar de novo."""
+        if self.taxa <= 0:
+            return 0.0
+        agora = self._relogio()
+        with self._trava:
+            balde = self._baldes.get(cliente)
+            if balde is None:
+                balde = self._baldes[cliente] = BaldeTokens(self.taxa, self.rajada, agora)
+                if len(self._baldes) > self.max_clientes:
+                    self._baldes.popitem(last=False)
+            else:
+                self._baldes.move_to_end(cliente)
+            return balde.consome(agora)
+
+
+class _Tarefa:
+    __slots__ = ("fn", "pronto", "valor", "erro", "cancelada")
+
+    def __init__(self, fn: Callable[[], Any]) -> None:
+        self.fn = fn
+        self.pronto = threading.Event()
+        self.valor: Any = None
+        self.erro: Optional[BaseException] = None
+        self.cancelada = False
+
+
+class AgendadorJusto:
+    """
+    Pool de `n_workers` threads com uma fila por cliente, servidas em round-robin.
+    `n_workers` <= 0 executa direto na thread de quem chama (sem pool).
+    """
+
+    def __init__(self, n_workers: int) -> None:
+        self.n_workers = n_workers
+        self._cond = threading.Condition()
+        self._filas: Dict[str, Deque[_Tarefa]] = {}
+        self._vez: Deque[str] = deque()  # clientes com trabalho pendente, na ordem da rodada
+        self._workers: List[threading.Thread] = []
+
+    def pendentes(self) -> Dict[str, int]:
+        """Tamanho da fila de cada cliente com trabalho pendente (para server_stats)."""
+        with self._cond:
+            return {cliente: len(fila) for cliente, fila in self._filas.items()}
+
+    def executa(self, cliente: str, fn: Callable[[], Any], espera_max: Optional[float] = None) -> Any:
+        """
+        Enfileira `fn` na fila de `cliente` e espera o resultado (ou a exceção de `fn`).
+        Passado `espera_max` sem resultado, a tarefa é cancelada (se ainda não começou) e sobe TimeoutError.
+        """
+        if self.n_workers <= 0:
+            return fn()
+        tarefa = _Tarefa(fn)
+        with self._cond:
+            self._garante_workers()
+            fila = self._filas.get(cliente)
+            if fila is None:
+                fila = self._filas[cliente] = deque()
+                self._vez.append(cliente)
+            fila.append(tarefa)
+            self._cond.notify()
+
+        if not tarefa.pronto.wait(espera_max):
+            tarefa.cancelada = True
+            raise TimeoutError(f"tarefa de {cliente!r} não terminou a tempo")
+        if tarefa.erro is not None:
+            raise tarefa.erro
+        return tarefa.valor
+
+    def _garante_workers(self) -> None:
+        # chamado sob self._cond: o pool só nasce na primeira tarefa
+        while len(self._workers) < self.n_workers:
+            t = threading.Thread(target=self._trabalha, name=f"centercar-worker-{len(self._workers)}", daemon=True)
+            self._workers.append(t)
+            t.start()
+
+    def _proxima(self) -> _Tarefa:
+        with self._cond:
+            while not self._vez:
+                self._cond.wait()
+            cliente = self._vez.popleft()
+            fila = self._filas[cliente]
+            tarefa = fila.popleft()
+            if fila:
+                self._vez.append(cliente)  # ainda tem trabalho: volta para o fim da rodada
+            else:
+                del self._filas[cliente]
+            return tarefa
+
+    def _trabalha(self) -> None:
+        while True:
+            tarefa = self._proxima()
+            if tarefa.cancelada:
+                continue
+            try:
+                tarefa.valor = tarefa.fn()
+            except BaseException as e:
+                tarefa.erro = e
+            finally:
+                tarefa.pronto.set()
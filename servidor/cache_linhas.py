@@ -0,0 +1,124 @@
+# servidor/cache_linhas.py
+"""
+Cache LRU de linhas por id, para o get_cars_by_ids.
+
+Guarda cada veículo já serializado (o JSON do dict de resposta, em bytes):
+ocupa uns 250 bytes por linha e a resposta é montada juntando os pedaços, sem
+passar de novo pelo json.dumps.
+
+Invalidação pelo log de alterações (`veiculos_alteracoes`), o mesmo do
+subscribe_cars: antes de responder, `sincroniza` confere o último `seq` de
+cada arquivo de dados e descarta os ids escritos desde a última conferência
+— inclusive escritas de outros processos (seed, scripts). Quem escreve no
+próprio processo pode chamar `invalida` direto.
+
+Corrida leitura x escrita: uma linha lida do banco antes de uma escrita pode
+chegar ao cache depois da invalidação correspondente. Por isso `guarda`
+recebe a `geracao` vista antes da leitura e não grava nada se houve
+invalidação no meio.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from center_car.modelo_veiculo import AlteracaoVeiculo
+from servidor.metricas import METRICAS
+
+# acima disso, invalidar id a id custa mais que esvaziar o cache
+MAX_IDS_INVALIDACAO = 10_000
+
+
+class CacheLinhas:
+    """LRU id -> JSON da linha, com no máximo `capacidade` linhas (0 desliga)."""
+
+    def __init__(self, capacidade: int) -> None:
+        self.capacidade = capacidade
+        self._trava = threading.Lock()
+        self._linhas: "OrderedDict[int, bytes]" = OrderedDict()
+        self._seqs: Dict[int, int] = {}  # arquivo de dados -> último seq conferido
+        self.geracao = 0
+
+    def __len__(self) -> int:
+        return len(self._linhas)
+
+    def busca(self, ids: Iterable[int]) -> Tuple[Dict[int, bytes], List[int]]:
+        """(achados, faltando): o JSON das linhas em cache e os ids que precisam ir ao banco."""
+        achados: Dict[int, bytes] = {}
+        faltando: List[int] = []
+        with self._trava:
+            for id_ in ids:
+                linha = self._linhas.get(id_)
+                if linha is None:
+                    faltando.append(id_)
+                else:
+                    self._linhas.move_to_end(id_)
+                    achados[id_] = linha
+        METRICAS.evento("cache_linhas_acertos", len(achados))
+        METRICAS.evento("cache_linhas_faltas", len(faltando))
+        return achados, faltando
+
+    def guarda(self, linhas: Dict[int, bytes], geracao: int) -> None:
+        """Guarda linhas lidas do banco — só se não houve invalidação desde `geracao`."""
+        if self.capacidade <= 0:
+            return
+        with self._trava:
+            if geracao != self.geracao:
+                return
+            self._linhas.update(linhas)
+            for id_ in linhas:
+                self._linhas.move_to_end(id_)
+            while len(self._linhas) > self.capacidade:
+                self._linhas.popitem(last=False)
+
+    def invalida(self, ids: Optional[Iterable[int]] = None) -> None:
+        """Descarta os `ids` (todos, se None)."""
+        with self._trava:
+            self.geracao += 1
+            if ids is None:
+                self._linhas.clear()
+                return
+            for id_ in ids:
+                self._linhas.pop(id_, None)
+
+    def sincroniza(self, i: int, sessao) -> int:
+        """
+        Aplica ao cache as escritas registradas no log do arquivo `i` desde a
+        última conferência (lidas por `sessao`). Devolve a geração atual, para o `guarda`.
+        """
+        seq = sessao.query(func.max(AlteracaoVeiculo.seq)).scalar() or 0
+        anterior = self._seqs.get(i)
+        if anterior is None or seq < anterior:
+            # primeira conferência ou log recriado (banco trocado): nada do cache é confiável
+            self.invalida()
+        elif seq > anterior and (sessao.query(func.min(AlteracaoVeiculo.seq)).scalar() or 0) > anterior + 1:
+            # a poda do log já apagou escritas que o cache não conferiu
+            self.invalida()
+        elif seq > anterior:
+            ids = [
+                vid
+                for (vid,) in sessao.query(AlteracaoVeiculo.veiculo_id)
+                .filter(AlteracaoVeiculo.seq > anterior)
+                .limit(MAX_IDS_INVALIDACAO + 1)
+            ]
+            self.invalida(None if len(ids) > MAX_IDS_INVALIDACAO else ids)
+            METRICAS.evento("cache_linhas_invalidadas", len(ids))
+        with self._trava:
+            self._seqs[i] = seq
+            return self.geracao
+
+    def exporta(self) -> Optional[Tuple[int, Tuple[Dict[int, int], List[Tuple[int, bytes]]]]]:
+        """(versão, estado) para o snapshot de subida; versão = soma dos seqs conferidos, como o `_versao_global`."""
+        with self._trava:
+            if not self._seqs:
+                return None
+            return sum(self._seqs.values()), (dict(self._seqs), list(self._linhas.items()))
+
+    def importa(self, versao: int, estado: Tuple[Dict[int, int], List[Tuple[int, bytes]]]) -> None:
+        seqs, linhas = estado
+        with self._trava:
+            self.geracao += 1
+            self._seqs = dict(seqs)
+            self._linhas = OrderedDict(linhas[-self.capacidade :] if self.capacidade > 0 else [])
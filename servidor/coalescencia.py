@@ -0,0 +1,75 @@
+# servidor/coalescencia.py
+"""
+Single-flight: coalesce execuções idênticas e simultâneas.
+
+Enquanto uma execução para uma chave está em andamento, quem chega com a
+mesma chave espera por ela e recebe o mesmo valor (ou a mesma exceção), em
+vez de repetir o trabalho. Não é cache: terminada a execução, a chave sai do
+mapa e a próxima requisição executa de novo — sem TTL, sem dado velho além
+do que já estava em voo.
+
+Erros que são do líder e não da chave (o prazo dele, por exemplo) não devem
+contaminar quem pegou carona: com `repete_erros`, o carona que recebe um
+desses roda `fn` por conta própria, dentro do próprio prazo.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+
+class _Voo:
+    __slots__ = ("pronto", "valor", "erro", "espera")
+
+    def __init__(self) -> None:
+        self.pronto = threading.Event()
+        self.valor: Any = None
+        self.erro: Optional[BaseException] = None
+        self.espera = 0  # quantos pegaram carona
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._trava = threading.Lock()
+        self._em_voo: Dict[str, _Voo] = {}
+
+    def executa(
+        self,
+        chave: str,
+        fn: Callable[[], Any],
+        espera_max: Optional[float] = None,
+        repete_erros: Tuple[Type[BaseException], ...] = (),
+    ) -> Tuple[Any, bool]:
+        """
+        Roda `fn` uma vez por chave em voo. Devolve (valor, compartilhado):
+        compartilhado=True quando o valor veio da execução de outra thread.
+        Quem pega carona espera no máximo `espera_max` segundos (TimeoutError)
+        e recebe o erro do líder — exceto os de `repete_erros`, que o fazem rodar `fn` ele mesmo.
+        """
+        with self._trava:
+            voo = self._em_voo.get(chave)
+            if voo is None:
+                voo = self._em_voo[chave] = _Voo()
+                lider = True
+            else:
+                voo.espera += 1
+                lider = False
+
+        if not lider:
+            if not voo.pronto.wait(espera_max):
+                raise TimeoutError(f"execução em voo para {chave!r} não terminou a tempo")
+            if voo.erro is not None:
+                if isinstance(voo.erro, repete_erros):
+                    return fn(), False
+                raise voo.erro
+            return voo.valor, True
+
+        try:
+            voo.valor = fn()
+        except BaseException as e:
+            voo.erro = e
+            raise
+        finally:
+            with self._trava:
+                del self._em_voo[chave]
+            voo.pronto.set()
+        return voo.valor, False
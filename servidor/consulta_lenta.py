@@ -0,0 +1,119 @@
+# servidor/consulta_lenta.py
+"""
+Log de consultas lentas com o plano de execução do SQLite.
+
+Quando um search_cars passa do limiar configurado, registramos os filtros
+normalizados, o SQL gerado por `aplicar_filtros`, a quantidade de linhas, o
+tempo e a saída de `EXPLAIN QUERY PLAN` — o suficiente para decidir qual
+índice criar. Os registros são amostrados e limitados por minuto para que uma
+rajada de consultas lentas não vire uma rajada de EXPLAINs e de log.
+
+Consulta interrompida pelo prazo é registrada mesmo abaixo do limiar (o prazo
+pode ser menor que ele), marcada como interrompida e sem contagem de linhas.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from center_car.config import AMOSTRA_CONSULTA_LENTA, LIMIAR_CONSULTA_LENTA_MS, MAX_CONSULTAS_LENTAS_MIN
+
+logger = logging.getLogger("centercar.consultas_lentas")
+
+JANELA_LIMITE: float = 60.0  # s
+
+
+def sql_da_consulta(consulta) -> Tuple[str, Tuple[Any, ...], str]:
+    """
+    Devolve (sql com '?', parâmetros posicionais, sql com literais) de um Query do SQLAlchemy.
+    O primeiro par alimenta o EXPLAIN; o terceiro é o que vai para o log.
+    """
+    sessao = consulta.session
+    dialeto = sessao.get_bind().dialect
+    compilado = consulta.statement.compile(dialect=dialeto)
+    params = tuple(compilado.params[nome] for nome in (compilado.positiontup or ()))
+    try:
+        legivel = str(consulta.statement.compile(dialect=dialeto, compile_kwargs={"literal_binds": True}))
+    except Exception:
+        legivel = str(compilado)
+    return str(compilado), params, legivel
+
+
+def plano_de_execucao(consulta) -> List[str]:
+    """Executa EXPLAIN QUERY PLAN na mesma sessão da consulta e devolve uma linha por nó do plano."""
+    sql, params, _ = sql_da_consulta(consulta)
+    linhas = consulta.session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    # colunas do SQLite: id, parent, notused, detail
+    return [str(linha[-1]) for linha in linhas]
+
+
+class RegistroConsultasLentas:
+    """Decide se uma consulta lenta deve ser registrada (limiar, amostragem, teto/minuto) e a registra."""
+
+    def __init__(
+        self,
+        limiar_ms: float = LIMIAR_CONSULTA_LENTA_MS,
+        amostra: float = AMOSTRA_CONSULTA_LENTA,
+        max_por_minuto: int = MAX_CONSULTAS_LENTAS_MIN,
+    ) -> None:
+        self.limiar_s = limiar_ms / 1000
+        self.amostra = amostra
+        self.max_por_minuto = max_por_minuto
+        self._trava = threading.Lock()
+        self._inicio_janela = time.monotonic()
+        self._na_janela = 0
+        self.registradas = 0
+        self.suprimidas = 0
+
+    def _reserva(self) -> Optional[int]:
+        """Reserva uma vaga na janela atual; devolve quantas foram suprimidas desde o último registro."""
+        if random.random() >= self.amostra:
+            return None
+        with self._trava:
+            agora = time.monotonic()
+            if agora - self._inicio_janela >= JANELA_LIMITE:
+                self._inicio_janela, self._na_janela = agora, 0
+            if self._na_janela >= self.max_por_minuto:
+                self.suprimidas += 1
+                return None
+            self._na_janela += 1
+            self.registradas += 1
+            suprimidas, self.suprimidas = self.suprimidas, 0
+            return suprimidas
+
+    def observa(
+        self, consulta, filtros: Dict[str, Any], linhas: int, duracao: float, interrompida: bool = False
+    ) -> bool:
+        """
+        Chamado após cada busca, com a sessão ainda aberta. Devolve True se registrou.
+        Falhas ao montar o plano nunca derrubam a requisição — só empobrecem o log.
+        """
+        if duracao < self.limiar_s and not interrompida:
+            return False
+        suprimidas = self._reserva()
+        if suprimidas is None:
+            return False
+
+        try:
+            _, _, sql = sql_da_consulta(consulta)
+            plano = plano_de_execucao(consulta)
+        except Exception as e:
+            sql, plano = "?", [f"(plano indisponível: {e})"]
+
+        logger.warning(
+            "consulta lenta: %.1f ms, %s, filtros=%s%s\n  SQL: %s\n  PLANO:\n    %s",
+            duracao * 1000,
+            "interrompida pelo prazo" if interrompida else f"{linhas} linhas",
+            json.dumps(filtros, sort_keys=True, ensure_ascii=False),
+            f" ({suprimidas} suprimidas antes desta)" if suprimidas else "",
+            " ".join(sql.split()),
+            "\n    ".join(plano),
+        )
+        return True
+
+
+# Instância única usada pelo servidor
+CONSULTAS_LENTAS = RegistroConsultasLentas()
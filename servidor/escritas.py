@@ -0,0 +1,279 @@
+# servidor/escritas.py
+"""
+Validação e gravação dos itens das tools de escrita.
+
+- upsert_cars: {"itens": [{"id"?, "marca", "modelo", ...}, ...]}. Sem "id",
+  insere (todos os campos obrigatórios; o id novo volta no ack). Com "id",
+  atualiza só os campos enviados — ou insere com esse id, se ele não existir
+  e o item vier completo.
+- update_prices: {"itens": [{"id": 7, "preco": 89900.0}, ...]}.
+
+Cada item vira um ack {"id": ..., "status": ...}, na ordem dos itens:
+"inserido", "atualizado", "nao_encontrado" ou "invalido" (com "erro"). Item
+inválido não impede os outros do mesmo pedido.
+
+`grava` roda dentro da transação do group commit (servidor/escritor.py), com
+uma sessão por arquivo de dados; o commit é de quem chama. As escritas passam
+pelos gatilhos do log de alterações como qualquer outra.
+
+Com shards cada arquivo tem o próprio commit, então nada aqui pode depender de
+todos valerem juntos:
+- id de veículo novo é reservado no próprio item na primeira tentativa: se o
+  lote for refeito (nada gravado), o insert repete o mesmo id em vez de gerar
+  outro;
+- mudar a marca (partição por marca) insere a linha no shard novo dentro do
+  lote, mas a cópia velha só é apagada depois que todos os commits do lote
+  valeram (`grava` devolve o que apagar). Se algo falhar no meio, sobra no
+  máximo uma cópia a mais por um tempo — nunca falta a linha.
+"""
+
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, update
+
+from center_car.banco_dados import shard_de, shards_dos_ids
+from center_car.dicionario import codifica_linhas
+from center_car.modelo_veiculo import (
+    MAX_LEN_COR,
+    MAX_LEN_MARCA,
+    MAX_LEN_MODELO,
+    MAX_LEN_MOTORIZACAO,
+    MAX_LEN_TIPO_COMBUSTIVEL,
+    MAX_LEN_TRANSMISSAO,
+    Veiculo,
+)
+
+OP_UPSERT = "upsert_cars"
+OP_PRECOS = "update_prices"
+
+# campos gravados de um veículo (todos obrigatórios para inserir)
+CAMPOS_VEICULO: Tuple[str, ...] = (
+    "marca",
+    "modelo",
+    "ano",
+    "motorizacao",
+    "tipo_combustivel",
+    "cor",
+    "quilometragem",
+    "numero_portas",
+    "transmissao",
+    "preco",
+)
+CAMPOS_TEXTO: Dict[str, int] = {
+    "marca": MAX_LEN_MARCA,
+    "modelo": MAX_LEN_MODELO,
+    "motorizacao": MAX_LEN_MOTORIZACAO,
+    "tipo_combustivel": MAX_LEN_TIPO_COMBUSTIVEL,
+    "cor": MAX_LEN_COR,
+    "transmissao": MAX_LEN_TRANSMISSAO,
+}
+ANO_MIN, ANO_MAX = 1900, 2100
+MAX_PORTAS = 10
+
+# acks de itens efetivamente gravados (os ids deles saem dos caches de leitura)
+STATUS_GRAVADO = ("inserido", "atualizado")
+
+# chave interna que guarda, no item de um insert, o id reservado na primeira tentativa do lote
+ID_RESERVADO = "_id_reservado"
+# maior id já reservado neste processo (com shards; só a thread do escritor grava)
+_ultimo_reservado = 0
+
+_TABELA = Veiculo.__table__
+
+
+def _inteiro(v: Any) -> bool:
+    return isinstance(v, int) and not isinstance(v, bool)
+
+
+def _numero(v: Any) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+
+
+def _erro_campo(campo: str, valor: Any) -> Optional[str]:
+    if campo in CAMPOS_TEXTO:
+        if not isinstance(valor, str) or not valor.strip():
+            return f"'{campo}' deve ser um texto não vazio"
+        if len(valor) > CAMPOS_TEXTO[campo]:
+            return f"'{campo}' passa de {CAMPOS_TEXTO[campo]} caracteres"
+    elif campo == "ano":
+        if not _inteiro(valor) or not ANO_MIN <= valor <= ANO_MAX:
+            return f"'ano' deve ser um inteiro entre {ANO_MIN} e {ANO_MAX}"
+    elif campo == "numero_portas":
+        if not _inteiro(valor) or not 0 < valor <= MAX_PORTAS:
+            return f"'numero_portas' deve ser um inteiro entre 1 e {MAX_PORTAS}"
+    elif campo == "quilometragem":
+        if not _numero(valor) or valor < 0:
+            return "'quilometragem' deve ser um número >= 0"
+    elif campo == "preco":
+        if not _numero(valor) or valor <= 0:
+            return "'preco' deve ser um número > 0"
+    return None
+
+
+def _normaliza(item: Dict[str, Any], campos: List[str]) -> Dict[str, Any]:
+    """Só os campos pedidos (e o id), com quilometragem/preco em float como no modelo."""
+    out: Dict[str, Any] = {"id": item["id"]} if "id" in item else {}
+    for campo in campos:
+        out[campo] = float(item[campo]) if campo in ("quilometragem", "preco") else item[campo]
+    return out
+
+
+def valida_upsert(item: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """(item normalizado, None) ou (None, motivo da recusa)."""
+    if not isinstance(item, dict):
+        return None, "item deve ser um objeto"
+    # escrita não ignora chave desconhecida como o search_cars: um "preço" mal digitado se perderia calado
+    desconhecidos = sorted(set(item) - set(CAMPOS_VEICULO) - {"id"})
+    if desconhecidos:
+        return None, f"campos desconhecidos: {desconhecidos}"
+    if "id" in item and (not _inteiro(item["id"]) or item["id"] <= 0):
+        return None, "'id' deve ser um inteiro positivo"
+    campos = [c for c in CAMPOS_VEICULO if c in item]
+    if "id" not in item and len(campos) < len(CAMPOS_VEICULO):
+        return None, f"campos obrigatórios para inserir: {[c for c in CAMPOS_VEICULO if c not in item]}"
+    if not campos:
+        return None, "nenhum campo para gravar"
+    for campo in campos:
+        erro = _erro_campo(campo, item[campo])
+        if erro:
+            return None, erro
+    return _normaliza(item, campos), None
+
+
+def valida_preco(item: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """(item normalizado, None) ou (None, motivo da recusa)."""
+    if not isinstance(item, dict) or set(item) != {"id", "preco"}:
+        return None, "item deve ser um objeto {\"id\", \"preco\"}"
+    if not _inteiro(item["id"]) or item["id"] <= 0:
+        return None, "'id' deve ser um inteiro positivo"
+    erro = _erro_campo("preco", item["preco"])
+    if erro:
+        return None, erro
+    return _normaliza(item, ["preco"]), None
+
+
+VALIDADORES = {OP_UPSERT: valida_upsert, OP_PRECOS: valida_preco}
+
+
+def ack_invalido(item: Any, erro: str) -> Dict[str, Any]:
+    id_ = item.get("id") if isinstance(item, dict) else None
+    return {"id": id_ if _inteiro(id_) else None, "status": "invalido", "erro": erro}
+
+
+class _Gravador:
+    """Aplica itens já validados nas sessões de um lote (uma por arquivo de dados)."""
+
+    def __init__(self, sessoes: List[Any]) -> None:
+        self.sessoes = sessoes
+        self._proximo: Optional[int] = None  # próximo id livre, com shards (cada arquivo tem o próprio autoincremento)
+        # veículos que mudaram de shard neste lote: id -> shard atual e id -> shard da cópia velha (apagar depois)
+        self._movidos: Dict[int, int] = {}
+        self.apagar: Dict[int, int] = {}
+
+    def aplica(self, operacao: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        if operacao == OP_PRECOS:
+            return self._atualiza_preco(item["id"], item["preco"])
+        campos = {c: v for c, v in item.items() if c not in ("id", ID_RESERVADO)}
+        if "id" in item:
+            return self._upsert(item["id"], campos)
+        if ID_RESERVADO not in item:
+            # reservado no item: o lote refeito insere de novo com este id, não com um novo
+            item[ID_RESERVADO] = self._proximo_id() if len(self.sessoes) > 1 else None
+        return {"id": self._insere(item[ID_RESERVADO], campos), "status": "inserido"}
+
+    def _atualiza_preco(self, id_: int, preco: float) -> Dict[str, Any]:
+        i = self._localiza(id_)
+        if i is None:
+            return {"id": id_, "status": "nao_encontrado"}
+        self.sessoes[i].execute(update(_TABELA).where(_TABELA.c.id == id_).values(preco=preco))
+        return {"id": id_, "status": "atualizado"}
+
+    def _localiza(self, id_: int) -> Optional[int]:
+        """Arquivo onde o veículo está (None se não existe); quem mudou de shard no lote está no destino."""
+        if id_ in self._movidos:
+            return self._movidos[id_]
+        for i in shards_dos_ids([id_]):
+            if self.sessoes[i].execute(select(_TABELA.c.id).where(_TABELA.c.id == id_)).first() is not None:
+                return i
+        return None
+
+    def _upsert(self, id_: int, campos: Dict[str, Any]) -> Dict[str, Any]:
+        i = self._localiza(id_)
+        if i is None:
+            if len(campos) < len(CAMPOS_VEICULO):
+                return ack_invalido({"id": id_}, "id inexistente: para inserir, envie todos os campos")
+            self._insere(id_, campos)
+            return {"id": id_, "status": "inserido"}
+        destino = shard_de(campos["marca"], id_) if len(self.sessoes) > 1 and "marca" in campos else i
+        if destino != i:
+            self._move(id_, i, destino, campos)
+        else:
+            self._atualiza(i, id_, campos)
+        return {"id": id_, "status": "atualizado"}
+
+    def _atualiza(self, i: int, id_: int, campos: Dict[str, Any]) -> None:
+        valores = codifica_linhas(self.sessoes[i], [campos])[0]
+        self.sessoes[i].execute(update(_TABELA).where(_TABELA.c.id == id_).values(**valores))
+
+    def _move(self, id_: int, origem: int, destino: int, campos: Dict[str, Any]) -> None:
+        """Partição por marca e a marca mudou: a linha vai para `destino` (lida pelo ORM, que decodifica lookups)."""
+        # populate_existing: a linha pode ter mudado por UPDATE direto (Core) neste lote, por fora do identity map
+        atual = self.sessoes[origem].get(Veiculo, id_, populate_existing=True)
+        linha = {c: getattr(atual, c) for c in CAMPOS_VEICULO}
+        linha.update(campos)
+        if self.apagar.get(id_) == destino:
+            # voltou para o shard da cópia velha (ainda não apagada): ela vira a atual
+            del self.apagar[id_]
+            self._atualiza(destino, id_, linha)
+        else:
+            self._insere(id_, linha)
+        if self._movidos.get(id_) == origem:
+            # a origem é uma cópia inserida neste mesmo lote: sai na mesma transação
+            self.sessoes[origem].execute(delete(_TABELA).where(_TABELA.c.id == id_))
+        else:
+            self.apagar[id_] = origem
+        self._movidos[id_] = destino
+
+    def _insere(self, id_: Optional[int], campos: Dict[str, Any]) -> int:
+        if len(self.sessoes) > 1:
+            assert id_ is not None  # com shards o id é sempre atribuído por quem grava
+            if self._proximo is not None:
+                self._proximo = max(self._proximo, id_ + 1)
+            sessao = self.sessoes[shard_de(campos["marca"], id_)]
+        else:
+            sessao = self.sessoes[0]
+        linha = codifica_linhas(sessao, [campos if id_ is None else {"id": id_, **campos}])[0]
+        return sessao.execute(insert(_TABELA).values(**linha)).inserted_primary_key[0]
+
+    def _proximo_id(self) -> int:
+        global _ultimo_reservado
+        if self._proximo is None:
+            # lido nas sessões do lote, que já enxergam o que o próprio lote inseriu; nunca abaixo de um id já
+            # reservado, que pode estar num item à espera de ser refeito
+            maior = max(s.execute(select(func.max(_TABELA.c.id))).scalar() or 0 for s in self.sessoes)
+            self._proximo = 1 + max(maior, _ultimo_reservado)
+        id_ = self._proximo
+        self._proximo += 1
+        _ultimo_reservado = max(_ultimo_reservado, id_)
+        return id_
+
+
+def grava(
+    sessoes: List[Any], pedidos: List[Tuple[str, List[Dict[str, Any]]]]
+) -> Tuple[List[List[Dict[str, Any]]], Dict[int, int]]:
+    """
+    Aplica os pedidos do lote (itens já validados; não faz commit) e devolve os acks de cada um e as cópias
+    velhas de veículos que mudaram de shard ({id: shard}), para `apaga_copias` depois de todos os commits.
+    """
+    gravador = _Gravador(sessoes)
+    acks = [[gravador.aplica(operacao, item) for item in itens] for operacao, itens in pedidos]
+    return acks, gravador.apagar
+
+
+def apaga_copias(sessoes: List[Any], copias: Dict[int, int]) -> None:
+    """Apaga (e faz commit de) as cópias velhas {id: shard}. Idempotente: pode ser repetida depois de uma falha."""
+    for i in sorted(set(copias.values())):
+        ids = [id_ for id_, shard in copias.items() if shard == i]
+        sessoes[i].execute(delete(_TABELA).where(_TABELA.c.id.in_(ids)))
+        sessoes[i].commit()
@@ -0,0 +1,156 @@
+# servidor/escritor.py
+"""
+Group commit para as tools de escrita (upsert_cars, update_prices).
+
+No SQLite o custo de uma escrita pequena é o commit (fsync do journal), não o
+UPDATE: com centenas de atualizações de preço/estoque por segundo, um commit
+por item é o gargalo. Aqui todas as escritas vão para uma thread só, que junta
+os pedidos que chegam juntos e grava o lote numa transação — N pedidos, um
+commit. Uma thread só também acaba com a disputa pela trava de escrita do
+arquivo entre as threads do servidor.
+
+Depois do primeiro pedido, a thread espera no máximo `atraso_max` segundos
+por companhia (ou até juntar `max_itens` itens): é a latência que uma escrita
+aceita pagar para dividir o commit. Enquanto um lote grava, os pedidos
+seguintes já se acumulam para o próximo, então sob carga o lote cresce mesmo
+com `atraso_max` = 0.
+
+Cada pedido recebe os próprios acks (um por item). Se o lote inteiro falhar,
+a thread desfaz e grava os pedidos um a um, para só o culpado receber o erro.
+Refazer só é seguro se nada do lote foi gravado: com vários arquivos (shards)
+um commit pode valer e o seguinte falhar, e aí o aplicador sobe
+`CommitParcial` — todos os pedidos do lote recebem o erro, sem repetição.
+"""
+
+import logging
+import threading
+from collections import deque
+from time import monotonic
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from servidor.metricas import METRICAS
+
+logger = logging.getLogger("centercar.escritor")
+
+# (operação, itens) de cada pedido do lote -> acks de cada pedido, na mesma ordem
+Aplicador = Callable[[List[Tuple[str, List[Dict[str, Any]]]]], List[List[Dict[str, Any]]]]
+
+
+class CommitParcial(Exception):
+    """Parte do lote já foi gravada quando a falha veio: refazer os pedidos poderia gravá-los duas vezes."""
+
+
+class _Pedido:
+    __slots__ = ("operacao", "itens", "pronto", "acks", "erro", "na_fila")
+
+    def __init__(self, operacao: str, itens: List[Dict[str, Any]]) -> None:
+        self.operacao = operacao
+        self.itens = itens
+        self.pronto = threading.Event()
+        self.acks: List[Dict[str, Any]] = []
+        self.erro: Optional[BaseException] = None
+        self.na_fila = True
+
+
+class EscritorEmGrupo:
+    """
+    Thread única de escrita. `aplica(lote)` grava o lote numa transação (commit
+    incluído) e devolve os acks de cada pedido; vem do servidor, que sabe onde
+    estão os dados.
+    """
+
+    def __init__(self, aplica: Aplicador, atraso_max: float, max_itens: int) -> None:
+        self._aplica = aplica
+        self.atraso_max = atraso_max
+        self.max_itens = max(max_itens, 1)
+        self._cond = threading.Condition()
+        self._fila: Deque[_Pedido] = deque()
+        self._itens_na_fila = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def submete(
+        self, operacao: str, itens: List[Dict[str, Any]], espera_max: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Enfileira os itens e espera o commit; devolve um ack por item (ou sobe o erro do pedido).
+        Passado `espera_max` com o pedido ainda na fila, ele sai da fila e sobe TimeoutError: nada
+        foi gravado. Pedido que já entrou num lote é esperado até o fim — quem chama sempre sabe o que valeu.
+        """
+        pedido = _Pedido(operacao, itens)
+        with self._cond:
+            self._garante_thread()
+            self._fila.append(pedido)
+            self._itens_na_fila += len(itens)
+            self._cond.notify()
+
+        if not pedido.pronto.wait(espera_max):
+            with self._cond:
+                if pedido.na_fila:
+                    self._fila.remove(pedido)
+                    self._itens_na_fila -= len(itens)
+                    raise TimeoutError(f"escrita {operacao!r} não entrou num commit a tempo")
+            pedido.pronto.wait()
+        if pedido.erro is not None:
+            raise pedido.erro
+        return pedido.acks
+
+    def _garante_thread(self) -> None:
+        # chamado sob self._cond: a thread só nasce na primeira escrita
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._grava_sempre, name="centercar-escritor", daemon=True)
+            self._thread.start()
+
+    def _junta(self) -> List[_Pedido]:
+        """Espera o primeiro pedido, dá `atraso_max` para chegarem outros e tira da fila até `max_itens` itens."""
+        with self._cond:
+            while not self._fila:
+                self._cond.wait()
+            limite = monotonic() + self.atraso_max
+            while self._fila and self._itens_na_fila < self.max_itens:
+                restante = limite - monotonic()
+                if restante <= 0:
+                    break
+                self._cond.wait(restante)
+            lote: List[_Pedido] = []
+            total = 0
+            # pedido maior que max_itens sozinho ainda vai (num lote só dele)
+            while self._fila and (not lote or total + len(self._fila[0].itens) <= self.max_itens):
+                pedido = self._fila.popleft()
+                pedido.na_fila = False
+                self._itens_na_fila -= len(pedido.itens)
+                total += len(pedido.itens)
+                lote.append(pedido)
+            return lote
+
+    def _grava_sempre(self) -> None:
+        while True:
+            lote = self._junta()
+            if lote:  # vazio se todos os pedidos desistiram durante a espera
+                self._grava(lote)
+
+    def _grava(self, lote: List[_Pedido]) -> None:
+        try:
+            try:
+                resultados = self._aplica([(p.operacao, p.itens) for p in lote])
+            except Exception as e:
+                if len(lote) == 1 or isinstance(e, CommitParcial):
+                    logger.error("lote de %d escritas falhou: %s", len(lote), e)
+                    for pedido in lote:
+                        pedido.erro = e
+                    return
+                logger.warning("lote de %d escritas falhou (%s); gravando uma a uma", len(lote), e)
+                for pedido in lote:
+                    try:
+                        pedido.acks = self._aplica([(pedido.operacao, pedido.itens)])[0]
+                    except Exception as e_pedido:
+                        pedido.erro = e_pedido
+                    METRICAS.evento("escrita_commits")
+                return
+            for pedido, acks in zip(lote, resultados):
+                pedido.acks = acks
+            METRICAS.evento("escrita_commits")
+        finally:
+            METRICAS.evento("escrita_pedidos", len(lote))
+            METRICAS.evento("escrita_itens", sum(len(p.itens) for p in lote))
+            for pedido in lote:
+                pedido.pronto.set()
@@ -0,0 +1,118 @@
+# servidor/indice_fuzzy.py
+"""
+Busca tolerante a erros de digitação para marca e modelo.
+
+Um `IndiceNgramas` por campo (center_car/indice_ngramas.py, compartilhado
+com a réplica local do cliente) sobre os valores distintos no banco.
+
+Os índices são imutáveis: construídos inteiros e trocados de uma vez. `IndiceFuzzy`
+confere a versão dos dados (log de alterações) no máximo a cada `intervalo`
+segundos e, se mudou, reconstrói numa thread à parte — a consulta nunca
+espera a reconstrução, usa o índice anterior até a troca. A versão anda a
+cada escrita, mas quase todas (preço, quilometragem) não mexem em marca e
+modelo: com `mudou`, o servidor diz antes se vale reconstruir.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from center_car.config import FUZZY_INTERVALO
+from center_car.indice_ngramas import CAMPOS_FUZZY, IndiceNgramas
+
+logger = logging.getLogger("centercar.fuzzy")
+
+
+class IndiceFuzzy:
+    """
+    Índices de marca e modelo mantidos em dia com o banco.
+
+    `versao()` devolve a versão atual dos dados; `carregar()` devolve
+    (versão, {campo: valores distintos}). `mudou(índices)`, opcional, diz se
+    as escritas desde a última conferência podem ter mudado os valores
+    distintos; se não, a versão nova vale para o índice atual, sem
+    reconstruir. Todos vêm do servidor, que sabe onde estão os dados (banco
+    único ou shards).
+    """
+
+    def __init__(
+        self,
+        versao: Callable[[], int],
+        carregar: Callable[[], Tuple[int, Dict[str, List[str]]]],
+        intervalo: float = FUZZY_INTERVALO,
+        mudou: Optional[Callable[[Dict[str, IndiceNgramas]], bool]] = None,
+    ) -> None:
+        self._versao = versao
+        self._carregar = carregar
+        self._mudou = mudou
+        self.intervalo = intervalo
+        self._trava = threading.Lock()
+        self._indices: Optional[Dict[str, IndiceNgramas]] = None
+        self.versao_indice = -1
+        self._ultima_checagem = 0.0
+        self._reconstruindo = False
+
+    def constroi(self) -> None:
+        """Constrói (ou reconstrói) os índices agora, na thread de quem chama."""
+        versao, valores = self._carregar()
+        indices = {campo: IndiceNgramas(valores.get(campo, ())) for campo in CAMPOS_FUZZY}
+        with self._trava:
+            self._indices, self.versao_indice = indices, versao
+            self._ultima_checagem = time.monotonic()
+
+    def exporta(self) -> Optional[Tuple[int, Dict[str, IndiceNgramas]]]:
+        """(versão, índices) para o snapshot de subida; None se ainda não foi construído."""
+        with self._trava:
+            if self._indices is None:
+                return None
+            return self.versao_indice, self._indices
+
+    def importa(self, versao: int, indices: Dict[str, IndiceNgramas]) -> None:
+        """Adota índices prontos (vindos do snapshot) como se tivessem sido construídos agora."""
+        with self._trava:
+            self._indices, self.versao_indice = indices, versao
+            self._ultima_checagem = time.monotonic()
+
+    def indice(self, campo: str) -> IndiceNgramas:
+        """Índice atual do campo; na primeira chamada constrói, nas demais no máximo agenda a atualização."""
+        if self._indices is None:
+            self.constroi()
+        else:
+            self._talvez_atualiza()
+        return self._indices[campo]
+
+    def sugere(self, campo: str, termo: str, limite: int = 5) -> List[Tuple[str, float]]:
+        return self.indice(campo).candidatos(termo, limite)
+
+    def resolve(self, campo: str, termo: str) -> Optional[str]:
+        """Melhor candidato para `termo`, ou None se nada passar do score mínimo."""
+        melhores = self.sugere(campo, termo, 1)
+        return melhores[0][0] if melhores else None
+
+    def _talvez_atualiza(self) -> None:
+        agora = time.monotonic()
+        with self._trava:
+            if self._reconstruindo or agora - self._ultima_checagem < self.intervalo:
+                return
+            self._ultima_checagem = agora
+            self._reconstruindo = True
+        threading.Thread(target=self._atualiza, name="centercar-fuzzy", daemon=True).start()
+
+    def _atualiza(self) -> None:
+        try:
+            versao = self._versao()
+            if versao == self.versao_indice:
+                return
+            indices = self._indices
+            if self._mudou is not None and indices is not None and not self._mudou(indices):
+                # só mudou o que o índice não usa (preço, quilometragem): o índice atual vale para a versão nova
+                with self._trava:
+                    self.versao_indice = versao
+                return
+            self.constroi()
+        except Exception:
+            logger.exception("falha atualizando o índice fuzzy")
+        finally:
+            with self._trava:
+                self._reconstruindo = False
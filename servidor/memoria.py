@@ -0,0 +1,48 @@
+# servidor/memoria.py
+"""
+Rastreio opcional do pico de memória por requisição (tracemalloc).
+
+O tracemalloc é global ao processo, então o pico medido inclui o que outras
+threads alocaram no mesmo intervalo — com carga concorrente ele é um limite
+superior, não um valor exato. Para não distorcer ainda mais, só uma
+requisição é rastreada por vez; as demais seguem sem rastreio. Mesmo assim
+basta para ver quais formatos de consulta são os pesados (`server_stats`,
+seção `memoria_por_forma`).
+"""
+
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator
+
+from center_car.config import RASTREAR_MEMORIA
+from servidor.metricas import METRICAS
+
+
+class RastreadorMemoria:
+    def __init__(self, ativo: bool = RASTREAR_MEMORIA) -> None:
+        self.ativo = ativo
+        self._em_uso = threading.Lock()
+
+    @contextmanager
+    def rastreia(self, forma: str) -> Iterator[None]:
+        """Mede o pico de memória alocada durante o bloco e registra em METRICAS sob `forma`."""
+        if not self.ativo or not self._em_uso.acquire(blocking=False):
+            yield
+            return
+        try:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            base, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            try:
+                yield
+            finally:
+                _, pico = tracemalloc.get_traced_memory()
+                METRICAS.observa_memoria(forma, max(0, pico - base) / 1024)
+        finally:
+            self._em_uso.release()
+
+
+# Instância única usada pelo servidor
+MEMORIA = RastreadorMemoria()
@@ -0,0 +1,202 @@
+# servidor/metricas.py
+"""
+Métricas do servidor MCP, sempre ligadas e baratas no caminho quente.
+
+- Um histograma por fase da requisição (recv, decode, fila, consulta,
+  hidratacao, encode, compressao, send), com buckets em escala log2 de microssegundos: observar é uma
+  busca binária + um incremento sob lock.
+- Contadores por tool: requisições, erros, bytes recebidos/enviados.
+- Gauges de conexões ativas e, passada por quem pede o snapshot, da
+  profundidade da fila de cada cliente no pool de consultas.
+- Contadores de eventos (ex.: respostas truncadas) e, quando o rastreio de
+  memória está ligado, o pico de memória por formato de consulta.
+
+Tudo é exposto pela tool `server_stats` (JSON ou texto puro).
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# Fases de uma requisição, na ordem em que acontecem
+FASES: tuple[str, ...] = ("recv", "decode", "fila", "consulta", "hidratacao", "encode", "compressao", "send")
+
+# Limites superiores dos buckets, em µs: 1, 2, 4, ..., 2^26 (~67 s); acima disso cai no +Inf
+LIMITES_US: List[int] = [2**i for i in range(27)]
+
+# Rótulos fixos para o que não é tool conhecida (evita cardinalidade ilimitada nos contadores)
+TOOL_LEGADO = "legacy"
+TOOL_DESCONHECIDA = "unknown"
+TOOL_INVALIDA = "invalid"
+
+
+class Histograma:
+    """Histograma de latências com buckets fixos em escala log2 (µs)."""
+
+    def __init__(self) -> None:
+        self._trava = threading.Lock()
+        self.contagens: List[int] = [0] * (len(LIMITES_US) + 1)
+        self.total = 0
+        self.soma_us = 0.0
+        self.max_us = 0.0
+
+    def observa(self, segundos: float) -> None:
+        us = segundos * 1e6
+        idx = bisect_left(LIMITES_US, us)
+        with self._trava:
+            self.contagens[idx] += 1
+            self.total += 1
+            self.soma_us += us
+            if us > self.max_us:
+                self.max_us = us
+
+    def percentil_us(self, p: float) -> Optional[float]:
+        """Estimativa do percentil `p` (limite superior do bucket que o contém)."""
+        with self._trava:
+            contagens, total, maximo = list(self.contagens), self.total, self.max_us
+        if not total:
+            return None
+        alvo = p / 100 * total
+        acumulado = 0
+        for idx, c in enumerate(contagens):
+            acumulado += c
+            if acumulado >= alvo:
+                return float(min(LIMITES_US[idx], maximo)) if idx < len(LIMITES_US) else maximo
+        return maximo
+
+    def resumo(self) -> Dict[str, Any]:
+        with self._trava:
+            total, soma, maximo = self.total, self.soma_us, self.max_us
+            buckets = {str(lim): c for lim, c in zip(LIMITES_US, self.contagens) if c}
+            if self.contagens[-1]:
+                buckets["+Inf"] = self.contagens[-1]
+        return {
+            "n": total,
+            "media_us": round(soma / total, 1) if total else None,
+            "p50_us": self.percentil_us(50),
+            "p95_us": self.percentil_us(95),
+            "p99_us": self.percentil_us(99),
+            "max_us": round(maximo, 1),
+            "buckets_us": buckets,
+        }
+
+
+class Metricas:
+    """Registro central: histogramas por fase, contadores por tool e conexões ativas."""
+
+    def __init__(self) -> None:
+        self._trava = threading.Lock()
+        self.inicio = time.time()
+        self.fases: Dict[str, Histograma] = {fase: Histograma() for fase in FASES}
+        self.por_tool: Dict[str, Dict[str, int]] = {}
+        self.conexoes_ativas = 0
+        self.eventos: Dict[str, int] = {}
+        self.memoria: Dict[str, Dict[str, float]] = {}
+        self.aquecimento: Dict[str, Any] = {}
+
+    def observa(self, fase: str, segundos: float) -> None:
+        self.fases[fase].observa(segundos)
+
+    def conta(self, tool: str, bytes_in: int = 0, bytes_out: int = 0, erro: bool = False) -> None:
+        with self._trava:
+            c = self.por_tool.get(tool)
+            if c is None:
+                c = self.por_tool[tool] = {"requisicoes": 0, "erros": 0, "bytes_in": 0, "bytes_out": 0}
+            c["requisicoes"] += 1
+            c["erros"] += int(erro)
+            c["bytes_in"] += bytes_in
+            c["bytes_out"] += bytes_out
+
+    def evento(self, nome: str, n: int = 1) -> None:
+        with self._trava:
+            self.eventos[nome] = self.eventos.get(nome, 0) + n
+
+    def observa_memoria(self, forma: str, pico_kb: float) -> None:
+        """Registra o pico de memória (KiB) de uma requisição, agrupado pelo formato da consulta."""
+        with self._trava:
+            m = self.memoria.get(forma)
+            if m is None:
+                m = self.memoria[forma] = {"n": 0, "soma_kb": 0.0, "max_kb": 0.0}
+            m["n"] += 1
+            m["soma_kb"] += pico_kb
+            if pico_kb > m["max_kb"]:
+                m["max_kb"] = pico_kb
+
+    def registra_aquecimento(self, segundos: float, origem: str) -> None:
+        """Tempo da subida até as estruturas em memória ficarem prontas; `origem` = "snapshot" ou "reconstrucao"."""
+        with self._trava:
+            self.aquecimento = {"ms": round(segundos * 1000, 1), "origem": origem}
+
+    @contextmanager
+    def conexao(self) -> Iterator[None]:
+        """Mantém o gauge de conexões ativas enquanto o bloco roda."""
+        with self._trava:
+            self.conexoes_ativas += 1
+        try:
+            yield
+        finally:
+            with self._trava:
+                self.conexoes_ativas -= 1
+
+    def snapshot(self, fila_por_cliente: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """`fila_por_cliente`: consultas esperando worker, por cliente (vem do agendador, que não mora aqui)."""
+        with self._trava:
+            por_tool = {tool: dict(c) for tool, c in self.por_tool.items()}
+            ativas = self.conexoes_ativas
+            eventos = dict(self.eventos)
+            aquecimento = dict(self.aquecimento)
+            memoria = {
+                forma: {"n": int(m["n"]), "media_kb": round(m["soma_kb"] / m["n"], 1), "max_kb": round(m["max_kb"], 1)}
+                for forma, m in self.memoria.items()
+            }
+        return {
+            "uptime_s": round(time.time() - self.inicio, 3),
+            "conexoes_ativas": ativas,
+            "fila_por_cliente": dict(fila_por_cliente or {}),
+            "tools": por_tool,
+            "eventos": eventos,
+            "aquecimento": aquecimento,
+            "memoria_por_forma": dict(sorted(memoria.items(), key=lambda kv: -kv[1]["max_kb"])),
+            "fases": {fase: h.resumo() for fase, h in self.fases.items()},
+        }
+
+    def texto(self, fila_por_cliente: Optional[Dict[str, int]] = None) -> str:
+        """Dump em texto puro, uma métrica por linha (formato de exposição do Prometheus)."""
+        snap = self.snapshot(fila_por_cliente)
+        linhas = [
+            f"centercar_uptime_segundos {snap['uptime_s']}",
+            f"centercar_conexoes_ativas {snap['conexoes_ativas']}",
+        ]
+        for cliente, n in sorted(snap["fila_por_cliente"].items()):
+            linhas.append(f'centercar_fila_pendentes{{cliente="{cliente}"}} {n}')
+        for tool, c in sorted(snap["tools"].items()):
+            for nome, valor in c.items():
+                linhas.append(f'centercar_tool_{nome}_total{{tool="{tool}"}} {valor}')
+        if snap["aquecimento"]:
+            a = snap["aquecimento"]
+            linhas.append(f'centercar_aquecimento_ms{{origem="{a["origem"]}"}} {a["ms"]}')
+        for nome, valor in sorted(snap["eventos"].items()):
+            linhas.append(f'centercar_eventos_total{{evento="{nome}"}} {valor}')
+        for forma, m in snap["memoria_por_forma"].items():
+            linhas.append(f'centercar_memoria_pico_max_kb{{filtros="{forma}"}} {m["max_kb"]}')
+        for fase, h in self.fases.items():
+            with h._trava:
+                contagens, total, soma = list(h.contagens), h.total, h.soma_us
+            acumulado = 0
+            for lim, c in zip(LIMITES_US, contagens):
+                acumulado += c
+                linhas.append(f'centercar_fase_us_bucket{{fase="{fase}",le="{lim}"}} {acumulado}')
+            linhas.append(f'centercar_fase_us_bucket{{fase="{fase}",le="+Inf"}} {total}')
+            linhas.append(f'centercar_fase_us_sum{{fase="{fase}"}} {round(soma, 1)}')
+            linhas.append(f'centercar_fase_us_count{{fase="{fase}"}} {total}')
+        return "\n".join(linhas) + "\n"
+
+    def zera(self) -> None:
+        """Reinicia tudo (útil em testes e no benchmark)."""
+        self.__init__()
+
+
+# Instância única usada pelo servidor
+METRICAS = Metricas()
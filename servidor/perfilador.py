@@ -0,0 +1,139 @@
+# servidor/perfilador.py
+"""
+Profiling sob demanda de requisições do servidor MCP.
+
+Algumas requisições patológicas são lentas de um jeito que as métricas não
+explicam. Com o perfilador ligado, uma requisição elegível roda dentro do
+cProfile e o resultado vai para `PERFIL_DIR` (abra com `python -m pstats` ou
+snakeviz). É elegível a requisição que:
+  - traz no envelope "perfilar": <PERFIL_TOKEN> (flag privilegiada), ou
+  - casa com PERFIL_TOOL e/ou PERFIL_FILTRO (padrões fnmatch), ou
+  - cai na amostra aleatória de 1 a cada PERFIL_AMOSTRA_N.
+
+Para não pesar em produção: no máximo MAX_PERFIS_MIN perfis por minuto e um
+perfil por vez (o cProfile é global ao interpretador a partir do 3.12) — quem
+chega enquanto outro perfil roda simplesmente segue sem profiling.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from typing import Any, Dict, Iterator
+
+from center_car.config import (
+    MAX_PERFIS_MIN,
+    PERFIL_AMOSTRA_N,
+    PERFIL_ATIVO,
+    PERFIL_DIR,
+    PERFIL_FILTRO,
+    PERFIL_TOKEN,
+    PERFIL_TOOL,
+)
+
+logger = logging.getLogger("centercar.perfilador")
+
+JANELA_LIMITE: float = 60.0  # s
+
+
+class Perfilador:
+    """Decide quais requisições perfilar e grava os perfis em disco."""
+
+    def __init__(
+        self,
+        ativo: bool = PERFIL_ATIVO,
+        diretorio: str = PERFIL_DIR,
+        amostra_n: int = PERFIL_AMOSTRA_N,
+        padrao_tool: str = PERFIL_TOOL,
+        padrao_filtro: str = PERFIL_FILTRO,
+        token: str = PERFIL_TOKEN,
+        max_por_minuto: int = MAX_PERFIS_MIN,
+    ) -> None:
+        self.ativo = ativo
+        self.diretorio = diretorio
+        self.amostra_n = amostra_n
+        self.padrao_tool = padrao_tool
+        self.padrao_filtro = padrao_filtro
+        self.token = token
+        self.max_por_minuto = max_por_minuto
+        self._em_uso = threading.Lock()
+        self._local = threading.local()
+        self._trava = threading.Lock()
+        self._inicio_janela = time.monotonic()
+        self._na_janela = 0
+        self.gravados = 0
+
+    def elegivel(self, req: Dict[str, Any]) -> bool:
+        """Aplica as regras de seleção (token, tool/filtro, amostra) a um envelope já decodificado."""
+        if self.token and req.get("perfilar") == self.token:
+            return True
+        if not self.ativo:
+            return False
+
+        if self.padrao_tool or self.padrao_filtro:
+            tool_ok = not self.padrao_tool or fnmatchcase(str(req.get("tool")), self.padrao_tool)
+            args = json.dumps(req.get("args"), sort_keys=True, ensure_ascii=False)
+            filtro_ok = not self.padrao_filtro or fnmatchcase(args, self.padrao_filtro)
+            if tool_ok and filtro_ok:
+                return True
+
+        return self.amostra_n > 0 and random.randrange(self.amostra_n) == 0
+
+    def _reserva(self) -> bool:
+        with self._trava:
+            agora = time.monotonic()
+            if agora - self._inicio_janela >= JANELA_LIMITE:
+                self._inicio_janela, self._na_janela = agora, 0
+            if self._na_janela >= self.max_por_minuto:
+                return False
+            self._na_janela += 1
+            return True
+
+    @contextmanager
+    def talvez(self, req: Dict[str, Any]) -> Iterator[None]:
+        """Roda o bloco dentro do cProfile se a requisição for elegível e houver vaga; senão, roda normal."""
+        if not self.elegivel(req) or not self._em_uso.acquire(blocking=False):
+            yield
+            return
+        try:
+            if not self._reserva():
+                yield
+                return
+            perfil = cProfile.Profile()
+            t0 = time.perf_counter()
+            perfil.enable()
+            self._local.ativo = True
+            try:
+                yield
+            finally:
+                self._local.ativo = False
+                perfil.disable()
+                self._grava(perfil, req, time.perf_counter() - t0)
+        finally:
+            self._em_uso.release()
+
+    def perfilando(self) -> bool:
+        """True se a thread atual está dentro de um `talvez` perfilado (o cProfile só vê a própria thread)."""
+        return getattr(self._local, "ativo", False)
+
+    def _grava(self, perfil: cProfile.Profile, req: Dict[str, Any], duracao: float) -> None:
+        try:
+            os.makedirs(self.diretorio, exist_ok=True)
+            with self._trava:
+                self.gravados += 1
+                n = self.gravados
+            nome = f"{time.strftime('%Y%m%d-%H%M%S')}_{req.get('tool')}_{n}.prof"
+            caminho = os.path.join(self.diretorio, nome)
+            perfil.dump_stats(caminho)
+            logger.info("perfil gravado: %s (%.1f ms, args=%s)", caminho, duracao * 1000, req.get("args"))
+        except OSError:
+            logger.exception("falha gravando perfil")
+
+
+# Instância única usada pelo servidor
+PERFILADOR = Perfilador()
@@ -0,0 +1,107 @@
+# servidor/registro_log.py
+"""
+Log do servidor fora do caminho da requisição.
+
+As threads de atendimento só enfileiram o registro (QueueHandler); uma thread
+de fundo (QueueListener) formata e escreve no stderr. Assim a contenção no
+lock do stream não aparece na latência. Se a fila encher, o registro é
+descartado e contado no evento `logs_descartados` do server_stats — log
+nunca bloqueia requisição.
+
+A linha por requisição é estruturada (cliente, tool, formato dos filtros,
+duração, linhas) e amostrada por `LOG_AMOSTRA_REQUISICAO`.
+"""
+
+import atexit
+import logging
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional, Tuple
+
+from center_car.config import LOG_AMOSTRA_REQUISICAO, LOG_NIVEL, LOG_TAMANHO_FILA
+from servidor.metricas import METRICAS
+
+logger = logging.getLogger("centercar.servidor")
+
+# Campos estruturados que o formatter anexa como chave=valor, quando presentes no registro
+CAMPOS: tuple[str, ...] = ("cliente", "tool", "filtros", "duracao_ms", "linhas")
+
+_trava = threading.Lock()
+_listener: Optional[QueueListener] = None
+
+
+class FormatterEstruturado(logging.Formatter):
+    """Formato padrão do servidor seguido dos campos estruturados (chave=valor)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        base = super().format(record)
+        extras = " ".join(f"{c}={getattr(record, c)}" for c in CAMPOS if hasattr(record, c))
+        return f"{base} {extras}" if extras else base
+
+
+class QueueHandlerDescartavel(QueueHandler):
+    """QueueHandler que descarta (e conta nas métricas) em vez de bloquear ou estourar quando a fila enche."""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            METRICAS.evento("logs_descartados")
+
+
+def configura_log(nivel: str = LOG_NIVEL, tamanho_fila: int = LOG_TAMANHO_FILA) -> QueueHandlerDescartavel:
+    """
+    Troca os handlers do logger raiz por um QueueHandler + listener em thread de fundo.
+    Idempotente: chamadas seguintes devolvem o handler já instalado.
+    """
+    global _listener
+    raiz = logging.getLogger()
+    with _trava:
+        if _listener is not None:
+            return next(h for h in raiz.handlers if isinstance(h, QueueHandlerDescartavel))
+
+        saida = logging.StreamHandler(sys.stderr)
+        saida.setFormatter(FormatterEstruturado("%(asctime)s %(levelname)s %(name)s %(message)s"))
+
+        fila: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=tamanho_fila)
+        handler = QueueHandlerDescartavel(fila)
+        raiz.handlers = [handler]
+        raiz.setLevel(nivel)
+
+        _listener = QueueListener(fila, saida, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+        return handler
+
+
+def formato_filtros(filtros: Dict[str, Any]) -> str:
+    """Só as chaves, ordenadas: agrupa requisições pela forma da consulta, não pelos valores."""
+    return ",".join(sorted(filtros)) or "-"
+
+
+def log_requisicao(
+    addr: Tuple[str, int],
+    tool: str,
+    filtros: Dict[str, Any],
+    duracao: float,
+    linhas: Optional[int] = None,
+    amostra: float = LOG_AMOSTRA_REQUISICAO,
+) -> None:
+    """Linha estruturada por requisição; a decisão de amostragem vem antes de montar o registro."""
+    if amostra < 1.0 and random.random() >= amostra:
+        return
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info(
+        "requisicao",
+        extra={
+            "cliente": f"{addr[0]}:{addr[1]}",
+            "tool": tool,
+            "filtros": formato_filtros(filtros),
+            "duracao_ms": round(duracao * 1000, 3),
+            "linhas": "-" if linhas is None else linhas,
+        },
+    )
@@ -0,0 +1,163 @@
+# servidor/replica_memoria.py
+"""
+Réplica de leitura em memória do banco SQLite, para o search_cars.
+
+O estoque muda poucas vezes por hora e é lido milhares de vezes por segundo:
+em vez de cada leitura ir ao arquivo, o servidor copia o arquivo inteiro para
+um banco em memória com a API de backup do sqlite3 e atende as buscas dali.
+
+Cada cópia é um banco em memória com cache compartilhado e nome próprio
+("file:centercar_replica_<n>?mode=memory&cache=shared"): uma conexão "âncora"
+mantém o banco vivo e o engine da geração abre quantas conexões precisar para
+ele. A cópia nova é montada inteira por fora e só então entra no lugar da
+antiga (troca de uma referência, sob trava) — consulta em andamento continua
+na geração em que começou e nenhuma vê réplica pela metade. A geração velha
+some quando a última conexão dela fecha.
+
+Uma thread confere a versão dos dados no disco a cada `intervalo` segundos e
+reconstrói quando ela muda (ou, com `idade_max` > 0, quando a cópia envelhece).
+"""
+
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from center_car.config import REPLICA_IDADE_MAX, REPLICA_INTERVALO
+from center_car.modelo_veiculo import OPCAO_ARQUIVO
+from servidor.metricas import METRICAS
+
+logger = logging.getLogger("centercar.replica")
+
+# nomes únicos entre todas as réplicas do processo (uma por arquivo de dados)
+_NUMERACAO = itertools.count()
+
+
+class _Geracao:
+    """Uma cópia pronta: conexão âncora + engine/sessionmaker apontando para ela."""
+
+    def __init__(self, caminho: str, versao: Callable[[object], int]) -> None:
+        uri = f"file:centercar_replica_{next(_NUMERACAO)}?mode=memory&cache=shared"
+        self.ancora = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        origem = sqlite3.connect(caminho)
+        try:
+            # backup copia um instantâneo consistente, mesmo com escritas concorrentes no arquivo
+            origem.backup(self.ancora)
+        finally:
+            origem.close()
+        # NullPool: cada sessão abre (barato, é memória) e fecha a sua conexão. Com pool, o SQLAlchemy usaria
+        # SingletonThreadPool para "mode=memory", cujo dispose fecha conexões em uso por outras threads.
+        # OPCAO_ARQUIVO: o esquema dicionário guarda os nomes dos lookups por arquivo de dados, não por geração
+        self.engine = create_engine(
+            f"sqlite:///{uri}&uri=true",
+            connect_args={"check_same_thread": False},
+            poolclass=NullPool,
+            execution_options={OPCAO_ARQUIVO: caminho},
+        )
+        self.Sessao = sessionmaker(bind=self.engine)
+        # versão lida da própria cópia: é exatamente a dos dados copiados
+        with self.Sessao() as sessao:
+            self.versao = versao(sessao)
+        self.criada = time.monotonic()
+
+    def descarta(self) -> None:
+        self.engine.dispose()
+        self.ancora.close()
+
+
+class ReplicaMemoria:
+    """
+    Réplica em memória de um arquivo SQLite (o banco único ou um shard).
+
+    `versao(sessao)` devolve a versão dos dados vista pela sessão (o
+    `versao_dados` do servidor); `sessao_disco()` abre uma sessão no arquivo,
+    para a checagem periódica.
+    """
+
+    def __init__(
+        self,
+        caminho: str,
+        versao: Callable[[object], int],
+        sessao_disco: Callable[[], object],
+        intervalo: float = REPLICA_INTERVALO,
+        idade_max: float = REPLICA_IDADE_MAX,
+    ) -> None:
+        self.caminho = caminho
+        self._versao = versao
+        self._sessao_disco = sessao_disco
+        self.intervalo = intervalo
+        self.idade_max = idade_max
+        self._trava = threading.Lock()
+        self._reconstrucao = threading.Lock()
+        self._atual: Optional[_Geracao] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def versao(self) -> int:
+        """Versão dos dados da cópia atual (-1 antes da primeira)."""
+        atual = self._atual
+        return atual.versao if atual is not None else -1
+
+    def sessao(self):
+        """Sessão de leitura na cópia atual (constrói a primeira, se preciso)."""
+        if self._atual is None:
+            self.reconstroi()
+        with self._trava:
+            sessao = self._atual.Sessao()
+            # conecta já, sob a trava: a conexão aberta segura a geração viva mesmo se ela for trocada
+            # antes da consulta (conectando depois, pegaria um banco em memória vazio com o mesmo nome)
+            sessao.connection()
+        return sessao
+
+    def reconstroi(self) -> None:
+        """Copia o arquivo para uma geração nova e troca. Reconstruções concorrentes viram uma só."""
+        with self._reconstrucao:
+            t0 = time.perf_counter()
+            nova = _Geracao(self.caminho, self._versao)
+            with self._trava:
+                antiga, self._atual = self._atual, nova
+                if antiga is not None:
+                    antiga.descarta()
+            METRICAS.evento("replica_trocas")
+            logger.info(
+                "réplica de %s na versão %d (%.1f ms)", self.caminho, nova.versao, (time.perf_counter() - t0) * 1000
+            )
+
+    def verifica(self) -> bool:
+        """Uma rodada da checagem: reconstrói se a versão no disco mudou ou a cópia passou de `idade_max`."""
+        atual = self._atual
+        if atual is None:
+            self.reconstroi()
+            return True
+        vencida = self.idade_max > 0 and time.monotonic() - atual.criada >= self.idade_max
+        if not vencida:
+            sessao = self._sessao_disco()
+            try:
+                if self._versao(sessao) == atual.versao:
+                    return False
+            finally:
+                sessao.close()
+        self.reconstroi()
+        return True
+
+    def inicia(self) -> None:
+        """Constrói a primeira cópia agora e sobe a thread que a mantém em dia."""
+        self.reconstroi()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._vigia, name="centercar-replica", daemon=True)
+            self._thread.start()
+
+    def _vigia(self) -> None:
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.verifica()
+            except Exception:
+                # falha (arquivo travado, disco) não derruba a réplica: segue servindo a cópia atual
+                logger.exception("falha atualizando a réplica de %s", self.caminho)
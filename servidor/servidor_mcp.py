@@ -1,18 +1,230 @@
+import heapq
 import json
-import logging
+import os
+import signal
 import socket
+import sys
 import threading
-from typing import Any, Dict, List, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from itertools import islice
+from operator import attrgetter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-from center_car.banco_dados import obter_sessao
-from center_car.config import HOST, PORTA
-from center_car.modelo_veiculo import Veiculo
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from center_car.banco_dados import (
+    arquivos_de_dados,
+    obter_sessao,
+    obter_sessao_shard,
+    sessoes_de_dados,
+    shards_da_consulta,
+    shards_dos_ids,
+    usa_shards,
+)
+from center_car.config import (
+    CACHE_LINHAS_MAX,
+    CHAVES_CLIENTES,
+    COALESCER_CONSULTAS,
+    ESCRITA_ATRASO_MS,
+    ESCRITA_HABILITADA,
+    ESCRITA_MAX_ITENS,
+    HOST,
+    LIMITE_MODO,
+    MAX_BYTES_RESPOSTA,
+    MAX_LINHAS_RESPOSTA,
+    MAX_REQUISICAO_BYTES,
+    N_SHARDS,
+    PODA_INTERVALO,
+    PORTA,
+    PRAZO_MAX_MS,
+    PRAZO_PADRAO_MS,
+    RAJADA_POR_CLIENTE,
+    REPLICA_MEMORIA,
+    RETENCAO_ALTERACOES,
+    SNAPSHOT_CAMINHO,
+    SNAPSHOT_INTERVALO,
+    TAXA_POR_CLIENTE,
+    WORKERS_CONSULTA,
+)
+from center_car.dicionario import igual
+from center_car.indice_ngramas import CAMPOS_FUZZY, IndiceNgramas
+from center_car.modelo_veiculo import AlteracaoVeiculo, Veiculo
+from center_car.protocolo import (
+    TAMANHO_HEADER,
+    FrameGrandeDemais,
+    FrameInvalido,
+    codifica,
+    decodifica,
+    escolhe_compressao,
+    frame,
+    le_frame,
+    recomprime_frame,
+)
+from servidor.agendador import AgendadorJusto, LimitadorTaxa
+from servidor.cache_linhas import CacheLinhas
+from servidor.coalescencia import SingleFlight
+from servidor.consulta_lenta import CONSULTAS_LENTAS
+from servidor.escritas import OP_PRECOS, OP_UPSERT, STATUS_GRAVADO, VALIDADORES, ack_invalido, apaga_copias, grava
+from servidor.escritor import CommitParcial, EscritorEmGrupo
+from servidor.indice_fuzzy import IndiceFuzzy
+from servidor.memoria import MEMORIA
+from servidor.metricas import METRICAS, TOOL_DESCONHECIDA, TOOL_INVALIDA, TOOL_LEGADO
+from servidor.perfilador import PERFILADOR
+from servidor.registro_log import configura_log, formato_filtros, log_requisicao, logger
+from servidor.replica_memoria import ReplicaMemoria
+from servidor.snapshot_caches import SnapshotCaches
 
 # Configuração
-BUFFER_SIZE: int = 64 * 1024  # 64 KiB
 EXPECTED_TOOL = "search_cars"
+TOOL_SUBSCRIBE = "subscribe_cars"
+TOOL_STATS = "server_stats"
+TOOL_SUGGEST = "suggest"
+TOOL_POR_IDS = "get_cars_by_ids"
+TOOL_UPSERT = OP_UPSERT
+TOOL_PRECOS = OP_PRECOS
+
+# Tools MCP: nome -> função que atende a chamada (ver `ferramenta`, mais abaixo)
+FERRAMENTAS: Dict[str, Callable[["Chamada"], None]] = {}
+
+# get_cars_by_ids: máx. de ids por chamada e por IN (limite de variáveis do SQLite)
+MAX_IDS_POR_CHAMADA: int = 1000
+LOTE_IN: int = 500
+
+# upsert_cars / update_prices: máx. de itens por chamada
+MAX_ITENS_POR_ESCRITA: int = 1000
+
+# suggest: candidatos por campo (padrão e teto)
+LIMITE_SUGESTOES: int = 5
+MAX_SUGESTOES: int = 20
+
+# Change feed (subscribe_cars)
+LOTE_SUBSCRICAO: int = 1000  # máx. de deltas por frame enviado
+INTERVALO_SUBSCRICAO: float = 0.5  # s entre consultas ao log de alterações
+HEARTBEAT_SUBSCRICAO: float = 15.0  # s sem mudanças até mandar um frame vazio (detecta cliente morto)
+
+# Prazo: o progress handler do SQLite é chamado a cada N instruções da VM (~0,1 ms de granularidade)
+PASSOS_PROGRESSO: int = 10_000
+
+# search_cars idênticos em voo ao mesmo tempo compartilham uma execução (consulta + encode)
+COALESCEDOR = SingleFlight()
+
+# Justiça entre clientes: token bucket por cliente e pool de consultas com fila round-robin por cliente
+LIMITADOR = LimitadorTaxa(TAXA_POR_CLIENTE, RAJADA_POR_CLIENTE)
+AGENDADOR = AgendadorJusto(WORKERS_CONSULTA)
+
+# ------------------------ Busca fuzzy (suggest / search_cars "fuzzy") ------------------------ #
+
+
+def _versao_global() -> int:
+    """Versão dos dados somando os logs de alterações de todos os arquivos (só cresce)."""
+    total = 0
+    for sessao in sessoes_de_dados():
+        try:
+            total += versao_dados(sessao)
+        finally:
+            sessao.close()
+    return total
+
+
+# seq do log de cada arquivo que o índice fuzzy atual já cobre (arquivo i -> seq)
+_SEQS_FUZZY: Dict[int, int] = {}
+# acima disso, as alterações desde a última conferência não são lidas uma a uma: reconstrói
+MAX_ALTERACOES_FUZZY: int = 10_000
+
+
+def _valores_fuzzy() -> Tuple[int, Dict[str, List[str]]]:
+    """(versão, valores distintos de marca/modelo) para construir o índice fuzzy."""
+    versao = 0
+    seqs: Dict[int, int] = {}
+    valores: Dict[str, set] = {campo: set() for campo in CAMPOS_FUZZY}
+    for i, sessao in enumerate(sessoes_de_dados()):
+        try:
+            seqs[i] = versao_dados(sessao)
+            versao += seqs[i]
+            for marca, modelo in sessao.query(Veiculo.marca, Veiculo.modelo).distinct():
+                valores["marca"].add(marca)
+                valores["modelo"].add(modelo)
+        finally:
+            sessao.close()
+    _SEQS_FUZZY.clear()
+    _SEQS_FUZZY.update(seqs)
+    return versao, {campo: sorted(v) for campo, v in valores.items()}
+
+
+def _marca_modelo_mudaram(indices: Dict[str, IndiceNgramas]) -> bool:
+    """
+    As escritas desde a última conferência podem ter mudado os valores distintos de marca/modelo?
+    Insert e delete sim; update só se deixou na linha um valor que o índice não tem (preço,
+    quilometragem etc. não mexem nele). Um valor que sumiu por update fica até a próxima
+    reconstrução — no máximo o fuzzy sugere um nome que hoje não casa com nada.
+    """
+    seqs: Dict[int, int] = {}
+    sessoes = sessoes_de_dados()
+    try:
+        for i, sessao in enumerate(sessoes):
+            seqs[i] = seq = versao_dados(sessao)
+            anterior = _SEQS_FUZZY.get(i)
+            if anterior is None or seq < anterior or not log_cobre(sessao, anterior):
+                # índice vindo do snapshot, log recriado (banco trocado) ou podado: não dá para saber o que mudou
+                return True
+            if seq == anterior:
+                continue
+            alteracoes = (
+                sessao.query(AlteracaoVeiculo.veiculo_id, AlteracaoVeiculo.operacao)
+                .filter(AlteracaoVeiculo.seq > anterior, AlteracaoVeiculo.seq <= seq)
+                .limit(MAX_ALTERACOES_FUZZY + 1)
+                .all()
+            )
+            if len(alteracoes) > MAX_ALTERACOES_FUZZY or any(op != "update" for _, op in alteracoes):
+                return True
+            ids = {vid for vid, _ in alteracoes}
+            for marca, modelo in sessao.query(Veiculo.marca, Veiculo.modelo).filter(Veiculo.id.in_(ids)).distinct():
+                if not (indices["marca"].tem(marca) and indices["modelo"].tem(modelo)):
+                    return True
+    finally:
+        for sessao in sessoes:
+            sessao.close()
+    _SEQS_FUZZY.update(seqs)
+    return False
+
+
+INDICE_FUZZY = IndiceFuzzy(_versao_global, _valores_fuzzy, mudou=_marca_modelo_mudaram)
+
+# get_cars_by_ids: linhas já serializadas, por id (invalidadas pelo log de alterações)
+CACHE_LINHAS = CacheLinhas(CACHE_LINHAS_MAX)
+
+
+# ------------------------ Snapshot de subida quente ------------------------ #
+
+
+def _identidade_dados() -> Tuple[int, Tuple[Tuple[str, int, int], ...]]:
+    """(versão dos dados, (arquivo, tamanho, mtime) de cada arquivo): o que um snapshot precisa bater para valer."""
+    assinatura = tuple((c, st.st_size, st.st_mtime_ns) for c in arquivos_de_dados() for st in [os.stat(c)])
+    return _versao_global(), assinatura
+
+
+# estruturas que sobrevivem ao restart (None = snapshot desligado)
+SNAPSHOT: Optional[SnapshotCaches] = None
+if SNAPSHOT_CAMINHO:
+    SNAPSHOT = SnapshotCaches(SNAPSHOT_CAMINHO, _identidade_dados)
+    SNAPSHOT.registra("indice_fuzzy", INDICE_FUZZY.exporta, INDICE_FUZZY.importa)
+    SNAPSHOT.registra("cache_linhas", CACHE_LINHAS.exporta, CACHE_LINHAS.importa)
+
+# Réplicas em memória para o search_cars (uma por arquivo de dados; vazia = lê do disco)
+REPLICAS: List[ReplicaMemoria] = []
+
+# Scatter-gather nos shards (criado na primeira busca particionada)
+_EXECUTOR_SHARDS: Optional[ThreadPoolExecutor] = None
+_TRAVA_EXECUTOR = threading.Lock()
+
+
+class PrazoExcedido(Exception):
+    """A requisição estourou o prazo; vira erro MCP TIMEOUT."""
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 # ------------------------ Filtros / Util ------------------------ #
 
@@ -21,9 +233,10 @@ def aplicar_filtros(query, filtros):
     """
     Recebe um Query de SQLAlchemy e um dict de filtros,
     aplica-os na consulta e retorna o query resultante.
+    Igualdade em colunas de lookup passa por `igual` (compara o id no esquema dicionário).
     """
     if "marca" in filtros:
-        query = query.filter(Veiculo.marca == filtros["marca"])
+        query = query.filter(igual("marca", filtros["marca"]))
 
     if "modelo" in filtros:
         termo = f"%{filtros['modelo']}%"
@@ -36,44 +249,97 @@ def aplicar_filtros(query, filtros):
         query = query.filter(Veiculo.ano <= filtros["ano_max"])
 
     if "tipo_combustivel" in filtros:
-        query = query.filter(Veiculo.tipo_combustivel == filtros["tipo_combustivel"])
+        query = query.filter(igual("tipo_combustivel", filtros["tipo_combustivel"]))
+
+    if "preco_min" in filtros:
+        query = query.filter(Veiculo.preco >= filtros["preco_min"])
 
     if "preco_max" in filtros:
         query = query.filter(Veiculo.preco <= filtros["preco_max"])
 
+    if "quilometragem_max" in filtros:
+        query = query.filter(Veiculo.quilometragem <= filtros["quilometragem_max"])
+
+    if "numero_portas" in filtros:
+        query = query.filter(Veiculo.numero_portas == filtros["numero_portas"])
+
+    if "transmissao" in filtros:
+        query = query.filter(igual("transmissao", filtros["transmissao"]))
+
+    if "cor" in filtros:
+        query = query.filter(igual("cor", filtros["cor"]))
+
+    # paginação: continua depois do último id da página anterior
+    if "cursor" in filtros:
+        query = query.filter(Veiculo.id > filtros["cursor"])
+
     return query
 
 
-def _recv_all(conn: socket.socket, total_bytes: int) -> bytes:
-    """Lê exatamente `total_bytes` bytes do socket (ou menos, se a conexão encerrar)."""
-    chunks: List[bytes] = []
-    bytes_lidos = 0
-    while bytes_lidos < total_bytes:
-        to_read = min(BUFFER_SIZE, total_bytes - bytes_lidos)
-        parte = conn.recv(to_read)
-        if not parte:
-            break
-        chunks.append(parte)
-        bytes_lidos += len(parte)
-    return b"".join(chunks)
+def _veiculo_para_dict(v: Veiculo) -> Dict[str, Any]:
+    """Converte um Veiculo no formato de resposta do protocolo."""
+    return {
+        "id": v.id,
+        "marca": v.marca,
+        "modelo": v.modelo,
+        "ano": v.ano,
+        "tipo_combustivel": v.tipo_combustivel,
+        "cor": v.cor,
+        "quilometragem": v.quilometragem,
+        "numero_portas": v.numero_portas,
+        "transmissao": v.transmissao,
+        "preco": v.preco,
+    }
 
 
 def _ok(result: List[Dict[str, Any]]) -> bytes:
-    body = {"ok": True, "result": result}
-    data = json.dumps(body).encode("utf-8")
-    return len(data).to_bytes(4, "big") + data
+    return codifica({"ok": True, "result": result})
+
+
+def _frame_alteracoes(deltas: List[Dict[str, Any]], seq: Optional[int], reinicio: bool = False) -> bytes:
+    corpo: Dict[str, Any] = {"ok": True, "result": deltas, "seq": seq}
+    if reinicio:
+        corpo["reinicio"] = True
+    return codifica(corpo)
+
+
+def _ok_pagina(result: List[Dict[str, Any]], truncado: bool) -> bytes:
+    """
+    Resposta do search_cars respeitando MAX_BYTES_RESPOSTA.
+    Página truncada (por linhas ou bytes) sai com "truncado": true e o "cursor"
+    (último id) para o cliente pedir a próxima.
+    """
+    data = json.dumps({"ok": True, "result": result}).encode("utf-8")
+    if truncado or len(data) > MAX_BYTES_RESPOSTA:
+        # raro: só re-serializa quando precisa anexar cursor ou cortar por tamanho
+        result, truncado = _corta_por_bytes(result, truncado)
+        body: Dict[str, Any] = {"ok": True, "result": result}
+        if truncado and result:
+            body.update(truncado=True, cursor=result[-1]["id"])
+        data = json.dumps(body).encode("utf-8")
+    return frame(data)
+
+
+def _corta_por_bytes(result: List[Dict[str, Any]], truncado: bool) -> Tuple[List[Dict[str, Any]], bool]:
+    """Maior prefixo de `result` que cabe em MAX_BYTES_RESPOSTA (com folga para o envelope)."""
+    orcamento = MAX_BYTES_RESPOSTA - 128
+    usados = 0
+    for i, item in enumerate(result):
+        usados += len(json.dumps(item).encode("utf-8")) + 2
+        if usados > orcamento:
+            return result[: max(i, 1)], True
+    return result, truncado
 
 
-def _erro(code: str, message: str) -> bytes:
-    body = {"ok": False, "error": {"code": code, "message": message}}
-    data = json.dumps(body).encode("utf-8")
-    return len(data).to_bytes(4, "big") + data
+def _erro(code: str, message: str, **extra: Any) -> bytes:
+    return codifica({"ok": False, "error": {"code": code, "message": message, **extra}})
 
 
 def _validar_args(f: Dict[str, Any]) -> Dict[str, Any]:
     """
     Validação simples dos filtros recebidos (tipos/chaves conhecidas).
-    Ignora o que não bater com o esperado.
+    Ignora o que não bater com o esperado (inclusive true/false nos campos
+    numéricos: em Python, bool é subclasse de int).
     """
     out: Dict[str, Any] = {}
     if isinstance(f.get("marca"), str):
@@ -82,135 +348,993 @@ def _validar_args(f: Dict[str, Any]) -> Dict[str, Any]:
         out["modelo"] = f["modelo"]
     if isinstance(f.get("tipo_combustivel"), str):
         out["tipo_combustivel"] = f["tipo_combustivel"]
-    if isinstance(f.get("ano_min"), int):
+    if isinstance(f.get("transmissao"), str):
+        out["transmissao"] = f["transmissao"]
+    if isinstance(f.get("cor"), str):
+        out["cor"] = f["cor"]
+    if _inteiro(f.get("numero_portas")):
+        out["numero_portas"] = f["numero_portas"]
+    if _inteiro(f.get("ano_min")):
         out["ano_min"] = f["ano_min"]
-    if isinstance(f.get("ano_max"), int):
+    if _inteiro(f.get("ano_max")):
         out["ano_max"] = f["ano_max"]
-    if isinstance(f.get("preco_max"), (int, float)):
+    if isinstance(f.get("preco_min"), (int, float)) and not isinstance(f["preco_min"], bool):
+        out["preco_min"] = float(f["preco_min"])
+    if isinstance(f.get("preco_max"), (int, float)) and not isinstance(f["preco_max"], bool):
         out["preco_max"] = float(f["preco_max"])
+    if isinstance(f.get("quilometragem_max"), (int, float)) and not isinstance(f["quilometragem_max"], bool):
+        out["quilometragem_max"] = float(f["quilometragem_max"])
+    if _inteiro(f.get("cursor")) and f["cursor"] >= 0:
+        out["cursor"] = f["cursor"]
+    if _inteiro(f.get("limite")) and f["limite"] > 0:
+        out["limite"] = f["limite"]
     return out
 
 
+def _inteiro(valor: Any) -> bool:
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+
+# ------------------------ Change feed (subscribe_cars) ------------------------ #
+
+
+def versao_dados(sessao) -> int:
+    """Último `seq` do log de alterações (0 se nada foi escrito desde a criação do log)."""
+    return sessao.query(func.max(AlteracaoVeiculo.seq)).scalar() or 0
+
+
+def log_cobre(sessao, desde: int) -> bool:
+    """
+    O log ainda tem todas as entradas depois de `desde`? Falso se a poda já
+    apagou alguma delas ou se `desde` é de outro log (maior que o último seq).
+    """
+    primeiro, ultimo = sessao.query(func.min(AlteracaoVeiculo.seq), func.max(AlteracaoVeiculo.seq)).one()
+    if ultimo is None:
+        return desde == 0
+    return primeiro - 1 <= desde <= ultimo
+
+
+def poda_alteracoes(sessao, manter: int = RETENCAO_ALTERACOES) -> int:
+    """Apaga do log as entradas mais antigas, mantendo as `manter` mais recentes (0 = mantém todas)."""
+    if manter <= 0:
+        return 0
+    limite = versao_dados(sessao) - manter
+    apagadas = sessao.query(AlteracaoVeiculo).filter(AlteracaoVeiculo.seq <= limite).delete(synchronize_session=False)
+    sessao.commit()
+    return apagadas
+
+
+def _poda_sempre(intervalo: float) -> None:
+    while True:
+        time.sleep(intervalo)
+        for sessao in sessoes_de_dados():
+            try:
+                METRICAS.evento("alteracoes_podadas", poda_alteracoes(sessao))
+            except Exception:
+                # banco travado por uma escrita longa: tenta de novo na próxima rodada
+                logger.exception("falha podando o log de alterações")
+            finally:
+                sessao.close()
+
+
+def inicia_poda_alteracoes() -> None:
+    """Sobe a thread que mantém o log de alterações em RETENCAO_ALTERACOES entradas por arquivo."""
+    if RETENCAO_ALTERACOES > 0 and PODA_INTERVALO > 0:
+        threading.Thread(target=_poda_sempre, args=(PODA_INTERVALO,), name="centercar-poda", daemon=True).start()
+
+
+def alteracoes_desde(sessao, desde: int, limite: int = LOTE_SUBSCRICAO) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Lê até `limite` entradas do log com seq > `desde` e devolve (deltas, último seq lido).
+
+    Várias alterações do mesmo veículo na janela viram um único delta com a
+    última operação. Inserts/updates levam o estado atual da linha; se ela não
+    existe mais (apagada depois), o delta sai como delete.
+    """
+    entradas = (
+        sessao.query(AlteracaoVeiculo)
+        .filter(AlteracaoVeiculo.seq > desde)
+        .order_by(AlteracaoVeiculo.seq)
+        .limit(limite)
+        .all()
+    )
+    if not entradas:
+        return [], desde
+
+    ultima_op: Dict[int, str] = {}
+    for e in entradas:
+        # re-inserir mantém a ordem de chegada pela última alteração
+        ultima_op.pop(e.veiculo_id, None)
+        ultima_op[e.veiculo_id] = e.operacao
+
+    vivos = [vid for vid, op in ultima_op.items() if op != "delete"]
+    linhas = {v.id: v for v in sessao.query(Veiculo).filter(Veiculo.id.in_(vivos)).all()} if vivos else {}
+
+    deltas: List[Dict[str, Any]] = []
+    for vid, op in ultima_op.items():
+        v = linhas.get(vid)
+        if op == "delete" or v is None:
+            deltas.append({"op": "delete", "id": vid})
+        else:
+            deltas.append({"op": op, "id": vid, "veiculo": _veiculo_para_dict(v)})
+    return deltas, entradas[-1].seq
+
+
+def _validar_args_subscricao(f: Dict[str, Any]) -> Optional[int]:
+    """Extrai o cursor `desde` (int >= 0); None significa "começar com snapshot completo"."""
+    desde = f.get("desde")
+    if isinstance(desde, int) and not isinstance(desde, bool) and desde >= 0:
+        return desde
+    return None
+
+
+def _envia_snapshot(conn: socket.socket, algoritmo: Optional[str] = None) -> int:
+    """
+    Envia todas as linhas atuais como deltas 'insert', em lotes.
+    Só o último frame leva `seq` (os anteriores vão com null), para que um
+    consumidor que caia no meio do snapshot não salve um cursor incompleto.
+    O primeiro leva "reinicio": true — quem já tinha uma cópia descarta a
+    antiga e monta uma nova a partir dele.
+    """
+    sessao = obter_sessao()
+    try:
+        seq = versao_dados(sessao)
+        ultimo_id = 0
+        primeiro = True
+        while True:
+            lote = (
+                sessao.query(Veiculo).filter(Veiculo.id > ultimo_id).order_by(Veiculo.id).limit(LOTE_SUBSCRICAO).all()
+            )
+            fim = len(lote) < LOTE_SUBSCRICAO
+            deltas = [{"op": "insert", "id": v.id, "veiculo": _veiculo_para_dict(v)} for v in lote]
+            conn.sendall(_comprime(_frame_alteracoes(deltas, seq if fim else None, primeiro), algoritmo))
+            primeiro = False
+            if fim:
+                return seq
+            ultimo_id = lote[-1].id
+    finally:
+        sessao.close()
+
+
+def assina_alteracoes(
+    conn: socket.socket, addr: Tuple[str, int], args: Dict[str, Any], algoritmo: Optional[str] = None
+) -> None:
+    """
+    Mantém a conexão aberta e empurra deltas do log de alterações.
+
+    Sem `desde`, começa com um snapshot completo; com `desde`, retoma do
+    cursor informado (o `seq` do último frame recebido antes de cair) — ou
+    manda o snapshot completo, se o log já foi podado além dele.
+    Frames grandes saem comprimidos com `algoritmo`, se negociado.
+    Termina quando o cliente desconecta (sendall falha).
+    """
+    cursor = _validar_args_subscricao(args)
+    logger.info("MCP %s %s desde=%s", addr, TOOL_SUBSCRIBE, cursor)
+
+    try:
+        if cursor is not None:
+            sessao = obter_sessao()
+            try:
+                cobre = log_cobre(sessao, cursor)
+            finally:
+                sessao.close()
+            if not cobre:
+                logger.info("MCP %s %s desde=%s fora do log: snapshot completo", addr, TOOL_SUBSCRIBE, cursor)
+                cursor = None
+        if cursor is None:
+            cursor = _envia_snapshot(conn, algoritmo)
+
+        ultimo_envio = time.monotonic()
+        while True:
+            sessao = obter_sessao()
+            try:
+                deltas, novo_cursor = alteracoes_desde(sessao, cursor)
+            finally:
+                sessao.close()
+
+            if deltas or time.monotonic() - ultimo_envio >= HEARTBEAT_SUBSCRICAO:
+                conn.sendall(_comprime(_frame_alteracoes(deltas, novo_cursor), algoritmo))
+                cursor = novo_cursor
+                ultimo_envio = time.monotonic()
+
+            # lote cheio: provavelmente há mais pendente, não espera
+            if len(deltas) < LOTE_SUBSCRICAO:
+                time.sleep(INTERVALO_SUBSCRICAO)
+    except OSError:
+        logger.info("MCP %s %s encerrada", addr, TOOL_SUBSCRIBE)
+
+
 # ------------------------ Handler da conexão ------------------------ #
 
 
+def _envia(conn: socket.socket, dados: bytes) -> int:
+    """sendall cronometrado (fase "send"); devolve os bytes enviados para os contadores."""
+    t0 = time.perf_counter()
+    conn.sendall(dados)
+    METRICAS.observa("send", time.perf_counter() - t0)
+    return len(dados)
+
+
+def _busca(filtros: Dict[str, Any], prazo: Optional[float] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Executa o search_cars, separando o tempo de SQL/ORM ("consulta") da montagem dos dicts ("hidratacao").
+    Consultas acima do limiar vão para o log de consultas lentas (com EXPLAIN QUERY PLAN).
+
+    Traz no máximo MAX_LINHAS_RESPOSTA (ou `limite`, se menor) em ordem de id;
+    devolve (resultados, truncado) — truncado se havia mais linhas.
+    Com `prazo`, a consulta é abortada dentro do SQLite quando ele passa (PrazoExcedido).
+    Com shards, a mesma consulta roda em paralelo nos shards relevantes e os resultados são intercalados por id.
+    """
+    limite = min(filtros.get("limite", MAX_LINHAS_RESPOSTA), MAX_LINHAS_RESPOSTA)
+    t0 = time.perf_counter()
+    if usa_shards():
+        veiculos = _consulta_shards(filtros, limite, prazo)
+    else:
+        veiculos = _consulta_em(_leitura(0, obter_sessao), filtros, limite, prazo)
+    t1 = time.perf_counter()
+    truncado = len(veiculos) > limite
+    resultados = [_veiculo_para_dict(v) for v in veiculos[:limite]]
+    t2 = time.perf_counter()
+    METRICAS.observa("consulta", t1 - t0)
+    METRICAS.observa("hidratacao", t2 - t1)
+    if truncado:
+        METRICAS.evento("respostas_truncadas")
+    return resultados, truncado
+
+
+def consulta_busca(sessao, filtros: Dict[str, Any], limite: int):
+    """
+    Query dos `limite` primeiros veículos (em ordem de id) que passam nos filtros.
+
+    Os filtros rodam numa subconsulta só de ids, que os índices de cobertura
+    (INDICES_COBERTURA em center_car/modelo_veiculo.py) respondem sem ler
+    páginas da tabela; a linha inteira só é lida para os ids da página.
+    """
+    ids = aplicar_filtros(sessao.query(Veiculo.id), filtros).order_by(Veiculo.id).limit(limite)
+    return sessao.query(Veiculo).filter(Veiculo.id.in_(ids.scalar_subquery())).order_by(Veiculo.id)
+
+
+def _consulta_em(obter, filtros: Dict[str, Any], limite: int, prazo: Optional[float]) -> List[Veiculo]:
+    """
+    Até `limite` + 1 veículos em ordem de id numa sessão (banco único ou um shard).
+    Consulta interrompida pelo prazo também vai para o log de lentas (são as mais lentas de todas).
+    """
+    if prazo is not None and time.perf_counter() >= prazo:
+        raise PrazoExcedido()  # estourou antes de chegar ao banco (na fila): não há consulta a registrar
+    t0 = time.perf_counter()
+    sessao = obter()
+    try:
+        # limite + 1: a linha extra só diz se há mais, sem contar a tabela toda
+        consulta = consulta_busca(sessao, filtros, limite + 1)
+        try:
+            with _prazo_sqlite(sessao, prazo):
+                veiculos = consulta.all()
+        except PrazoExcedido:
+            sessao.rollback()  # o EXPLAIN do registro roda na mesma sessão
+            CONSULTAS_LENTAS.observa(consulta, filtros, 0, time.perf_counter() - t0, interrompida=True)
+            raise
+        CONSULTAS_LENTAS.observa(consulta, filtros, len(veiculos), time.perf_counter() - t0)
+    finally:
+        sessao.close()
+    return veiculos
+
+
+def _consulta_shards(filtros: Dict[str, Any], limite: int, prazo: Optional[float]) -> List[Veiculo]:
+    """
+    Scatter-gather: cada shard relevante devolve os seus `limite` + 1 primeiros
+    por id, e o merge das listas já ordenadas dá os `limite` + 1 primeiros do
+    total — mesma ordem e mesmo corte do banco único.
+    """
+    alvos = shards_da_consulta(filtros)
+    METRICAS.evento("consultas_shard", len(alvos))
+    if len(alvos) == 1:
+        return _consulta_em(_leitura(alvos[0], partial(obter_sessao_shard, alvos[0])), filtros, limite, prazo)
+    executor = _executor_shards()
+    futuros = [
+        executor.submit(_consulta_em, _leitura(i, partial(obter_sessao_shard, i)), filtros, limite, prazo)
+        for i in alvos
+    ]
+    listas = [f.result() for f in futuros]
+    return list(islice(heapq.merge(*listas, key=attrgetter("id")), limite + 1))
+
+
+def _leitura(i: int, obter):
+    """De onde o search_cars lê o arquivo `i`: a réplica em memória, se ligada; senão `obter` (disco)."""
+    return REPLICAS[i].sessao if REPLICAS else obter
+
+
+def inicia_replicas() -> None:
+    """Copia cada arquivo de dados para a memória e sobe as threads que mantêm as cópias em dia."""
+    sessoes = [partial(obter_sessao_shard, i) for i in range(N_SHARDS)] if usa_shards() else [obter_sessao]
+    replicas = [ReplicaMemoria(c, versao_dados, s) for c, s in zip(arquivos_de_dados(), sessoes)]
+    for replica in replicas:
+        replica.inicia()
+    REPLICAS[:] = replicas
+
+
+def _executor_shards() -> ThreadPoolExecutor:
+    global _EXECUTOR_SHARDS
+    with _TRAVA_EXECUTOR:
+        if _EXECUTOR_SHARDS is None:
+            # cada worker de consulta pode estar espalhando para todos os shards ao mesmo tempo
+            _EXECUTOR_SHARDS = ThreadPoolExecutor(
+                max_workers=max(1, WORKERS_CONSULTA) * N_SHARDS, thread_name_prefix="centercar-shard"
+            )
+        return _EXECUTOR_SHARDS
+
+
+def _prazo_da_requisicao(req: Dict[str, Any], inicio: float) -> float:
+    """Instante (perf_counter) em que a requisição expira: "prazo_ms" do envelope, limitado a PRAZO_MAX_MS."""
+    prazo_ms = req.get("prazo_ms")
+    if not isinstance(prazo_ms, (int, float)) or isinstance(prazo_ms, bool) or prazo_ms <= 0:
+        prazo_ms = PRAZO_PADRAO_MS
+    return inicio + min(prazo_ms, PRAZO_MAX_MS) / 1000
+
+
+@contextmanager
+def _prazo_sqlite(sessao, prazo: Optional[float]) -> Iterator[None]:
+    """
+    Faz o próprio SQLite abortar a consulta quando `prazo` passa, via progress handler
+    na conexão DBAPI da sessão. O handler é removido na saída: a conexão volta ao pool limpa.
+    """
+    if prazo is None:
+        yield
+        return
+    if time.perf_counter() >= prazo:
+        raise PrazoExcedido()
+
+    try:
+        instala = sessao.connection().connection.driver_connection.set_progress_handler
+    except AttributeError:
+        # sessões fake dos testes não têm conexão DBAPI
+        instala = None
+
+    if instala is not None:
+        instala(lambda: 1 if time.perf_counter() >= prazo else 0, PASSOS_PROGRESSO)
+    try:
+        yield
+    except OperationalError as e:
+        # sqlite3 devolve "interrupted" quando o handler pede para abortar
+        if time.perf_counter() >= prazo:
+            raise PrazoExcedido() from e
+        raise
+    finally:
+        if instala is not None:
+            instala(None, 0)
+
+
+def _resposta_busca(filtros: Dict[str, Any], prazo: Optional[float] = None) -> Tuple[Optional[bytes], int]:
+    """
+    Busca + encode de um search_cars: devolve (frame pronto, linhas).
+    Frame None significa "excedeu o limite" no modo "erro" (quem chama responde RESULT_TOO_LARGE).
+    """
+    with MEMORIA.rastreia(formato_filtros(filtros)):
+        resultados, truncado = _busca(filtros, prazo)
+        if prazo is not None and time.perf_counter() >= prazo:
+            # não vale a pena serializar o que o cliente já desistiu de esperar
+            raise PrazoExcedido()
+        if LIMITE_MODO == "erro":
+            return (None if truncado else _encode(_ok, resultados)), len(resultados)
+        return _encode(_ok_pagina, resultados, truncado), len(resultados)
+
+
+def _resolve_fuzzy(filtros: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Troca marca/modelo digitados com erro pelo melhor candidato do índice.
+    Modelo que já aparece dentro de algum valor fica como está (o LIKE encontra).
+    Devolve só o que foi trocado ({"marca": "Volkswagen"}), para o cliente saber.
+    """
+    resolvido: Dict[str, str] = {}
+    for campo in CAMPOS_FUZZY:
+        termo = filtros.get(campo)
+        if not isinstance(termo, str):
+            continue
+        if campo == "modelo" and INDICE_FUZZY.indice(campo).contem(termo):
+            continue
+        melhor = INDICE_FUZZY.resolve(campo, termo)
+        if melhor is not None and melhor != termo:
+            filtros[campo] = resolvido[campo] = melhor
+    return resolvido
+
+
+def _frame_sugestoes(args: Dict[str, Any]) -> bytes:
+    """
+    suggest: {"termo": "volksvagem", "campo": "marca"?, "limite": 5?}
+    -> [{"campo": "marca", "valor": "Volkswagen", "score": 0.33}, ...], melhor primeiro.
+    """
+    termo = args.get("termo")
+    if not isinstance(termo, str) or not termo.strip():
+        return _erro("INVALID_REQUEST", "'termo' deve ser um texto não vazio")
+    campo = args.get("campo")
+    if campo is not None and campo not in CAMPOS_FUZZY:
+        return _erro("INVALID_REQUEST", f"'campo' deve ser um de {list(CAMPOS_FUZZY)}")
+    limite = args.get("limite")
+    if not isinstance(limite, int) or isinstance(limite, bool) or limite <= 0:
+        limite = LIMITE_SUGESTOES
+    limite = min(limite, MAX_SUGESTOES)
+
+    sugestoes = [
+        {"campo": c, "valor": valor, "score": score}
+        for c in ([campo] if campo else CAMPOS_FUZZY)
+        for valor, score in INDICE_FUZZY.sugere(c, termo, limite)
+    ]
+    sugestoes.sort(key=lambda s: -s["score"])
+    return codifica({"ok": True, "result": sugestoes[:limite]})
+
+
+def _id_cliente(req: Any, addr: Tuple[str, int]) -> str:
+    """
+    Chave de justiça/limite: a "api_key" do envelope, se for uma das CHAVES_CLIENTES; senão o IP (todas as
+    portas contam juntas). Chave desconhecida cai no IP — inventar uma por requisição não dá balde novo.
+    """
+    chave = req.get("api_key") if isinstance(req, dict) else None
+    if isinstance(chave, str) and chave in CHAVES_CLIENTES:
+        return f"key:{chave}"
+    return f"ip:{addr[0]}"
+
+
+def _agendada(cliente: str, fn, espera_max: Optional[float] = None):
+    """Executa `fn` no pool de consultas, na fila do cliente; a espera na fila vira a fase "fila"."""
+    if PERFILADOR.perfilando():
+        # o cProfile só enxerga a thread em que foi ligado: requisição perfilada roda aqui mesmo
+        return fn()
+    enfileirada = time.perf_counter()
+
+    def tarefa():
+        METRICAS.observa("fila", time.perf_counter() - enfileirada)
+        return fn()
+
+    return AGENDADOR.executa(cliente, tarefa, espera_max)
+
+
+def _encode(montar, *args) -> bytes:
+    """Serializa a resposta cronometrando a fase "encode"."""
+    t0 = time.perf_counter()
+    dados = montar(*args)
+    METRICAS.observa("encode", time.perf_counter() - t0)
+    return dados
+
+
+def _comprime(dados: bytes, algoritmo: Optional[str]) -> bytes:
+    """
+    Comprime o frame com o algoritmo negociado (fase "compressao"), se passar do limiar.
+    Os eventos bytes_pre_compressao/bytes_comprimidos dão a taxa obtida em server_stats.
+    """
+    if algoritmo is None:
+        return dados
+    t0 = time.perf_counter()
+    saida = recomprime_frame(dados, algoritmo)
+    METRICAS.observa("compressao", time.perf_counter() - t0)
+    if saida is not dados:
+        METRICAS.evento("bytes_pre_compressao", len(dados))
+        METRICAS.evento("bytes_comprimidos", len(saida))
+    return saida
+
+
+def _com_resolvido(resposta: bytes, resolvido: Dict[str, str]) -> bytes:
+    """Anexa "resolvido" ao objeto de resposta já serializado, sem re-serializar o result."""
+    extra = json.dumps({"resolvido": resolvido})[1:-1].encode("utf-8")
+    return frame(bytes(memoryview(resposta)[TAMANHO_HEADER:-1]) + b", " + extra + b"}")
+
+
+def _frame_lista(resultados: List[Dict[str, Any]]) -> bytes:
+    return codifica(resultados)
+
+
+def _frame_stats(formato: Any) -> bytes:
+    filas = _filas_por_cliente()
+    if formato == "texto":
+        return codifica({"ok": True, "result": METRICAS.texto(filas)})
+    return codifica({"ok": True, "result": METRICAS.snapshot(filas)})
+
+
+def _filas_por_cliente() -> Dict[str, int]:
+    """
+    Profundidade da fila de cada cliente no agendador, para acompanhar a justiça.
+    server_stats não pede chave: a api_key aparece só com os 4 primeiros caracteres.
+    """
+    filas: Dict[str, int] = {}
+    for cliente, n in AGENDADOR.pendentes().items():
+        if cliente.startswith("key:"):
+            cliente = cliente[:8] + "…"
+        filas[cliente] = filas.get(cliente, 0) + n
+    return filas
+
+
+# ------------------------ Tools MCP ------------------------ #
+
+
+class Chamada:
+    """Uma requisição MCP aceita (tool conhecida, dentro do limite de taxa, "args" objeto), entregue à tool."""
+
+    __slots__ = ("conn", "addr", "req", "tool", "args", "bytes_in", "inicio", "cliente", "algoritmo")
+
+    def __init__(
+        self,
+        conn: socket.socket,
+        addr: Tuple[str, int],
+        req: Dict[str, Any],
+        bytes_in: int,
+        inicio: float,
+        cliente: str,
+        algoritmo: Optional[str],
+    ) -> None:
+        self.conn = conn
+        self.addr = addr
+        self.req = req
+        self.tool: str = req["tool"]
+        self.args: Dict[str, Any] = req["args"]
+        self.bytes_in = bytes_in
+        self.inicio = inicio
+        self.cliente = cliente
+        self.algoritmo = algoritmo
+
+    def responde(self, dados: bytes, erro: bool = False) -> None:
+        """Envia um frame pronto e contabiliza a requisição na tool."""
+        enviados = _envia(self.conn, dados)
+        METRICAS.conta(self.tool, self.bytes_in, enviados, erro=erro)
+
+
+def ferramenta(nome: str) -> Callable[[Callable[[Chamada], None]], Callable[[Chamada], None]]:
+    """Registra a função decorada como a tool MCP `nome` em FERRAMENTAS."""
+
+    def registra(atende: Callable[[Chamada], None]) -> Callable[[Chamada], None]:
+        FERRAMENTAS[nome] = atende
+        return atende
+
+    return registra
+
+
+@ferramenta(TOOL_SUBSCRIBE)
+def _tool_subscribe(ch: Chamada) -> None:
+    if usa_shards():
+        # o log de alterações é por arquivo: não há um cursor único para retomar
+        ch.responde(_erro("INVALID_REQUEST", "subscribe_cars não está disponível com shards"), erro=True)
+        return
+    METRICAS.conta(ch.tool, ch.bytes_in)
+    assina_alteracoes(ch.conn, ch.addr, ch.args, ch.algoritmo)
+
+
+@ferramenta(TOOL_SUGGEST)
+def _tool_suggest(ch: Chamada) -> None:
+    t0 = time.perf_counter()
+    resposta = _frame_sugestoes(ch.args)
+    METRICAS.observa("consulta", time.perf_counter() - t0)
+    ch.responde(resposta)
+    log_requisicao(ch.addr, ch.tool, {"termo": ch.args.get("termo")}, time.perf_counter() - ch.inicio)
+
+
+@ferramenta(TOOL_STATS)
+def _tool_stats(ch: Chamada) -> None:
+    ch.responde(_comprime(_frame_stats(ch.args.get("formato")), ch.algoritmo))
+
+
+@ferramenta(EXPECTED_TOOL)
+def _tool_search_cars(ch: Chamada) -> None:
+    filtros = _validar_args(ch.args)
+    # modo fuzzy: corrige marca/modelo antes da busca (e da chave de coalescência)
+    resolvido = _resolve_fuzzy(filtros) if ch.args.get("fuzzy") is True else {}
+
+    prazo = _prazo_da_requisicao(ch.req, ch.inicio)
+
+    def busca():
+        # a consulta roda no pool, na fila deste cliente; quem estourar o prazo na fila nem chega ao banco
+        return _agendada(ch.cliente, lambda: _resposta_busca(filtros, prazo), max(0.0, prazo - time.perf_counter()))
+
+    try:
+        if COALESCER_CONSULTAS:
+            chave = json.dumps(filtros, sort_keys=True)
+            # o prazo não entra na chave: se o líder estourar o dele, quem ainda tem tempo busca com o próprio
+            (resposta, linhas), compartilhada = COALESCEDOR.executa(
+                chave,
+                busca,
+                espera_max=max(0.0, prazo - time.perf_counter()),
+                repete_erros=(PrazoExcedido, TimeoutError),
+            )
+            METRICAS.evento("buscas_coalescidas" if compartilhada else "buscas_executadas")
+        else:
+            resposta, linhas = busca()
+    except (PrazoExcedido, TimeoutError):
+        METRICAS.evento("prazos_excedidos")
+        ch.responde(_erro("TIMEOUT", "Consulta excedeu o prazo da requisição"), erro=True)
+        log_requisicao(ch.addr, ch.tool, filtros, time.perf_counter() - ch.inicio)
+        return
+    except Exception as e:
+        logger.exception("Erro processando requisição MCP")
+        ch.responde(_erro("SERVER_ERROR", str(e)), erro=True)
+        return
+
+    if resposta is None or len(resposta) - 4 > MAX_BYTES_RESPOSTA:
+        # só acontece no modo "erro": no modo "truncar" a página já vem cortada
+        limites = f"{MAX_LINHAS_RESPOSTA} linhas / {MAX_BYTES_RESPOSTA} bytes"
+        ch.responde(_erro("RESULT_TOO_LARGE", f"Resultado excede o limite ({limites}); refine os filtros"), erro=True)
+        return
+
+    if resolvido:
+        resposta = _com_resolvido(resposta, resolvido)
+    # a resposta pode ser compartilhada (coalescida): comprime por conexão, conforme o que ela negociou
+    ch.responde(_comprime(resposta, ch.algoritmo))
+    log_requisicao(ch.addr, ch.tool, filtros, time.perf_counter() - ch.inicio, linhas)
+
+
+def _validar_ids(args: Dict[str, Any]) -> Optional[List[int]]:
+    """ "ids": lista de 1 a MAX_IDS_POR_CHAMADA inteiros; devolve sem repetições, na ordem pedida (None se inválido)."""
+    ids = args.get("ids")
+    if not isinstance(ids, list) or not 0 < len(ids) <= MAX_IDS_POR_CHAMADA:
+        return None
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return None
+    return list(dict.fromkeys(ids))
+
+
+def _linhas_por_ids(ids: List[int], prazo: Optional[float] = None) -> Dict[int, bytes]:
+    """
+    JSON de cada veículo existente entre `ids`: do cache de linhas, e o que faltar
+    num `IN` por arquivo de dados (lido da réplica em memória, se ligada).
+    """
+    if usa_shards():
+        fontes = [_leitura(i, partial(obter_sessao_shard, i)) for i in range(N_SHARDS)]
+    else:
+        fontes = [_leitura(0, obter_sessao)]
+    sessoes = [obter() for obter in fontes]
+    try:
+        t0 = time.perf_counter()
+        # primeiro aplica as escritas do log; a geração dali em diante protege o `guarda` de leituras atrasadas
+        for i, sessao in enumerate(sessoes):
+            geracao = CACHE_LINHAS.sincroniza(i, sessao)
+        linhas, faltando = CACHE_LINHAS.busca(ids)
+        veiculos: List[Veiculo] = []
+        for i, grupo in shards_dos_ids(faltando).items() if faltando else ():
+            with _prazo_sqlite(sessoes[i], prazo):
+                for k in range(0, len(grupo), LOTE_IN):
+                    lote = grupo[k : k + LOTE_IN]
+                    veiculos.extend(sessoes[i].query(Veiculo).filter(Veiculo.id.in_(lote)).all())
+        t1 = time.perf_counter()
+        novas = {v.id: json.dumps(_veiculo_para_dict(v)).encode("utf-8") for v in veiculos}
+        METRICAS.observa("consulta", t1 - t0)
+        METRICAS.observa("hidratacao", time.perf_counter() - t1)
+    finally:
+        for sessao in sessoes:
+            sessao.close()
+    CACHE_LINHAS.guarda(novas, geracao)
+    linhas.update(novas)
+    return linhas
+
+
+def _frame_por_ids(ids: List[int], linhas: Dict[int, bytes]) -> bytes:
+    """{"ok": true, "result": [...na ordem dos ids...], "faltando": [ids inexistentes]}, juntando os JSONs prontos."""
+    achados = [linhas[i] for i in ids if i in linhas]
+    faltando = [i for i in ids if i not in linhas]
+    corpo = b'{"ok": true, "result": [' + b", ".join(achados) + b'], "faltando": ' + json.dumps(faltando).encode()
+    return frame(corpo + b"}")
+
+
+@ferramenta(TOOL_POR_IDS)
+def _tool_get_cars_by_ids(ch: Chamada) -> None:
+    ids = _validar_ids(ch.args)
+    if ids is None:
+        msg = f"'ids' deve ser uma lista de 1 a {MAX_IDS_POR_CHAMADA} inteiros"
+        ch.responde(_erro("INVALID_REQUEST", msg), erro=True)
+        return
+    prazo = _prazo_da_requisicao(ch.req, ch.inicio)
+    try:
+        linhas = _agendada(ch.cliente, lambda: _linhas_por_ids(ids, prazo), max(0.0, prazo - time.perf_counter()))
+    except (PrazoExcedido, TimeoutError):
+        METRICAS.evento("prazos_excedidos")
+        ch.responde(_erro("TIMEOUT", "Consulta excedeu o prazo da requisição"), erro=True)
+        return
+    except Exception as e:
+        logger.exception("Erro processando requisição MCP")
+        ch.responde(_erro("SERVER_ERROR", str(e)), erro=True)
+        return
+    ch.responde(_comprime(_encode(_frame_por_ids, ids, linhas), ch.algoritmo))
+    log_requisicao(ch.addr, ch.tool, {"ids": len(ids)}, time.perf_counter() - ch.inicio, len(linhas))
+
+
+# ------------------------ Escritas (upsert_cars / update_prices) ------------------------ #
+
+
+# cópias velhas de veículos que mudaram de shard ({id: shard}) cujo delete ainda não valeu; só o escritor mexe
+_COPIAS_PENDENTES: Dict[int, int] = {}
+
+
+def _aplica_escritas(pedidos: List[Tuple[str, List[Dict[str, Any]]]]) -> List[List[Dict[str, Any]]]:
+    """
+    Um lote do group commit, na thread do escritor: sessões no disco (nunca na
+    réplica) e um commit por arquivo de dados. Com shards os commits são
+    independentes, como no seed: se um falha depois de outro valer, sobe
+    `CommitParcial` (o escritor não refaz) e o cache de linhas é esvaziado, já
+    que não dá para saber o que valeu. Cópias velhas de veículos que mudaram de
+    shard só são apagadas depois de todos os commits (e antes do próximo lote,
+    se o delete falhar). Depois do commit, recopia a réplica em memória dos
+    arquivos que mudaram (com CENTERCAR_REPLICA=1) e tira os ids gravados do
+    cache de linhas, nessa ordem e antes do ack: quem recebe o ack já lê o valor
+    novo, em qualquer tool. O índice fuzzy pega a mudança pela versão dos dados.
+    """
+    sessoes = [obter_sessao_shard(i) for i in range(N_SHARDS)] if usa_shards() else [obter_sessao()]
+    comitados = 0
+    try:
+        if _COPIAS_PENDENTES:
+            apaga_copias(sessoes, _COPIAS_PENDENTES)
+            CACHE_LINHAS.invalida(list(_COPIAS_PENDENTES))
+            _COPIAS_PENDENTES.clear()
+        resultados, copias = grava(sessoes, pedidos)
+        for sessao in sessoes:
+            sessao.commit()
+            comitados += 1
+        _COPIAS_PENDENTES.update(copias)
+        try:
+            apaga_copias(sessoes, copias)
+            _COPIAS_PENDENTES.clear()
+        except Exception:
+            # os dados do lote já valeram; a cópia a mais sai antes do próximo lote
+            logger.exception("cópias velhas de %d veículos movidos entre shards ficaram para depois", len(copias))
+    except Exception as e:
+        if comitados:
+            _atualiza_replicas()
+            CACHE_LINHAS.invalida()
+            raise CommitParcial(f"{comitados} de {len(sessoes)} arquivos gravados antes da falha: {e}") from e
+        raise
+    finally:
+        for sessao in sessoes:
+            sessao.close()
+    _atualiza_replicas()
+    CACHE_LINHAS.invalida([ack["id"] for acks in resultados for ack in acks if ack["status"] in STATUS_GRAVADO])
+    return resultados
+
+
+def _atualiza_replicas() -> None:
+    """
+    Recopia agora as réplicas em memória cujo arquivo mudou, sem esperar a
+    checagem periódica. Chamada pelo escritor antes de invalidar o cache: a
+    releitura que vem depois da invalidação já encontra a cópia nova.
+    """
+    for replica in REPLICAS:
+        try:
+            replica.verifica()
+        except Exception:
+            # sem a cópia nova a leitura fica atrasada até a próxima checagem, mas a escrita já valeu
+            logger.exception("falha atualizando a réplica de %s depois de uma escrita", replica.caminho)
+
+
+ESCRITOR = EscritorEmGrupo(_aplica_escritas, ESCRITA_ATRASO_MS / 1000, ESCRITA_MAX_ITENS)
+
+
+@ferramenta(TOOL_UPSERT)
+@ferramenta(TOOL_PRECOS)
+def _tool_escrita(ch: Chamada) -> None:
+    if not ESCRITA_HABILITADA:
+        ch.responde(_erro("FORBIDDEN", "Escritas desligadas neste servidor (CENTERCAR_ESCRITA=1)"), erro=True)
+        return
+    itens = ch.args.get("itens")
+    if not isinstance(itens, list) or not 0 < len(itens) <= MAX_ITENS_POR_ESCRITA:
+        msg = f"'itens' deve ser uma lista de 1 a {MAX_ITENS_POR_ESCRITA} objetos"
+        ch.responde(_erro("INVALID_REQUEST", msg), erro=True)
+        return
+
+    # item inválido recebe o ack na hora e não vai ao escritor; os válidos vão juntos, num pedido só
+    valida = VALIDADORES[ch.tool]
+    acks: List[Optional[Dict[str, Any]]] = []
+    validos: List[Dict[str, Any]] = []
+    posicoes: List[int] = []
+    for k, item in enumerate(itens):
+        normalizado, erro = valida(item)
+        if erro is not None:
+            acks.append(ack_invalido(item, erro))
+        else:
+            acks.append(None)
+            validos.append(normalizado)
+            posicoes.append(k)
+
+    if validos:
+        prazo = _prazo_da_requisicao(ch.req, ch.inicio)
+        try:
+            gravados = ESCRITOR.submete(ch.tool, validos, max(0.0, prazo - time.perf_counter()))
+        except TimeoutError:
+            METRICAS.evento("prazos_excedidos")
+            ch.responde(_erro("TIMEOUT", "Escrita não entrou num commit dentro do prazo; nada foi gravado"), erro=True)
+            return
+        except Exception as e:
+            logger.exception("Erro processando requisição MCP")
+            ch.responde(_erro("SERVER_ERROR", str(e)), erro=True)
+            return
+        for k, ack in zip(posicoes, gravados):
+            acks[k] = ack
+
+    ch.responde(codifica({"ok": True, "result": acks}))
+    n_gravados = sum(1 for ack in acks if ack is not None and ack["status"] in STATUS_GRAVADO)
+    log_requisicao(ch.addr, ch.tool, {"itens": len(itens)}, time.perf_counter() - ch.inicio, n_gravados)
+
+
+def _atende_mcp(conn: socket.socket, addr: Tuple[str, int], req: Dict[str, Any], bytes_in: int, inicio: float) -> None:
+    """
+    Despacha um envelope MCP {"tool": ..., "args": ...} já decodificado para a tool registrada.
+    `inicio` é o perf_counter do começo da leitura, para a duração no log.
+    """
+    atende = FERRAMENTAS.get(req["tool"]) if isinstance(req["tool"], str) else None
+    if atende is None:
+        enviados = _envia(conn, _erro("UNKNOWN_TOOL", f"Tool '{req['tool']}' não suportada"))
+        METRICAS.conta(TOOL_DESCONHECIDA, bytes_in, enviados, erro=True)
+        return
+    tool = req["tool"]
+    cliente = _id_cliente(req, addr)
+    espera = LIMITADOR.verifica(cliente)
+    if espera:
+        # resposta imediata e barata: nada de fila nem banco para quem passou do limite
+        METRICAS.evento("limitadas_por_taxa")
+        retry_ms = max(1, int(espera * 1000 + 0.999))
+        enviados = _envia(conn, _erro("RATE_LIMITED", "Limite de requisições excedido", retry_after_ms=retry_ms))
+        METRICAS.conta(tool, bytes_in, enviados, erro=True)
+        return
+    # compressão da resposta: o cliente lista o que aceita, em ordem de preferência
+    algoritmo = escolhe_compressao(req.get("compressao"))
+    if not isinstance(req["args"], dict):
+        enviados = _envia(conn, _erro("INVALID_REQUEST", "'args' deve ser um objeto"))
+        METRICAS.conta(tool, bytes_in, enviados, erro=True)
+        return
+    atende(Chamada(conn, addr, req, bytes_in, inicio, cliente, algoritmo))
+
+
 def trata_cliente(conn: socket.socket, addr: Tuple[str, int]) -> None:
     """
     Fluxo:
-      1) lê header (4 bytes) com o tamanho do payload
-      2) lê e decodifica JSON
+      1) lê o frame (header de 4 bytes + payload, ver center_car/protocolo.py)
+      2) decodifica JSON
       3) aceita dois formatos:
          a) MCP (envelope): {"tool": "search_cars", "args": {...}}
+            (opcional "compressao": ["zlib", "lzma"] -> respostas grandes comprimidas)
+            (ou "subscribe_cars": conexão persistente com deltas do log de alterações;
+             "server_stats", "suggest", "get_cars_by_ids", "upsert_cars", "update_prices": ver FERRAMENTAS)
          b) legado: {...filtros...}   -> mantém compatibilidade
       4) consulta banco, retorna:
          - MCP: {"ok": true, "result": [...]}  (ou {"ok": false, "error": {...}})
          - legado: lista simples (como antes)
+
+    Cada fase é cronometrada e contabilizada em `METRICAS` (ver servidor/metricas.py).
+    Envelopes elegíveis rodam sob o cProfile (ver servidor/perfilador.py).
     """
-    with conn:
+    with conn, METRICAS.conexao():
         conn.settimeout(5.0)
 
-        tamanho_bytes = conn.recv(4)
-        if len(tamanho_bytes) < 4:
+        t0 = time.perf_counter()
+        try:
+            payload = le_frame(conn, MAX_REQUISICAO_BYTES)
+        except FrameGrandeDemais as e:
+            # tamanho acima do teto: recusa sem alocar o buffer
+            enviados = _envia(conn, _erro("INVALID_HEADER", str(e)))
+            METRICAS.conta(TOOL_INVALIDA, TAMANHO_HEADER, enviados, erro=True)
+            return
+        except FrameInvalido:
+            # corpo incompleto: o cliente foi embora, não há a quem responder
+            METRICAS.conta(TOOL_INVALIDA, TAMANHO_HEADER, erro=True)
+            return
+        if payload is None:
             # header inválido: não dá pra responder num formato confiável
+            METRICAS.conta(TOOL_INVALIDA, erro=True)
             return
-        tamanho = int.from_bytes(tamanho_bytes, "big")
-
-        payload = _recv_all(conn, tamanho)
+        t1 = time.perf_counter()
+        METRICAS.observa("recv", t1 - t0)
+        bytes_in = TAMANHO_HEADER + len(payload)
         try:
-            req = json.loads(payload.decode("utf-8"))
-        except json.JSONDecodeError:
-            # JSON inválido -> se for MCP, devolvemos erro MCP; se não souber, devolve lista vazia (legado)
-            conn.sendall(_erro("INVALID_JSON", "JSON malformado"))
+            req = decodifica(payload)
+        except ValueError:
+            # JSON inválido (ou UTF-8 inválido) -> devolvemos erro MCP
+            enviados = _envia(conn, _erro("INVALID_JSON", "JSON malformado"))
+            METRICAS.conta(TOOL_INVALIDA, bytes_in, enviados, erro=True)
             return
+        METRICAS.observa("decode", time.perf_counter() - t1)
 
         # ---- Modo MCP (envelope) ----
         if isinstance(req, dict) and "tool" in req and "args" in req:
-            if req["tool"] != EXPECTED_TOOL:
-                conn.sendall(_erro("UNKNOWN_TOOL", f"Tool '{req['tool']}' não suportada"))
-                return
-            if not isinstance(req["args"], dict):
-                conn.sendall(_erro("INVALID_REQUEST", "'args' deve ser um objeto"))
-                return
-
-            filtros = _validar_args(req["args"])
-            logging.info("MCP %s filtros=%s", addr, filtros)
-
-            sessao = obter_sessao()
-            try:
-                consulta = aplicar_filtros(sessao.query(Veiculo), filtros)
-                resultados: List[Dict[str, Any]] = [
-                    {
-                        "id": v.id,
-                        "marca": v.marca,
-                        "modelo": v.modelo,
-                        "ano": v.ano,
-                        "tipo_combustivel": v.tipo_combustivel,
-                        "cor": v.cor,
-                        "quilometragem": v.quilometragem,
-                        "numero_portas": v.numero_portas,
-                        "transmissao": v.transmissao,
-                        "preco": v.preco,
-                    }
-                    for v in consulta.all()
-                ]
-            except Exception as e:
-                logging.exception("Erro processando requisição MCP")
-                conn.sendall(_erro("SERVER_ERROR", str(e)))
-                return
-            finally:
-                sessao.close()
-
-            conn.sendall(_ok(resultados))
+            # subscribe_cars é de longa duração: nunca entra no perfilador
+            perfil = PERFILADOR.talvez(req) if req["tool"] != TOOL_SUBSCRIBE else nullcontext()
+            with perfil:
+                _atende_mcp(conn, addr, req, bytes_in, t0)
             return
 
         # ---- Modo legado (apenas filtros): mantém compatibilidade com cliente antigo ----
         filtros = _validar_args(req if isinstance(req, dict) else {})
-        logging.info("LEGACY %s filtros=%s", addr, filtros)
+        cliente = _id_cliente(None, addr)
+        if LIMITADOR.verifica(cliente):
+            # legado não tem formato de erro: encerra a conexão sem resposta
+            METRICAS.evento("limitadas_por_taxa")
+            METRICAS.conta(TOOL_LEGADO, bytes_in, erro=True)
+            return
 
-        sessao = obter_sessao()
+        prazo = t0 + PRAZO_PADRAO_MS / 1000
         try:
-            consulta = aplicar_filtros(sessao.query(Veiculo), filtros)
-            resultados: List[Dict[str, Any]] = [
-                {
-                    "id": v.id,
-                    "marca": v.marca,
-                    "modelo": v.modelo,
-                    "ano": v.ano,
-                    "tipo_combustivel": v.tipo_combustivel,
-                    "cor": v.cor,
-                    "quilometragem": v.quilometragem,
-                    "numero_portas": v.numero_portas,
-                    "transmissao": v.transmissao,
-                    "preco": v.preco,
-                }
-                for v in consulta.all()
-            ]
-        finally:
-            sessao.close()
+            resultados, truncado = _agendada(
+                cliente, lambda: _busca(filtros, prazo), max(0.0, prazo - time.perf_counter())
+            )
+        except (PrazoExcedido, TimeoutError):
+            # legado não tem formato de erro: encerra a conexão sem resposta
+            METRICAS.evento("prazos_excedidos")
+            METRICAS.conta(TOOL_LEGADO, bytes_in, erro=True)
+            logger.warning("LEGACY %s consulta excedeu o prazo", addr)
+            return
+        except Exception:
+            METRICAS.conta(TOOL_LEGADO, bytes_in, erro=True)
+            raise
+        if truncado:
+            # cliente legado não entende cursor: recebe só a primeira página
+            logger.warning("LEGACY %s resposta truncada em %d linhas", addr, len(resultados))
 
-        resposta = json.dumps(resultados).encode("utf-8")
-        header = len(resposta).to_bytes(4, "big")
-        conn.sendall(header + resposta)
+        enviados = _envia(conn, _encode(_frame_lista, resultados))
+        METRICAS.conta(TOOL_LEGADO, bytes_in, enviados)
+        log_requisicao(addr, TOOL_LEGADO, filtros, time.perf_counter() - t0, len(resultados))
 
 
 # ------------------------ Bootstrap do servidor ------------------------ #
 
 
-def iniciar_servidor() -> None:
-    """Inicializa o socket servidor e aceita conexões em loop."""
-    print(f"🚀 Servidor MCP iniciado em {HOST}:{PORTA}")
+def aquece() -> None:
+    """
+    Deixa as estruturas em memória prontas: restaura do snapshot o que ainda
+    vale para os dados atuais e reconstrói o resto. O tempo total vai para o
+    log e para o `aquecimento` do server_stats. Roda em segundo plano, com o
+    socket já escutando: até terminar, a busca vai ao arquivo e o índice fuzzy
+    é construído no primeiro uso.
+    """
+    t0 = time.perf_counter()
+    restaurados: List[str] = []
+    if SNAPSHOT is not None:
+        try:
+            restaurados = SNAPSHOT.carrega()
+        except Exception:
+            logger.exception("snapshot não carregado na subida")
+    if "indice_fuzzy" not in restaurados:
+        try:
+            INDICE_FUZZY.constroi()
+        except Exception:
+            # banco ainda sem tabelas/dados: o índice é construído no primeiro uso
+            logger.exception("índice fuzzy não construído na subida")
+    if REPLICA_MEMORIA:
+        inicia_replicas()
+    segundos = time.perf_counter() - t0
+    origem = "snapshot" if restaurados else "reconstrucao"
+    METRICAS.registra_aquecimento(segundos, origem)
+    logger.info("servidor aquecido em %.1f ms (%s)", segundos * 1000, origem)
+    if SNAPSHOT is not None:
+        SNAPSHOT.inicia_periodico(SNAPSHOT_INTERVALO)
+
+
+def iniciar_servidor(host: str = HOST, porta: int = PORTA, pronto: Optional[threading.Event] = None) -> None:
+    """
+    Inicializa o socket servidor e aceita conexões em loop.
+
+    Se `pronto` for informado, o evento é sinalizado assim que o socket estiver
+    escutando — quem sobe o servidor em thread (ex.: `principal.py --tudo`) pode
+    esperar por ele em vez de dormir um tempo fixo. O aquecimento (`aquece`)
+    roda numa thread à parte, sem segurar o sinal.
+    """
+    configura_log()
+    if SNAPSHOT is not None and threading.current_thread() is threading.main_thread():
+        # SIGTERM (deploy) vira SystemExit, para o finally abaixo gravar o snapshot
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as servidor:
         servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        servidor.bind((HOST, PORTA))
+        servidor.bind((host, porta))
         servidor.listen()
-        while True:
-            conn, addr = servidor.accept()
-            thread = threading.Thread(
-                target=trata_cliente,
-                args=(conn, addr),
-                daemon=True,
-            )
-            thread.start()
+        print(f"🚀 Servidor MCP iniciado em {host}:{porta}")
+        if pronto is not None:
+            pronto.set()
+        threading.Thread(target=aquece, name="centercar-aquecimento", daemon=True).start()
+        inicia_poda_alteracoes()
+        try:
+            while True:
+                conn, addr = servidor.accept()
+                thread = threading.Thread(
+                    target=trata_cliente,
+                    args=(conn, addr),
+                    daemon=True,
+                )
+                thread.start()
+        finally:
+            if SNAPSHOT is not None:
+                try:
+                    SNAPSHOT.salva()
+                except Exception:
+                    logger.exception("snapshot não gravado no desligamento")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+# servidor/snapshot_caches.py
+"""
+Snapshot das estruturas em memória do servidor (índice fuzzy, caches) para
+subir quente depois de um deploy.
+
+Cada estrutura se registra com `exporta()` -> (versão dos dados, estado) ou
+None, e `importa(versão, estado)`. O arquivo guarda, além dos estados, a
+identidade dos dados no momento da gravação: a versão (log de alterações) e
+tamanho + mtime de cada arquivo SQLite — a versão sozinha não distingue um
+banco recriado com a mesma quantidade de escritas. Na subida, estrutura cuja
+versão não bate com a identidade atual é ignorada e reconstruída como antes.
+
+O formato é pickle (objetos Python prontos, sem reconstrução): carregue só
+arquivos gravados pelo próprio servidor. A gravação é atômica (arquivo
+temporário + os.replace), então um crash no meio não deixa snapshot truncado.
+"""
+
+import logging
+import os
+import pickle
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("centercar.snapshot")
+
+# muda quando o layout do arquivo (ou de alguma estrutura) muda de forma incompatível
+FORMATO = 2
+
+
+class SnapshotCaches:
+    """
+    `identidade()` devolve (versão dos dados, assinatura dos arquivos); vem do
+    servidor, que sabe onde estão os dados.
+    """
+
+    def __init__(self, caminho: str, identidade: Callable[[], Tuple[int, Any]]) -> None:
+        self.caminho = caminho
+        self._identidade = identidade
+        self._estruturas: Dict[str, Tuple[Callable[[], Optional[Tuple[int, Any]]], Callable[[int, Any], None]]] = {}
+        self._trava = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def registra(
+        self, nome: str, exporta: Callable[[], Optional[Tuple[int, Any]]], importa: Callable[[int, Any], None]
+    ) -> None:
+        self._estruturas[nome] = (exporta, importa)
+
+    def salva(self) -> List[str]:
+        """Grava as estruturas em dia com os dados; devolve os nomes gravados."""
+        with self._trava:
+            versao, assinatura = self._identidade()
+            estados = {}
+            for nome, (exporta, _) in self._estruturas.items():
+                exportado = exporta()
+                # estrutura atrasada (reconstrução em andamento) fica de fora: seria descartada na carga
+                if exportado is not None and exportado[0] == versao:
+                    estados[nome] = exportado[1]
+            conteudo = {"formato": FORMATO, "versao": versao, "assinatura": assinatura, "estados": estados}
+            temporario = f"{self.caminho}.tmp"
+            with open(temporario, "wb") as f:
+                pickle.dump(conteudo, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporario, self.caminho)
+        logger.info("snapshot gravado em %s (versão %d: %s)", self.caminho, versao, ", ".join(estados) or "vazio")
+        return list(estados)
+
+    def carrega(self) -> List[str]:
+        """Restaura o que o snapshot tiver de válido para os dados atuais; devolve os nomes restaurados."""
+        try:
+            with open(self.caminho, "rb") as f:
+                conteudo = pickle.load(f)
+        except FileNotFoundError:
+            return []
+        except Exception:
+            logger.exception("snapshot ilegível em %s; ignorado", self.caminho)
+            return []
+        if not isinstance(conteudo, dict) or conteudo.get("formato") != FORMATO:
+            logger.info("snapshot em formato antigo; ignorado")
+            return []
+
+        versao, assinatura = self._identidade()
+        if (conteudo["versao"], conteudo["assinatura"]) != (versao, assinatura):
+            logger.info(
+                "snapshot da versão %d, dados na %d; estruturas serão reconstruídas", conteudo["versao"], versao
+            )
+            return []
+        restaurados = []
+        for nome, estado in conteudo["estados"].items():
+            if nome in self._estruturas:
+                self._estruturas[nome][1](versao, estado)
+                restaurados.append(nome)
+        return restaurados
+
+    def inicia_periodico(self, intervalo: float) -> None:
+        """Grava a cada `intervalo` segundos numa thread (além da gravação no desligamento)."""
+        if intervalo <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._grava_sempre, args=(intervalo,), name="centercar-snapshot", daemon=True
+        )
+        self._thread.start()
+
+    def _grava_sempre(self, intervalo: float) -> None:
+        while True:
+            time.sleep(intervalo)
+            try:
+                self.salva()
+            except Exception:
+                logger.exception("falha gravando o snapshot em %s", self.caminho)
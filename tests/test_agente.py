@@ -126,3 +126,60 @@ def test_pergunta_simples(monkeypatch):
     # Responde "n" -> False
     monkeypatch.setattr(builtins, "input", lambda *_: "n")
     assert agente.pergunta_simples("confirma?") is False
+
+
+def test_buscar_usa_replica_local_quando_pronta(monkeypatch):
+    chamadas = []
+
+    def fake_envia(filtros, fuzzy=False, resolvido=None):
+        chamadas.append((filtros, fuzzy))
+        if resolvido is not None:
+            resolvido["marca"] = "Jeep"
+        return [{"id": 1}]
+
+    agente = _load_agente_with_fake_client(monkeypatch, fake_envia)
+
+    class FakeReplica:
+        pronta = False
+
+        def busca(self, filtros, fuzzy=False, resolvido=None):
+            return [{"id": 2, "fuzzy": fuzzy}]
+
+    replica = FakeReplica()
+    # antes da primeira sincronização (ou sem réplica), vai ao servidor
+    resolvido = {}
+    assert agente.buscar({"marca": "Jepe"}, replica, fuzzy=True, resolvido=resolvido) == [{"id": 1}]
+    assert resolvido == {"marca": "Jeep"}
+    assert agente.buscar({}, None) == [{"id": 1}]
+    assert chamadas == [({"marca": "Jepe"}, True), ({}, False)]
+
+    replica.pronta = True
+    assert agente.buscar({"marca": "Jeep"}, replica, fuzzy=True) == [{"id": 2, "fuzzy": True}]
+    assert len(chamadas) == 2
+
+
+def test_exibir_resolvido_avisa_o_que_foi_trocado(monkeypatch, capsys):
+    agente = _load_agente_with_fake_client(monkeypatch)
+
+    agente.exibir_resolvido({"marca": "Volksvagem"}, {})
+    assert capsys.readouterr().out == ""
+
+    agente.exibir_resolvido({"marca": "Volksvagem", "modelo": "Gol"}, {"marca": "Volkswagen"})
+    assert 'mostrando resultados para "Volkswagen"' in capsys.readouterr().out
+
+
+def test_main_mede_ate_a_primeira_pergunta(monkeypatch, capsys):
+    agente = _load_agente_with_fake_client(monkeypatch)
+    monkeypatch.setattr(agente, "REPLICA_LOCAL", False)
+
+    class Parou(Exception):
+        pass
+
+    def primeira_pergunta(*_a, **_k):
+        # a medição já saiu quando a primeira pergunta aparece
+        assert "Pronto para a primeira pergunta em" in capsys.readouterr().out
+        raise Parou
+
+    monkeypatch.setattr(builtins, "input", primeira_pergunta)
+    with pytest.raises(Parou):
+        agente.main(inicio=agente.time.perf_counter())
@@ -9,7 +9,10 @@ from sqlalchemy.orm import sessionmaker
 
 from center_car.modelo_veiculo import Base, Veiculo
 from cliente.cliente_mcp import envia_filtros
-from servidor.servidor_mcp import aplicar_filtros
+from servidor.servidor_mcp import alteracoes_desde, aplicar_filtros, log_cobre, poda_alteracoes, versao_dados
+
+# o fixture fake_socket (parte 2) troca socket.socket; o teste de ponta a ponta do subscribe usa o de verdade
+_SOCKET_REAL = socket.socket
 
 # --- Parte 1: testes de filtros com SQLAlchemy ---
 
@@ -72,6 +75,735 @@ def test_aplicar_filtro_preco_max(sessao_em_memoria):
     assert resultados[0].marca == "X"
 
 
+def test_filtros_novos_usam_indice_de_cobertura(sessao_em_memoria):
+    """Cada filtro novo filtra de fato e, numa combinação comum, a subconsulta de ids sai só do índice."""
+    from servidor.consulta_lenta import plano_de_execucao
+    from servidor.servidor_mcp import _validar_args, consulta_busca
+
+    casos = [
+        ({"preco_min": 60000, "preco_max": 80000}, ["Beta"], "ix_veiculos_busca_preco (preco>? AND preco<?)"),
+        ({"marca": "X", "preco_min": 40000}, ["Alpha"], "ix_veiculos_busca_marca (marca=? AND preco>?)"),
+        ({"marca": "Y", "quilometragem_max": 1500}, [], "ix_veiculos_busca_marca (marca=?)"),
+        ({"marca": "Y", "numero_portas": 2}, ["Beta"], "ix_veiculos_busca_marca (marca=?)"),
+        ({"marca": "X", "transmissao": "Manual"}, ["Alpha"], "ix_veiculos_busca_marca (marca=?)"),
+        ({"cor": "Preto"}, ["Beta"], "ix_veiculos_busca_cor (cor=?)"),
+    ]
+    for filtros, modelos, indice in casos:
+        assert _validar_args(filtros) == filtros
+        consulta = consulta_busca(sessao_em_memoria, filtros, 10)
+        assert [v.modelo for v in consulta.all()] == modelos, filtros
+        assert f"SEARCH veiculos USING COVERING INDEX {indice}" in plano_de_execucao(consulta), filtros
+
+
+def test_validar_args_ignora_booleanos_nos_campos_numericos():
+    """JSON true/false não vira 1/0: bool é subclasse de int, mas não é número de portas nem cursor."""
+    from servidor.servidor_mcp import _validar_args
+
+    campos = ("numero_portas", "ano_min", "ano_max", "preco_min", "preco_max", "quilometragem_max", "cursor", "limite")
+    assert _validar_args({campo: True for campo in campos}) == {}
+    assert _validar_args({campo: False for campo in campos}) == {}
+    assert _validar_args({"numero_portas": 4, "cursor": 0, "limite": 10, "preco_max": 1}) == {
+        "numero_portas": 4,
+        "cursor": 0,
+        "limite": 10,
+        "preco_max": 1.0,
+    }
+
+
+def test_log_alteracoes_registra_escritas(sessao_em_memoria):
+    # os dois inserts da fixture já estão no log (gatilhos instalados no create_all)
+    assert versao_dados(sessao_em_memoria) == 2
+    deltas, cursor = alteracoes_desde(sessao_em_memoria, 0)
+    assert [(d["op"], d["veiculo"]["modelo"]) for d in deltas] == [("insert", "Alpha"), ("insert", "Beta")]
+    assert cursor == 2
+
+    alpha = sessao_em_memoria.query(Veiculo).filter_by(modelo="Alpha").one()
+    beta = sessao_em_memoria.query(Veiculo).filter_by(modelo="Beta").one()
+    alpha.preco = 45000
+    sessao_em_memoria.delete(beta)
+    sessao_em_memoria.commit()
+
+    # retomando do cursor: só o que mudou depois dele
+    deltas, novo_cursor = alteracoes_desde(sessao_em_memoria, cursor)
+    assert novo_cursor == 4
+    por_id = {d["id"]: d for d in deltas}
+    assert por_id[alpha.id]["op"] == "update"
+    assert por_id[alpha.id]["veiculo"]["preco"] == 45000
+    assert por_id[beta.id] == {"op": "delete", "id": beta.id}
+
+    assert alteracoes_desde(sessao_em_memoria, novo_cursor) == ([], novo_cursor)
+
+
+def test_log_alteracoes_colapsa_por_veiculo(sessao_em_memoria):
+    alpha = sessao_em_memoria.query(Veiculo).filter_by(modelo="Alpha").one()
+    for preco in (1, 2, 3):
+        alpha.preco = preco
+        sessao_em_memoria.commit()
+
+    deltas, cursor = alteracoes_desde(sessao_em_memoria, 2)
+    assert cursor == 5
+    assert len(deltas) == 1
+    assert deltas[0]["veiculo"]["preco"] == 3
+
+
+def test_poda_do_log_mantem_as_mais_recentes_e_invalida_o_cache(sessao_em_memoria):
+    from servidor.cache_linhas import CacheLinhas
+
+    cache = CacheLinhas(10)
+    cache.guarda({1: b"{}", 2: b"{}"}, cache.sincroniza(0, sessao_em_memoria))
+    alpha = sessao_em_memoria.get(Veiculo, 1)
+    for preco in (1, 2, 3):
+        alpha.preco = preco
+        sessao_em_memoria.commit()
+
+    assert poda_alteracoes(sessao_em_memoria, manter=0) == 0  # 0 = mantém tudo
+    assert poda_alteracoes(sessao_em_memoria, manter=2) == 3
+    assert versao_dados(sessao_em_memoria) == 5
+    assert [d["id"] for d in alteracoes_desde(sessao_em_memoria, 3)[0]] == [1]
+    assert log_cobre(sessao_em_memoria, 3) and log_cobre(sessao_em_memoria, 5)
+    assert not log_cobre(sessao_em_memoria, 2) and not log_cobre(sessao_em_memoria, 6)
+
+    # o cache conferiu o log no seq 2: as entradas 3 e 4 sumiram, então nada dele vale mais
+    cache.sincroniza(0, sessao_em_memoria)
+    assert len(cache) == 0
+
+
+def _frames(*frames):
+    """assina_alteracoes falso: devolve os frames dados e registra o `desde` de cada chamada."""
+    chamadas = []
+
+    def assina(desde=None):
+        chamadas.append(desde)
+        for deltas, seq in frames:
+            yield {"ok": True, "result": deltas, "seq": seq}
+
+    return assina, chamadas
+
+
+def test_replica_local_filtra_como_o_servidor(sessao_em_memoria, monkeypatch):
+    import cliente.cliente_mcp as cli
+    from cliente.replica_local import ReplicaLocal
+
+    sessao_em_memoria.add(
+        Veiculo(
+            marca="X",
+            modelo="Gama_100%",
+            ano=2022,
+            motorizacao="1.6",
+            tipo_combustivel="Flex",
+            cor="Branco",
+            quilometragem=0,
+            numero_portas=4,
+            transmissao="CVT",
+            preco=90000,
+        )
+    )
+    sessao_em_memoria.commit()
+    deltas, seq = alteracoes_desde(sessao_em_memoria, 0)
+    assina, _ = _frames((deltas, seq))
+    monkeypatch.setattr(cli, "assina_alteracoes", assina)
+    replica = ReplicaLocal()
+    replica._assina()
+
+    casos = [
+        {},
+        {"marca": "X"},
+        {"marca": "x"},  # igualdade sensível a maiúsculas, como no SQLite
+        {"modelo": "ALP"},
+        {"modelo": "a_p"},  # '_' e '%' são curingas do LIKE
+        {"modelo": "100%"},
+        {"ano_min": 2019, "ano_max": 2021},
+        {"tipo_combustivel": "Diesel"},
+        {"preco_min": 50000, "preco_max": 70000},
+        {"quilometragem_max": 1000},
+        {"numero_portas": 4, "transmissao": "CVT"},
+        {"cor": "Branco", "cursor": 1},
+    ]
+    for filtros in casos:
+        esperado = [v.id for v in aplicar_filtros(sessao_em_memoria.query(Veiculo), filtros).order_by(Veiculo.id)]
+        assert [v["id"] for v in replica.busca(filtros)] == esperado, filtros
+    assert replica.busca({"marca": "Y"})[0] == {
+        "id": 2,
+        "marca": "Y",
+        "modelo": "Beta",
+        "ano": 2018,
+        "tipo_combustivel": "Diesel",
+        "cor": "Preto",
+        "quilometragem": 2000.0,
+        "numero_portas": 2,
+        "transmissao": "Automática",
+        "preco": 70000.0,
+    }
+    # fuzzy corrige a marca localmente, como o servidor faria
+    resolvido = {}
+    assert [v["id"] for v in replica.busca({"marca": "Xx", "modelo": "Gama"}, fuzzy=True, resolvido=resolvido)] == [3]
+    assert resolvido == {"marca": "X"}
+
+
+def test_replica_local_sincroniza_retoma_e_sobrevive_ao_servidor_fora(monkeypatch):
+    import cliente.cliente_mcp as cli
+    from cliente.replica_local import ReplicaLocal
+
+    def veiculo(id_, marca, preco):
+        fixos = {"modelo": "M", "ano": 2020, "tipo_combustivel": "Flex", "cor": "Azul", "quilometragem": 0.0}
+        return {"id": id_, "marca": marca, **fixos, "numero_portas": 4, "transmissao": "Manual", "preco": preco}
+
+    replica = ReplicaLocal()
+    # conexão cai no meio do snapshot: nada é adotado e a próxima tentativa recomeça do zero
+    assina, chamadas = _frames(([{"op": "insert", "id": 1, "veiculo": veiculo(1, "A", 10.0)}], None))
+    monkeypatch.setattr(cli, "assina_alteracoes", assina)
+    assert replica._assina() is True
+    assert not replica.pronta and len(replica) == 0
+
+    assina, chamadas = _frames(
+        ([{"op": "insert", "id": 1, "veiculo": veiculo(1, "A", 10.0)}], None),
+        ([{"op": "insert", "id": 2, "veiculo": veiculo(2, "B", 20.0)}], 5),
+        ([{"op": "update", "id": 1, "veiculo": veiculo(1, "A", 11.0)}, {"op": "delete", "id": 2}], 7),
+    )
+    monkeypatch.setattr(cli, "assina_alteracoes", assina)
+    replica._assina()
+    assert chamadas == [None]
+    assert replica.pronta and replica.seq == 7
+    assert replica.busca({}) == [veiculo(1, "A", 11.0)]
+
+    # reconexão retoma do último seq; servidor fora do ar não apaga nem trava a réplica
+    assina, chamadas = _frames()
+    monkeypatch.setattr(cli, "assina_alteracoes", assina)
+    assert replica._assina() is False
+    assert chamadas == [7]
+    assert replica.busca({"marca": "A"}) == [veiculo(1, "A", 11.0)]
+
+    # o seq 7 já saiu do log do servidor: o snapshot novo ("reinicio") substitui a cópia inteira
+    def assina_reinicio(desde=None):
+        yield {
+            "ok": True,
+            "result": [{"op": "insert", "id": 3, "veiculo": veiculo(3, "C", 30.0)}],
+            "seq": None,
+            "reinicio": True,
+        }
+        assert replica.busca({}) == [veiculo(1, "A", 11.0)]  # a cópia antiga atende até o fim do snapshot
+        yield {"ok": True, "result": [], "seq": 50}
+
+    monkeypatch.setattr(cli, "assina_alteracoes", assina_reinicio)
+    replica._assina()
+    assert replica.seq == 50 and replica.busca({}) == [veiculo(3, "C", 30.0)]
+
+
+def test_replica_local_so_refaz_o_fuzzy_quando_marca_ou_modelo_aparecem_ou_somem(monkeypatch):
+    import cliente.cliente_mcp as cli
+    from cliente.replica_local import ReplicaLocal
+
+    def veiculo(id_, modelo, preco):
+        fixos = {"marca": "A", "ano": 2020, "tipo_combustivel": "Flex", "cor": "Azul", "quilometragem": 0.0}
+        return {"id": id_, "modelo": modelo, **fixos, "numero_portas": 4, "transmissao": "Manual", "preco": preco}
+
+    replica = ReplicaLocal()
+    assina, _ = _frames(([{"op": "insert", "id": i, "veiculo": veiculo(i, "Gol", 1.0)} for i in (1, 2)], 2))
+    monkeypatch.setattr(cli, "assina_alteracoes", assina)
+    replica._assina()
+    indices = replica._indices_fuzzy()
+
+    def aplica(*deltas):
+        assina, _ = _frames((list(deltas), replica.seq + 1))
+        monkeypatch.setattr(cli, "assina_alteracoes", assina)
+        replica._assina()
+
+    aplica({"op": "update", "id": 1, "veiculo": veiculo(1, "Gol", 2.0)})  # só o preço
+    aplica({"op": "delete", "id": 2}, {"op": "insert", "id": 3, "veiculo": veiculo(3, "Gol", 3.0)})
+    assert replica._indices_fuzzy() is indices
+
+    aplica({"op": "update", "id": 3, "veiculo": veiculo(3, "Polo", 3.0)})
+    assert replica._indices_fuzzy()["modelo"].tem("Polo")
+    resolvido = {}
+    assert [v["id"] for v in replica.busca({"modelo": "Pollo"}, fuzzy=True, resolvido=resolvido)] == [3]
+    assert resolvido == {"modelo": "Polo"}
+
+    aplica({"op": "delete", "id": 1})  # o último Gol
+    assert not replica._indices_fuzzy()["modelo"].tem("Gol")
+
+
+def test_replica_local_desiste_quando_o_servidor_recusa_a_assinatura(monkeypatch, caplog):
+    import cliente.cliente_mcp as cli
+    from cliente.replica_local import ReplicaLocal
+
+    chamadas = []
+
+    def recusa(desde=None):
+        chamadas.append(desde)
+        raise cli.AssinaturaRecusada("INVALID_REQUEST", "subscribe_cars não está disponível com shards")
+        yield  # gerador, como o de verdade
+
+    monkeypatch.setattr(cli, "assina_alteracoes", recusa)
+    replica = ReplicaLocal(espera_reconexao=0)
+    with caplog.at_level("WARNING", logger="centercar.replica_local"):
+        replica._sincroniza_sempre()  # retorna em vez de tentar para sempre
+    assert chamadas == [None] and not replica.pronta
+    assert [r.levelname for r in caplog.records] == ["WARNING"]
+
+
+def test_get_cars_by_ids_usa_cache_e_invalida_na_escrita(sessao_em_memoria, monkeypatch):
+    """get_cars_by_ids: ordem dos ids pedidos, ids inexistentes em "faltando", cache invalidado pelo log."""
+    import servidor.servidor_mcp as srv
+    from servidor.cache_linhas import CacheLinhas
+
+    monkeypatch.setattr(srv, "obter_sessao", sessionmaker(bind=sessao_em_memoria.get_bind()))
+    monkeypatch.setattr(srv, "CACHE_LINHAS", CacheLinhas(100))
+
+    def por_ids(ids):
+        return json.loads(srv._frame_por_ids(ids, srv._linhas_por_ids(ids))[4:])
+
+    resposta = por_ids([2, 99, 1])
+    assert [v["id"] for v in resposta["result"]] == [2, 1] and resposta["faltando"] == [99]
+    assert len(srv.CACHE_LINHAS) == 2
+
+    achados, faltando = srv.CACHE_LINHAS.busca([1, 2])
+    assert set(achados) == {1, 2} and not faltando
+
+    v = sessao_em_memoria.get(Veiculo, 1)
+    v.preco = 1.0
+    sessao_em_memoria.commit()
+    assert por_ids([1, 2])["result"][0]["preco"] == 1.0
+    assert set(srv.CACHE_LINHAS.busca([1, 2])[0]) == {1, 2}
+
+
+def test_indice_fuzzy_so_reconstroi_quando_marca_ou_modelo_podem_mudar(sessao_em_memoria, monkeypatch):
+    import servidor.servidor_mcp as srv
+    from servidor.indice_fuzzy import IndiceFuzzy
+
+    Sessao = sessionmaker(bind=sessao_em_memoria.get_bind())
+    monkeypatch.setattr(srv, "sessoes_de_dados", lambda: [Sessao()])
+    monkeypatch.setattr(srv, "_SEQS_FUZZY", {})
+    cargas = []
+    indice = IndiceFuzzy(
+        srv._versao_global, lambda: cargas.append(1) or srv._valores_fuzzy(), mudou=srv._marca_modelo_mudaram
+    )
+    indice.constroi()
+
+    def escreve(**campos):
+        v = sessao_em_memoria.get(Veiculo, 1)
+        for campo, valor in campos.items():
+            setattr(v, campo, valor)
+        sessao_em_memoria.commit()
+        indice._atualiza()
+        assert indice.versao_indice == srv._versao_global()
+
+    escreve(preco=1.0)
+    escreve(marca="Y", quilometragem=5)  # valor que o índice já tem
+    assert len(cargas) == 1
+    escreve(modelo="Gama")
+    assert len(cargas) == 2 and indice.resolve("modelo", "gamma") == "Gama"
+    sessao_em_memoria.delete(sessao_em_memoria.get(Veiculo, 2))
+    sessao_em_memoria.commit()
+    indice._atualiza()
+    assert len(cargas) == 3 and indice.indice("modelo").contem("gam") and not indice.indice("modelo").contem("bet")
+
+
+def test_escritas_em_grupo_confirmam_cada_item_e_invalidam_cache(tmp_path, monkeypatch):
+    """upsert_cars/update_prices simultâneos: um commit para vários pedidos, ack por item, cache de linhas limpo."""
+    import threading
+
+    import servidor.servidor_mcp as srv
+    from servidor.cache_linhas import CacheLinhas
+    from servidor.escritor import EscritorEmGrupo
+    from servidor.metricas import METRICAS
+    from tests.test_protocolo import FakeConn, _frame
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'escrita.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(srv, "obter_sessao", sessionmaker(bind=engine))
+    monkeypatch.setattr(srv, "CACHE_LINHAS", CacheLinhas(100))
+    monkeypatch.setattr(srv, "ESCRITA_HABILITADA", True)
+    monkeypatch.setattr(srv, "ESCRITOR", EscritorEmGrupo(srv._aplica_escritas, 0.1, 5000))
+
+    def chama(tool, itens):
+        conn = FakeConn(_frame({"tool": tool, "args": {"itens": itens}}))
+        srv.trata_cliente(conn, ("127.0.0.1", 1))
+        return json.loads(conn.sent[4:].decode("utf-8"))["result"]
+
+    carro = dict(
+        marca="Fiat",
+        modelo="Uno",
+        ano=2015,
+        motorizacao="1.0",
+        tipo_combustivel="Flex",
+        cor="Prata",
+        quilometragem=80000,
+        numero_portas=4,
+        transmissao="Manual",
+        preco=30000,
+    )
+    acks = chama("upsert_cars", [carro, dict(carro, modelo="Palio"), {"marca": "Fiat"}])
+    assert [(a["id"], a["status"]) for a in acks[:2]] == [(1, "inserido"), (2, "inserido")]
+    assert acks[2]["status"] == "invalido"
+
+    srv._linhas_por_ids([1, 2])
+    assert len(srv.CACHE_LINHAS) == 2
+
+    commits = METRICAS.eventos.get("escrita_commits", 0)
+    respostas = {}
+    threads = [
+        threading.Thread(
+            target=lambda k=k: respostas.update({k: chama("update_prices", [{"id": k, "preco": 1.5 * k}])})
+        )
+        for k in (1, 2, 99)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert METRICAS.eventos["escrita_commits"] - commits == 1  # três pedidos, um commit
+    assert respostas == {
+        1: [{"id": 1, "status": "atualizado"}],
+        2: [{"id": 2, "status": "atualizado"}],
+        99: [{"id": 99, "status": "nao_encontrado"}],
+    }
+    assert len(srv.CACHE_LINHAS) == 0
+
+    assert chama("upsert_cars", [{"id": 2, "cor": "Azul"}, {"id": 50, "cor": "Azul"}]) == [
+        {"id": 2, "status": "atualizado"},
+        {"id": 50, "status": "invalido", "erro": "id inexistente: para inserir, envie todos os campos"},
+    ]
+    with sessionmaker(bind=engine)() as sessao:
+        assert [(v.id, v.preco, v.cor) for v in sessao.query(Veiculo).order_by(Veiculo.id)] == [
+            (1, 1.5, "Prata"),
+            (2, 3.0, "Azul"),
+        ]
+        assert versao_dados(sessao) == 5  # 2 inserts + 3 updates no log de alterações
+
+
+def test_escrita_com_shards_nao_duplica_nem_perde_quando_um_commit_falha(tmp_path, monkeypatch):
+    """Shard 0 grava e o commit do shard 1 falha: nada é refeito (sem insert duplicado) e a linha que mudaria
+    de shard continua na origem."""
+    import zlib
+
+    from sqlalchemy.orm import Session
+
+    import center_car.banco_dados as bd
+    import servidor.servidor_mcp as srv
+    from servidor.cache_linhas import CacheLinhas
+    from servidor.escritor import CommitParcial, EscritorEmGrupo, _Pedido
+
+    falhas = []
+
+    class SessaoQueFalha(Session):
+        def commit(self):
+            if falhas:
+                falhas.pop()
+                raise RuntimeError("disco cheio")
+            super().commit()
+
+    engines = [
+        create_engine(f"sqlite:///{tmp_path}/s{i}.db", connect_args={"check_same_thread": False}) for i in (0, 1)
+    ]
+    for e in engines:
+        Base.metadata.create_all(bind=e)
+    monkeypatch.setattr(
+        bd, "SessoesShards", [sessionmaker(bind=engines[0]), sessionmaker(bind=engines[1], class_=SessaoQueFalha)]
+    )
+    monkeypatch.setattr(bd, "PARTICAO_SHARDS", "marca")
+    monkeypatch.setattr(srv, "N_SHARDS", 2)
+    monkeypatch.setattr(srv, "CACHE_LINHAS", CacheLinhas(100))
+    escritor = EscritorEmGrupo(srv._aplica_escritas, 0, 5000)
+
+    marcas = ["Fiat", "Ford", "Honda", "Jeep", "Kia", "Audi"]
+    m0 = next(m for m in marcas if zlib.crc32(m.encode("utf-8")) % 2 == 0)
+    m1 = next(m for m in marcas if zlib.crc32(m.encode("utf-8")) % 2 == 1)
+    carro = {"modelo": "Uno", "ano": 2015, "motorizacao": "1.0", "tipo_combustivel": "Flex", "cor": "Prata"}
+    carro.update(quilometragem=0.0, numero_portas=4, transmissao="Manual", preco=30000.0)
+
+    def ids(i):
+        with bd.SessoesShards[i]() as sessao:
+            return sorted(v.id for v in sessao.query(Veiculo))
+
+    def grava_lote(*pedidos):
+        lote = [_Pedido(op, itens) for op, itens in pedidos]
+        escritor._grava(lote)
+        return lote
+
+    lote = grava_lote(("upsert_cars", [dict(carro, marca=m0)]))
+    assert lote[0].erro is None and lote[0].acks == [{"id": 1, "status": "inserido"}]
+
+    # lote com um insert em cada shard; o commit do shard 1 falha depois do shard 0 valer
+    falhas.append(1)
+    lote = grava_lote(("upsert_cars", [dict(carro, marca=m0)]), ("upsert_cars", [dict(carro, marca=m1)]))
+    assert all(isinstance(p.erro, CommitParcial) for p in lote)
+    assert ids(0) == [1, 2] and ids(1) == []  # sem repetição: o id 2 não ganhou uma segunda cópia
+    assert len(srv.CACHE_LINHAS) == 0
+
+    # a marca do id 1 muda (shard 0 -> 1) e o commit do destino falha: a linha fica na origem
+    falhas.append(1)
+    lote = grava_lote(("upsert_cars", [{"id": 1, "marca": m1}]))
+    assert lote[0].erro is not None
+    assert ids(0) == [1, 2] and ids(1) == []
+
+    # sem falha, a linha muda de shard: insere no destino e só depois apaga a cópia velha
+    lote = grava_lote(("upsert_cars", [{"id": 1, "marca": m1}]), ("update_prices", [{"id": 1, "preco": 1.0}]))
+    assert [p.acks for p in lote] == [[{"id": 1, "status": "atualizado"}], [{"id": 1, "status": "atualizado"}]]
+    assert ids(0) == [2] and ids(1) == [1]
+    with bd.SessoesShards[1]() as sessao:
+        assert (sessao.get(Veiculo, 1).marca, sessao.get(Veiculo, 1).preco) == (m1, 1.0)
+
+
+def test_consulta_lenta_registra_sql_e_plano(sessao_em_memoria, caplog):
+    from servidor.consulta_lenta import RegistroConsultasLentas
+
+    registro = RegistroConsultasLentas(limiar_ms=0, amostra=1.0, max_por_minuto=1)
+    consulta = aplicar_filtros(sessao_em_memoria.query(Veiculo), {"marca": "X", "ano_min": 2019})
+
+    with caplog.at_level("WARNING", logger="centercar.consultas_lentas"):
+        assert registro.observa(consulta, {"marca": "X", "ano_min": 2019}, 1, 0.75)
+        # teto de 1 por minuto: a segunda é suprimida
+        assert not registro.observa(consulta, {"marca": "X"}, 1, 0.75)
+
+    assert registro.suprimidas == 1
+    msg = caplog.records[0].getMessage()
+    assert "750.0 ms" in msg and '"ano_min": 2019' in msg
+    assert "veiculos.marca = 'X'" in msg  # SQL com literais
+    assert "SEARCH veiculos USING INDEX ix_veiculos_busca_marca (marca=?)" in msg  # saída do EXPLAIN QUERY PLAN
+
+
+def test_consulta_interrompida_pelo_prazo_vai_para_o_log(sessao_em_memoria, monkeypatch, caplog):
+    import time
+    from contextlib import contextmanager
+
+    import servidor.servidor_mcp as srv
+    from servidor.consulta_lenta import RegistroConsultasLentas
+
+    @contextmanager
+    def prazo_estoura(sessao, prazo):
+        # o SQLite abortando a consulta (o progress handler de verdade: test_prazo_interrompe_consulta_no_sqlite)
+        yield
+        raise srv.PrazoExcedido()
+
+    # limiar acima do prazo: sem a marca de interrompida ela nunca seria registrada
+    monkeypatch.setattr(srv, "CONSULTAS_LENTAS", RegistroConsultasLentas(limiar_ms=10_000, amostra=1.0))
+    monkeypatch.setattr(srv, "_prazo_sqlite", prazo_estoura)
+
+    with caplog.at_level("WARNING", logger="centercar.consultas_lentas"):
+        with pytest.raises(srv.PrazoExcedido):
+            srv._consulta_em(lambda: sessao_em_memoria, {"marca": "X"}, 10, time.perf_counter() + 5)
+
+    msg = caplog.records[0].getMessage()
+    assert "interrompida pelo prazo" in msg
+    assert "veiculos.marca = 'X'" in msg and "ix_veiculos_busca_marca" in msg
+
+
+def test_consulta_rapida_nao_registra(sessao_em_memoria):
+    from servidor.consulta_lenta import RegistroConsultasLentas
+
+    registro = RegistroConsultasLentas(limiar_ms=500)
+    consulta = aplicar_filtros(sessao_em_memoria.query(Veiculo), {})
+    assert not registro.observa(consulta, {}, 2, 0.01)
+
+
+def test_prazo_interrompe_consulta_no_sqlite(sessao_em_memoria):
+    import time
+
+    from sqlalchemy import text
+
+    from servidor.servidor_mcp import PrazoExcedido, _prazo_sqlite
+
+    infinita = text("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c")
+    inicio = time.perf_counter()
+    with pytest.raises(PrazoExcedido):
+        with _prazo_sqlite(sessao_em_memoria, inicio + 0.05):
+            sessao_em_memoria.execute(infinita).scalar()
+    assert time.perf_counter() - inicio < 2.0
+
+    # o handler sai junto com o bloco: a conexão segue utilizável
+    sessao_em_memoria.rollback()
+    assert sessao_em_memoria.query(Veiculo).count() == 2
+
+
+@pytest.mark.parametrize("particao", ["marca", "id"])
+def test_shards_seed_e_scatter_gather(tmp_path, monkeypatch, particao):
+    """Seed grava cada linha no shard certo; a busca intercala os shards mantendo ordem e limite."""
+    import center_car.banco_dados as bd
+    import servidor.servidor_mcp as srv
+    from center_car.gerar_dados_ficticios import popula_bd
+
+    engines = [
+        create_engine(f"sqlite:///{tmp_path}/s{i}.db", connect_args={"check_same_thread": False}) for i in range(3)
+    ]
+    for e in engines:
+        Base.metadata.create_all(bind=e)
+    monkeypatch.setattr(bd, "engines_shards", engines)
+    monkeypatch.setattr(bd, "SessoesShards", [sessionmaker(bind=e) for e in engines])
+    monkeypatch.setattr(bd, "PARTICAO_SHARDS", particao)
+
+    popula_bd(120)
+    popula_bd(30)  # segunda carga continua a numeração global
+    por_shard = [bd.obter_sessao_shard(i).query(Veiculo).all() for i in range(3)]
+    assert sorted(v.id for vs in por_shard for v in vs) == list(range(1, 151))
+    for i, vs in enumerate(por_shard):
+        assert all(bd.shard_de(v.marca, v.id) == i for v in vs)
+
+    resultados, truncado = srv._busca({"limite": 40})
+    assert [v["id"] for v in resultados] == list(range(1, 41)) and truncado
+
+    marca = por_shard[0][0].marca
+    esperados = sorted(v.id for vs in por_shard for v in vs if v.marca == marca)
+    resultados, truncado = srv._busca({"marca": marca})
+    assert [v["id"] for v in resultados] == esperados and not truncado
+    assert bd.shards_da_consulta({"marca": marca}) == ([0] if particao == "marca" else [0, 1, 2])
+
+
+def test_replica_memoria_troca_sem_afetar_consulta_em_andamento(tmp_path, monkeypatch):
+    """A réplica só troca quando a versão no disco muda, e quem já estava lendo a cópia velha não é afetado."""
+    import servidor.servidor_mcp as srv
+    from servidor.replica_memoria import ReplicaMemoria
+
+    caminho = tmp_path / "base.db"
+    engine = create_engine(f"sqlite:///{caminho}")
+    Base.metadata.create_all(bind=engine)
+    Disco = sessionmaker(bind=engine)
+    campos = dict(
+        modelo="Alpha",
+        ano=2020,
+        motorizacao="1.0",
+        tipo_combustivel="Gasolina",
+        cor="Branco",
+        quilometragem=1000,
+        numero_portas=4,
+        transmissao="Manual",
+        preco=50000,
+    )
+
+    with Disco() as sessao:
+        sessao.add(Veiculo(marca="X", **campos))
+        sessao.commit()
+    replica = ReplicaMemoria(str(caminho), versao_dados, Disco, intervalo=60)
+    em_andamento = replica.sessao()
+    assert em_andamento.query(Veiculo).count() == 1
+    assert not replica.verifica()
+
+    with Disco() as sessao:
+        sessao.add(Veiculo(marca="Y", **campos))
+        sessao.commit()
+    assert replica.sessao().query(Veiculo).count() == 1  # ainda não trocou
+    assert replica.verifica()
+    assert em_andamento.query(Veiculo).count() == 1  # geração velha segue viva para quem a usa
+    em_andamento.close()
+
+    monkeypatch.setattr(srv, "REPLICAS", [replica])
+    resultados, _ = srv._busca({})
+    assert [v["marca"] for v in resultados] == ["X", "Y"]
+
+
+def test_escrita_com_replica_le_o_valor_novo_logo_depois_do_ack(tmp_path, monkeypatch):
+    """Com réplica em memória, o update_prices só confirma depois de recopiá-la: nada de linha velha pós-ack."""
+    import servidor.servidor_mcp as srv
+    from servidor.cache_linhas import CacheLinhas
+    from servidor.escritor import EscritorEmGrupo
+    from servidor.replica_memoria import ReplicaMemoria
+    from tests.test_protocolo import FakeConn, _frame
+
+    caminho = tmp_path / "base.db"
+    engine = create_engine(f"sqlite:///{caminho}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Disco = sessionmaker(bind=engine)
+    with Disco() as sessao:
+        sessao.add(
+            Veiculo(
+                marca="Fiat",
+                modelo="Uno",
+                ano=2015,
+                motorizacao="1.0",
+                tipo_combustivel="Flex",
+                cor="Prata",
+                quilometragem=80000,
+                numero_portas=4,
+                transmissao="Manual",
+                preco=30000,
+            )
+        )
+        sessao.commit()
+    # intervalo longo: só a escrita pode atualizar a cópia durante o teste
+    replica = ReplicaMemoria(str(caminho), versao_dados, Disco, intervalo=60)
+    replica.reconstroi()
+    monkeypatch.setattr(srv, "obter_sessao", Disco)
+    monkeypatch.setattr(srv, "REPLICAS", [replica])
+    monkeypatch.setattr(srv, "CACHE_LINHAS", CacheLinhas(100))
+    monkeypatch.setattr(srv, "ESCRITA_HABILITADA", True)
+    monkeypatch.setattr(srv, "ESCRITOR", EscritorEmGrupo(srv._aplica_escritas, 0.01, 5000))
+
+    assert json.loads(srv._linhas_por_ids([1])[1])["preco"] == 30000  # esquenta o cache a partir da réplica
+    conn = FakeConn(_frame({"tool": "update_prices", "args": {"itens": [{"id": 1, "preco": 27500}]}}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    assert json.loads(conn.sent[4:].decode("utf-8"))["result"][0]["status"] == "atualizado"
+
+    assert json.loads(srv._linhas_por_ids([1])[1])["preco"] == 27500
+    resultados, _ = srv._busca({})
+    assert [v["preco"] for v in resultados] == [27500]
+
+
+_BUSCA_JSON = """
+import json, sys
+import servidor.servidor_mcp as srv
+filtros = json.loads(sys.argv[1])
+print(json.dumps(srv._busca(filtros)[0]))
+"""
+
+_NOMES_REPLICA = """
+import servidor.servidor_mcp as srv
+from center_car import modelo_veiculo
+from center_car.banco_dados import CAMINHO_BD, obter_sessao
+from servidor.replica_memoria import ReplicaMemoria
+replica = ReplicaMemoria(CAMINHO_BD, srv.versao_dados, obter_sessao, intervalo=60)
+with obter_sessao() as sessao:
+    sessao.query(modelo_veiculo.Veiculo).first().marca
+for _ in range(3):
+    replica.reconstroi()
+    with replica.sessao() as sessao:
+        sessao.query(modelo_veiculo.Veiculo).first().marca
+print(sorted(modelo_veiculo._NOMES_POR_ARQUIVO) == [CAMINHO_BD])
+"""
+
+
+def test_migracao_dicionario_preserva_buscas(tmp_path):
+    """Depois de migrar para o esquema dicionário, as buscas devolvem exatamente o mesmo que antes."""
+    import os
+    import subprocess
+    import sys
+
+    from center_car.migrar_dicionario import migra_arquivo
+
+    caminho = tmp_path / "base.db"
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def roda(codigo, esquema, *args):
+        env = dict(os.environ, PYTHONPATH=raiz, CENTERCAR_BD=str(caminho), CENTERCAR_ESQUEMA=esquema)
+        env.pop("CENTERCAR_SHARDS", None)
+        saida = subprocess.run([sys.executable, "-c", codigo, *args], env=env, capture_output=True, text=True)
+        assert saida.returncode == 0, saida.stderr
+        return saida.stdout
+
+    roda(
+        "from center_car.gerar_dados_ficticios import create_tables, popula_bd; create_tables(); popula_bd(300)",
+        "texto",
+    )
+    amostra = json.loads(roda(_BUSCA_JSON, "texto", json.dumps({"limite": 1})))[0]
+    consultas = [
+        {"limite": 50},
+        {"marca": amostra["marca"]},
+        {"marca": amostra["marca"], "tipo_combustivel": amostra["tipo_combustivel"]},
+        {"tipo_combustivel": amostra["tipo_combustivel"], "preco_max": 150000},
+    ]
+    antes = [roda(_BUSCA_JSON, "texto", json.dumps(f)) for f in consultas]
+
+    migra_arquivo(str(caminho))
+    migra_arquivo(str(caminho))  # segunda vez não faz nada
+    depois = [roda(_BUSCA_JSON, "dicionario", json.dumps(f)) for f in consultas]
+    assert depois == antes
+
+    # seed no esquema novo continua funcionando (e reaproveita os lookups)
+    roda("from center_car.gerar_dados_ficticios import popula_bd; popula_bd(20)", "dicionario")
+    assert len(json.loads(roda(_BUSCA_JSON, "dicionario", json.dumps({"limite": 500})))) == 320
+
+    # disco e cada geração da réplica em memória dividem os nomes dos lookups do arquivo (não acumulam por geração)
+    assert roda(_NOMES_REPLICA, "dicionario").strip() == "True"
+
+
 # --- Parte 2: testes de cliente MCP simulando socket ---
 
 
@@ -85,9 +817,10 @@ class FakeSocket:
     def __init__(self, responses):
         self._resp = responses.copy()
         self.sent = b""
+        self.timeout = None
 
-    def settimeout(self, _):  # tolera chamadas em código real
-        pass
+    def settimeout(self, t):  # tolera chamadas em código real
+        self.timeout = t
 
     def connect(self, addr):
         pass
@@ -168,3 +901,100 @@ def test_envia_filtros_trata_excecao(monkeypatch):
 
     resultado = envia_filtros({"marca": "X"})
     assert resultado == []
+
+
+def test_envia_filtros_espera_o_prazo_pedido_mais_margem(monkeypatch):
+    import cliente.cliente_mcp as cliente_mcp
+
+    dados = json.dumps({"ok": True, "result": []}).encode("utf-8")
+    for prazo_ms, esperado in ((None, cliente_mcp.PRAZO_PADRAO_MS / 1000), (12_000, 12.0)):
+        fake = FakeSocket([len(dados).to_bytes(4, "big"), dados])
+        monkeypatch.setattr(socket, "socket", lambda *a, **k: fake)
+        assert envia_filtros({"marca": "X"}, prazo_ms=prazo_ms) == []
+        assert fake.timeout == esperado + cliente_mcp.MARGEM_PRAZO
+
+
+def test_subscribe_pelo_socket_retoma_e_reinicia_quando_o_log_foi_podado(tmp_path, monkeypatch):
+    """cliente_mcp.assina_alteracoes contra o servidor de verdade, num socket TCP local."""
+    import threading
+
+    import cliente.cliente_mcp as cli
+    import servidor.servidor_mcp as srv
+
+    monkeypatch.setattr(socket, "socket", _SOCKET_REAL)
+    engine = create_engine(f"sqlite:///{tmp_path / 'base.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Sessao = sessionmaker(bind=engine)
+    monkeypatch.setattr(srv, "obter_sessao", Sessao)
+    monkeypatch.setattr(srv, "INTERVALO_SUBSCRICAO", 0.01)
+    monkeypatch.setattr(srv, "HEARTBEAT_SUBSCRICAO", 0.05)
+
+    with Sessao() as sessao:
+        for marca in ("A", "B", "C"):
+            sessao.add(
+                Veiculo(
+                    marca=marca,
+                    modelo="M",
+                    ano=2020,
+                    motorizacao="1.0",
+                    tipo_combustivel="Flex",
+                    cor="Azul",
+                    quilometragem=0,
+                    numero_portas=4,
+                    transmissao="Manual",
+                    preco=10.0,
+                )
+            )
+        sessao.commit()
+
+    ouvinte = socket.create_server(("127.0.0.1", 0))
+    monkeypatch.setattr(cli, "HOST", "127.0.0.1")
+    monkeypatch.setattr(cli, "PORTA", ouvinte.getsockname()[1])
+    atendimentos = []
+
+    def aceita():
+        while True:
+            try:
+                conn, addr = ouvinte.accept()
+            except OSError:
+                return
+            atendimentos.append(threading.Thread(target=srv.trata_cliente, args=(conn, addr), daemon=True))
+            atendimentos[-1].start()
+
+    threading.Thread(target=aceita, daemon=True).start()
+
+    def primeiro_frame(desde=None):
+        frames = cli.assina_alteracoes(desde)
+        try:
+            return next(frames)
+        finally:
+            frames.close()
+
+    try:
+        frame = primeiro_frame()
+        assert frame["reinicio"] is True and frame["seq"] == 3 and len(frame["result"]) == 3
+
+        with Sessao() as sessao:
+            sessao.get(Veiculo, 1).preco = 11.0
+            sessao.commit()
+        frame = primeiro_frame(3)
+        assert "reinicio" not in frame and frame["seq"] == 4
+        assert [(d["op"], d["id"]) for d in frame["result"]] == [("update", 1)]
+
+        with Sessao() as sessao:
+            assert poda_alteracoes(sessao, manter=1) == 3
+        frame = primeiro_frame(2)  # a entrada 3 já saiu do log: snapshot completo de novo
+        assert frame["reinicio"] is True and frame["seq"] == 4 and len(frame["result"]) == 3
+        frame = primeiro_frame(3)  # nada depois do 3 foi podado: retoma normalmente
+        assert "reinicio" not in frame and frame["seq"] == 4
+
+        monkeypatch.setattr(srv, "usa_shards", lambda: True)
+        with pytest.raises(cli.AssinaturaRecusada) as recusa:
+            primeiro_frame()
+        assert recusa.value.code == "INVALID_REQUEST"
+    finally:
+        ouvinte.close()
+        # cada atendimento termina no primeiro heartbeat que não consegue mais enviar
+        for atendimento in atendimentos:
+            atendimento.join(2.0)
+    assert not any(a.is_alive() for a in atendimentos)
@@ -0,0 +1,188 @@
+# tests/test_perf.py
+"""
+Testes de desempenho (opt-in): `pytest -m perf` ou `make perf`.
+
+Semeia um SQLite em memória com PERF_VEICULOS veículos (sempre os mesmos,
+sementes fixas) e cronometra os caminhos quentes do search_cars: filtro
+(SQL + ORM), hidratação, encode, o servidor inteiro via FakeConn e uma ida
+e volta cliente -> servidor por socket de verdade.
+
+Cada tempo é guardado em tests/perf_baseline.json dividido pelo tempo de uma
+carga de calibração (Python puro) medida na mesma rodada — assim o baseline
+vale entre máquinas mais rápidas e mais lentas. Um caminho falha quando fica
+mais de CENTERCAR_PERF_TOLERANCIA vezes (padrão 2.0) acima do baseline.
+Mudança intencional? Regrave com:
+
+    CENTERCAR_PERF_ATUALIZAR=1 pytest -m perf
+"""
+
+import json
+import os
+import random
+import socket
+import statistics
+import threading
+import time
+from typing import Any, Callable, Dict
+
+import pytest
+from faker import Faker
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import center_car.gerar_dados_ficticios as gerador
+import cliente.cliente_mcp as cli
+import servidor.servidor_mcp as srv
+from center_car.modelo_veiculo import Base, Veiculo
+from tests.test_protocolo import FakeConn, _frame
+
+pytestmark = pytest.mark.perf
+
+PERF_VEICULOS = 5_000
+ARQUIVO_BASELINE = os.path.join(os.path.dirname(__file__), "perf_baseline.json")
+TOLERANCIA = float(os.getenv("CENTERCAR_PERF_TOLERANCIA", "2.0"))
+ATUALIZAR = os.getenv("CENTERCAR_PERF_ATUALIZAR", "0") == "1"
+
+FILTROS = {"marca": "Ford", "preco_max": 150_000}
+REPETICOES = 7
+RODADA_MINIMA_S = 0.05
+
+
+def _mede(fn: Callable[[], Any]) -> float:
+    """µs por chamada: mediana de REPETICOES rodadas, cada uma com chamadas suficientes para RODADA_MINIMA_S."""
+    fn()  # aquece caches (SQLAlchemy compila a consulta na primeira vez)
+    n = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(n):
+            fn()
+        if time.perf_counter() - t0 >= RODADA_MINIMA_S:
+            break
+        n *= 2
+    amostras = []
+    for _ in range(REPETICOES):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            fn()
+        amostras.append((time.perf_counter() - t0) / n)
+    return statistics.median(amostras) * 1e6
+
+
+def _calibracao() -> None:
+    # Python puro, parecido com o que o servidor faz: dicts, laço e json
+    linhas = [{"id": i, "marca": "Ford", "preco": i * 1.5} for i in range(500)]
+    json.dumps([{k: v for k, v in linha.items()} for linha in linhas])
+
+
+@pytest.fixture(scope="module")
+def medicoes():
+    """Baseline gravado + as medições da rodada; com CENTERCAR_PERF_ATUALIZAR=1, regrava o arquivo no fim."""
+    try:
+        with open(ARQUIVO_BASELINE, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+    if baseline.get("veiculos") not in (None, PERF_VEICULOS) and not ATUALIZAR:
+        pytest.fail(f"baseline gravado com {baseline['veiculos']} veículos; regrave com CENTERCAR_PERF_ATUALIZAR=1")
+    estado = {"baseline": baseline.get("caminhos", {}), "calibracao_us": _mede(_calibracao), "atual": {}}
+    yield estado
+    if ATUALIZAR:
+        with open(ARQUIVO_BASELINE, "w", encoding="utf-8") as f:
+            json.dump({"veiculos": PERF_VEICULOS, "caminhos": estado["atual"]}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+def _confere(medicoes: Dict[str, Any], caminho: str, us: float) -> None:
+    """Compara `us` (µs/op) com o baseline do caminho, normalizado pela calibração desta rodada."""
+    calibracao = medicoes["calibracao_us"]
+    medicoes["atual"][caminho] = round(us / calibracao, 4)
+    if ATUALIZAR:
+        return
+    relativo = medicoes["baseline"].get(caminho)
+    if relativo is None:
+        pytest.fail(f"sem baseline para {caminho!r}; grave com CENTERCAR_PERF_ATUALIZAR=1 pytest -m perf")
+    esperado = relativo * calibracao
+    razao = us / esperado
+    if razao > TOLERANCIA:
+        pytest.fail(
+            f"regressão de desempenho em {caminho!r}:\n"
+            f"  atual     {us:10.1f} µs/op\n"
+            f"  esperado  {esperado:10.1f} µs/op  (baseline x calibração desta máquina: {calibracao:.1f} µs)\n"
+            f"  {razao:.2f}x mais lento, tolerância {TOLERANCIA:.2f}x (CENTERCAR_PERF_TOLERANCIA)\n"
+            f"  se a mudança for intencional: CENTERCAR_PERF_ATUALIZAR=1 pytest -m perf",
+            pytrace=False,
+        )
+
+
+@pytest.fixture(scope="module")
+def base():
+    """SQLite em memória com PERF_VEICULOS veículos, sempre os mesmos; servidor e seed apontando para ele."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Sessao = sessionmaker(bind=engine)
+    mp = pytest.MonkeyPatch()
+    mp.setattr(gerador, "obter_sessao", Sessao)
+    mp.setattr(srv, "obter_sessao", Sessao)
+    random.seed(2025)
+    Faker.seed(2025)
+    gerador.popula_bd(PERF_VEICULOS)
+    yield Sessao
+    mp.undo()
+    engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def veiculos(base):
+    with base() as sessao:
+        return srv.aplicar_filtros(sessao.query(Veiculo), FILTROS).order_by(Veiculo.id).all()
+
+
+def test_perf_filtro(base, medicoes):
+    def filtra():
+        with base() as sessao:
+            srv.aplicar_filtros(sessao.query(Veiculo), FILTROS).order_by(Veiculo.id).all()
+
+    _confere(medicoes, "filtro", _mede(filtra))
+
+
+def test_perf_hidratacao(veiculos, medicoes):
+    _confere(medicoes, "hidratacao", _mede(lambda: [srv._veiculo_para_dict(v) for v in veiculos]))
+
+
+def test_perf_encode(veiculos, medicoes):
+    resultados = [srv._veiculo_para_dict(v) for v in veiculos]
+    _confere(medicoes, "encode", _mede(lambda: srv._ok_pagina(resultados, False)))
+
+
+def test_perf_servidor_fakeconn(base, medicoes, monkeypatch):
+    monkeypatch.setattr(srv, "COALESCER_CONSULTAS", False)
+    requisicao = _frame({"tool": "search_cars", "args": dict(FILTROS, limite=100)})
+
+    def atende():
+        conn = FakeConn(requisicao)
+        srv.trata_cliente(conn, ("127.0.0.1", 1))
+        assert conn.sent[4:5] == b"{"
+
+    _confere(medicoes, "servidor_fakeconn", _mede(atende))
+
+
+def test_perf_ida_e_volta(veiculos, medicoes, monkeypatch):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as servidor:
+        servidor.bind(("127.0.0.1", 0))
+        servidor.listen()
+
+        def aceita():
+            while True:
+                try:
+                    conn, addr = servidor.accept()
+                except OSError:
+                    return  # socket fechado no fim do teste
+                threading.Thread(target=srv.trata_cliente, args=(conn, addr), daemon=True).start()
+
+        threading.Thread(target=aceita, daemon=True).start()
+        monkeypatch.setattr(cli, "HOST", "127.0.0.1")
+        monkeypatch.setattr(cli, "PORTA", servidor.getsockname()[1])
+        # páginas de 100: o cliente segue o cursor até trazer tudo
+        assert len(cli.envia_filtros(dict(FILTROS, limite=100))) == len(veiculos)
+        _confere(medicoes, "ida_e_volta", _mede(lambda: cli.envia_filtros(dict(FILTROS, limite=100))))
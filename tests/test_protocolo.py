@@ -77,10 +77,23 @@ class FakeQuery:
     def __init__(self, results):
         self._results = results
 
-    # o servidor só chama .all() após aplicar filtros
+    # o servidor ordena por id e limita a página antes do .all()
+    def order_by(self, *_):
+        return self
+
+    def limit(self, n):
+        return type(self)(self._results[:n])
+
     def all(self):
         return self._results
 
+    # consulta_busca: os filtros rodam numa subconsulta de ids e as linhas vêm com IN
+    def filter(self, *_):
+        return self
+
+    def scalar_subquery(self):
+        return [v.id for v in self._results]
+
 
 class FakeSession:
     def __init__(self, results):
@@ -192,3 +205,706 @@ def test_servidor_ok_envelope_valido(monkeypatch):
     assert isinstance(msg["result"], list)
     assert len(msg["result"]) == 2
     assert {"id", "marca", "modelo", "ano", "cor", "quilometragem", "preco"} <= set(msg["result"][0].keys())
+
+
+def _porta_livre() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_servidor_sinaliza_pronto_ao_escutar():
+    """iniciar_servidor deve sinalizar o evento `pronto` só depois do listen()."""
+    import threading
+
+    porta = _porta_livre()
+    pronto = threading.Event()
+    threading.Thread(
+        target=srv.iniciar_servidor,
+        kwargs={"host": "127.0.0.1", "porta": porta, "pronto": pronto},
+        daemon=True,
+    ).start()
+
+    assert pronto.wait(5.0)
+    # se o evento foi sinalizado, o connect não pode ser recusado
+    with socket.create_connection(("127.0.0.1", porta), timeout=2.0):
+        pass
+
+
+def test_servidor_sinaliza_pronto_antes_de_aquecer(monkeypatch):
+    """O aquecimento roda em segundo plano: `pronto` não espera por ele."""
+    import threading
+
+    liberado = threading.Event()
+    monkeypatch.setattr(srv, "aquece", lambda: liberado.wait(5.0))
+    monkeypatch.setattr(srv, "inicia_poda_alteracoes", lambda: None)
+    porta = _porta_livre()
+    pronto = threading.Event()
+    threading.Thread(
+        target=srv.iniciar_servidor,
+        kwargs={"host": "127.0.0.1", "porta": porta, "pronto": pronto},
+        daemon=True,
+    ).start()
+    try:
+        assert pronto.wait(5.0)
+    finally:
+        liberado.set()
+
+
+def test_server_stats_conta_requisicoes_e_fases(monkeypatch):
+    """Depois de um search_cars, server_stats expõe contadores por tool e histogramas por fase."""
+    from servidor.metricas import METRICAS
+
+    METRICAS.zera()
+    monkeypatch.setattr(srv, "obter_sessao", lambda: FakeSession([_V(id=1)]))
+    monkeypatch.setattr(srv, "aplicar_filtros", lambda q, f: q)
+    srv.trata_cliente(FakeConn(_frame({"tool": "search_cars", "args": {}})), ("127.0.0.1", 1))
+    srv.trata_cliente(FakeConn(_frame({"tool": "xpto", "args": {}})), ("127.0.0.1", 1))
+
+    conn = FakeConn(_frame({"tool": "server_stats", "args": {}}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    stats = json.loads(conn.sent[4:].decode("utf-8"))["result"]
+
+    busca = stats["tools"]["search_cars"]
+    assert busca["requisicoes"] == 1 and busca["erros"] == 0
+    assert busca["bytes_in"] > 0 and busca["bytes_out"] > 0
+    assert stats["tools"]["unknown"]["erros"] == 1
+    assert stats["conexoes_ativas"] == 1  # a própria conexão do server_stats
+    for fase in ("recv", "decode", "consulta", "hidratacao", "encode", "send"):
+        assert stats["fases"][fase]["n"] >= 1
+
+    conn = FakeConn(_frame({"tool": "server_stats", "args": {"formato": "texto"}}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    texto = json.loads(conn.sent[4:].decode("utf-8"))["result"]
+    assert 'centercar_tool_requisicoes_total{tool="search_cars"} 1' in texto
+    assert 'centercar_fase_us_count{fase="consulta"} 1' in texto
+
+
+def test_histograma_percentis():
+    from servidor.metricas import Histograma
+
+    h = Histograma()
+    for _ in range(99):
+        h.observa(0.000_010)  # 10 µs -> bucket de 16 µs
+    h.observa(0.5)
+    assert h.percentil_us(50) == 16
+    assert h.percentil_us(100) == 500_000
+    assert h.resumo()["n"] == 100
+
+
+def test_perfilador_por_token_grava_perfil(monkeypatch, tmp_path):
+    """Envelope com a flag privilegiada é perfilado mesmo com o perfilador desligado."""
+    import pstats
+
+    from servidor.perfilador import Perfilador
+
+    monkeypatch.setattr(srv, "PERFILADOR", Perfilador(ativo=False, diretorio=str(tmp_path), token="segredo"))
+    monkeypatch.setattr(srv, "obter_sessao", lambda: FakeSession([_V(id=1)]))
+    monkeypatch.setattr(srv, "aplicar_filtros", lambda q, f: q)
+
+    srv.trata_cliente(FakeConn(_frame({"tool": "search_cars", "args": {}})), ("127.0.0.1", 1))
+    assert list(tmp_path.iterdir()) == []
+
+    req = {"tool": "search_cars", "args": {"marca": "Jeep"}, "perfilar": "segredo"}
+    conn = FakeConn(_frame(req))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+
+    assert json.loads(conn.sent[4:].decode("utf-8"))["ok"] is True
+    (perfil,) = tmp_path.iterdir()
+    assert perfil.suffix == ".prof"
+    assert pstats.Stats(str(perfil)).total_calls > 0
+
+
+def test_perfilador_padroes_e_limite(tmp_path):
+    from servidor.perfilador import Perfilador
+
+    p = Perfilador(
+        ativo=True, diretorio=str(tmp_path), padrao_tool="search_*", padrao_filtro='*"modelo"*', max_por_minuto=1
+    )
+    assert p.elegivel({"tool": "search_cars", "args": {"modelo": "Ren"}})
+    assert not p.elegivel({"tool": "search_cars", "args": {"marca": "Jeep"}})
+    assert not p.elegivel({"tool": "server_stats", "args": {"modelo": "Ren"}})
+
+    req = {"tool": "search_cars", "args": {"modelo": "Ren"}}
+    for _ in range(3):
+        with p.talvez(req):
+            sum(range(100))
+    assert len(list(tmp_path.iterdir())) == 1  # teto de 1 perfil por minuto
+
+
+def test_log_requisicao_estruturado_e_amostrado(caplog):
+    import logging
+    import queue
+
+    from servidor.metricas import METRICAS
+    from servidor.registro_log import FormatterEstruturado, QueueHandlerDescartavel, log_requisicao
+
+    with caplog.at_level(logging.INFO, logger="centercar.servidor"):
+        log_requisicao(("10.0.0.1", 999), "search_cars", {"marca": "Jeep", "ano_min": 2020}, 0.0125, 3)
+        log_requisicao(("10.0.0.1", 999), "search_cars", {}, 0.01, 0, amostra=0.0)
+
+    (rec,) = caplog.records
+    linha = FormatterEstruturado("%(message)s").format(rec)
+    assert linha == "requisicao cliente=10.0.0.1:999 tool=search_cars filtros=ano_min,marca duracao_ms=12.5 linhas=3"
+
+    # fila cheia descarta em vez de bloquear, e o descarte aparece no server_stats
+    descartados = METRICAS.eventos.get("logs_descartados", 0)
+    handler = QueueHandlerDescartavel(queue.Queue(maxsize=1))
+    handler.handle(rec)
+    handler.handle(rec)
+    assert METRICAS.snapshot()["eventos"]["logs_descartados"] == descartados + 1
+
+
+def _busca_fake(monkeypatch, n):
+    monkeypatch.setattr(srv, "obter_sessao", lambda: FakeSession([_V(id=i) for i in range(1, n + 1)]))
+    monkeypatch.setattr(srv, "aplicar_filtros", lambda q, f: q)
+    conn = FakeConn(_frame({"tool": "search_cars", "args": {}}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    return json.loads(conn.sent[4:].decode("utf-8"))
+
+
+def test_servidor_trunca_por_linhas_com_cursor(monkeypatch):
+    monkeypatch.setattr(srv, "MAX_LINHAS_RESPOSTA", 2)
+    msg = _busca_fake(monkeypatch, 3)
+    assert msg["ok"] is True
+    assert [v["id"] for v in msg["result"]] == [1, 2]
+    assert msg["truncado"] is True and msg["cursor"] == 2
+
+    # exatamente no limite: sem truncado/cursor
+    msg = _busca_fake(monkeypatch, 2)
+    assert "truncado" not in msg and "cursor" not in msg
+
+
+def test_servidor_trunca_por_bytes(monkeypatch):
+    monkeypatch.setattr(srv, "MAX_BYTES_RESPOSTA", 700)
+    msg = _busca_fake(monkeypatch, 10)
+    assert 1 <= len(msg["result"]) < 10
+    assert msg["truncado"] is True and msg["cursor"] == msg["result"][-1]["id"]
+
+
+def test_servidor_modo_erro_result_too_large(monkeypatch):
+    monkeypatch.setattr(srv, "MAX_LINHAS_RESPOSTA", 2)
+    monkeypatch.setattr(srv, "LIMITE_MODO", "erro")
+    msg = _busca_fake(monkeypatch, 3)
+    assert msg["ok"] is False
+    assert msg["error"]["code"] == "RESULT_TOO_LARGE"
+
+
+def test_cliente_segue_cursor_das_paginas(monkeypatch):
+    paginas = [
+        {"ok": True, "result": [{"id": 1}, {"id": 2}], "truncado": True, "cursor": 2, "resolvido": {"marca": "X"}},
+        {"ok": True, "result": [{"id": 3}], "resolvido": {"marca": "X"}},
+    ]
+    enviados = []
+
+    class PaginaSocket:
+        def __init__(self, *_a, **_k):
+            data = json.dumps(paginas.pop(0)).encode("utf-8")
+            self._resp = [len(data).to_bytes(4, "big"), data]
+
+        def settimeout(self, t):
+            pass
+
+        def connect(self, addr):
+            pass
+
+        def sendall(self, b):
+            enviados.append(json.loads(b[4:].decode("utf-8")))
+
+        def recv(self, n):
+            return self._resp.pop(0) if self._resp else b""
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            pass
+
+    monkeypatch.setattr(socket, "socket", PaginaSocket)
+
+    resolvido = {}
+    assert _envia({"marca": "Xx"}, fuzzy=True, resolvido=resolvido) == [{"id": 1}, {"id": 2}, {"id": 3}]
+    assert enviados[0]["args"] == {"marca": "Xx", "fuzzy": True}
+    assert enviados[1]["args"] == {"marca": "Xx", "fuzzy": True, "cursor": 2}
+    assert resolvido == {"marca": "X"}
+
+
+def test_rastreio_de_memoria_por_forma(monkeypatch):
+    import tracemalloc
+
+    from servidor.memoria import RastreadorMemoria
+    from servidor.metricas import METRICAS
+
+    METRICAS.zera()
+    monkeypatch.setattr(srv, "MEMORIA", RastreadorMemoria(ativo=True))
+    monkeypatch.setattr(srv, "obter_sessao", lambda: FakeSession([_V(id=i) for i in range(500)]))
+    monkeypatch.setattr(srv, "aplicar_filtros", lambda q, f: q)
+    srv.trata_cliente(FakeConn(_frame({"tool": "search_cars", "args": {"marca": "X"}})), ("127.0.0.1", 1))
+
+    tracemalloc.stop()
+
+    memoria = METRICAS.snapshot()["memoria_por_forma"]
+    assert memoria["marca"]["n"] == 1
+    assert memoria["marca"]["max_kb"] > 0
+
+
+def test_single_flight_coalesce_chamadas_simultaneas():
+    import threading
+    import time
+
+    from servidor.coalescencia import SingleFlight
+
+    sf = SingleFlight()
+    liberar = threading.Event()
+    chamadas = []
+
+    def lenta():
+        chamadas.append(1)
+        liberar.wait(5)
+        return b"bytes-codificados"
+
+    saidas = []
+    threads = [threading.Thread(target=lambda: saidas.append(sf.executa("k", lenta))) for _ in range(6)]
+    for t in threads:
+        t.start()
+    # espera todo mundo entrar no voo antes de liberar o líder
+    while "k" not in sf._em_voo or sf._em_voo["k"].espera < 5:
+        time.sleep(0.001)
+    liberar.set()
+    for t in threads:
+        t.join()
+
+    assert len(chamadas) == 1
+    assert {valor for valor, _ in saidas} == {b"bytes-codificados"}
+    assert sorted(comp for _, comp in saidas) == [False] + [True] * 5
+
+    # terminado o voo, a próxima chamada executa de novo (não é cache)
+    assert sf.executa("k", lambda: b"novo") == (b"novo", False)
+
+
+def test_single_flight_propaga_erro_do_lider():
+    from servidor.coalescencia import SingleFlight
+
+    sf = SingleFlight()
+
+    def falha():
+        raise RuntimeError("banco fora")
+
+    with pytest.raises(RuntimeError):
+        sf.executa("k", falha)
+    assert sf._em_voo == {}
+
+
+def test_carona_com_prazo_maior_nao_herda_timeout_do_lider(monkeypatch):
+    """Dois search_cars iguais com prazos diferentes: o líder (200 ms) estoura; o carona busca com o próprio prazo."""
+    import threading
+    import time
+
+    from servidor.coalescencia import SingleFlight
+
+    sf = SingleFlight()
+    monkeypatch.setattr(srv, "COALESCEDOR", sf)
+    monkeypatch.setattr(srv, "COALESCER_CONSULTAS", True)
+
+    buscas = []
+
+    def resposta_busca(filtros, prazo):
+        buscas.append(prazo)
+        if prazo - time.perf_counter() < 1:
+            # líder de prazo curto: segura o voo até o carona entrar e então estoura
+            limite = time.perf_counter() + 2
+            while not any(voo.espera for voo in list(sf._em_voo.values())) and time.perf_counter() < limite:
+                time.sleep(0.001)
+            raise srv.PrazoExcedido()
+        return _frame({"ok": True, "result": [{"id": 1}]}), 1
+
+    monkeypatch.setattr(srv, "_resposta_busca", resposta_busca)
+
+    respostas = {}
+
+    def chama(nome, prazo_ms):
+        conn = FakeConn(_frame({"tool": "search_cars", "args": {"marca": "X"}, "prazo_ms": prazo_ms}))
+        srv.trata_cliente(conn, ("127.0.0.1", 1))
+        respostas[nome] = json.loads(conn.sent[4:].decode("utf-8"))
+
+    lider = threading.Thread(target=chama, args=("lider", 200))
+    lider.start()
+    while not sf._em_voo:
+        time.sleep(0.001)
+    carona = threading.Thread(target=chama, args=("carona", 5000))
+    carona.start()
+    lider.join(5)
+    carona.join(5)
+
+    assert respostas["lider"]["error"]["code"] == "TIMEOUT"
+    assert respostas["carona"] == {"ok": True, "result": [{"id": 1}]}
+    assert len(buscas) == 2  # o carona entrou no voo do líder e, com o erro dele, buscou por conta própria
+
+
+def test_servidor_responde_timeout_quando_prazo_estoura(monkeypatch):
+    import time
+
+    class LentaQuery(FakeQuery):
+        def all(self):
+            time.sleep(0.05)
+            return self._results
+
+    class LentaSession(FakeSession):
+        def query(self, _model):
+            return LentaQuery(self._results)
+
+    monkeypatch.setattr(srv, "obter_sessao", lambda: LentaSession([_V(id=1)]))
+    monkeypatch.setattr(srv, "aplicar_filtros", lambda q, f: q)
+
+    conn = FakeConn(_frame({"tool": "search_cars", "args": {}, "prazo_ms": 10}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    msg = json.loads(conn.sent[4:].decode("utf-8"))
+    assert msg["ok"] is False
+    assert msg["error"]["code"] == "TIMEOUT"
+
+
+def test_framing_le_frame_em_pedacos_e_limite():
+    """le_frame junta frames que chegam fatiados (inclusive o header) e recusa tamanho acima do máximo."""
+    import threading
+
+    from center_car.protocolo import FrameGrandeDemais, codifica, le_frame
+
+    a, b = socket.socketpair()
+    with a, b:
+        dados = codifica({"ok": True, "result": list(range(5000))})
+
+        def envia_fatiado():
+            for i in range(0, len(dados), 3):
+                a.sendall(dados[i : i + 3])
+
+        t = threading.Thread(target=envia_fatiado)
+        t.start()
+        corpo = le_frame(b)
+        t.join()
+        assert isinstance(corpo, bytearray)
+        assert json.loads(corpo)["result"][-1] == 4999
+
+        a.sendall((10_000).to_bytes(4, "big"))
+        with pytest.raises(FrameGrandeDemais):
+            le_frame(b, max_bytes=1_000)
+
+        a.close()
+        assert le_frame(b) is None  # EOF limpo antes do header
+
+
+def test_frame_recusa_tamanho_que_invadiria_as_flags(monkeypatch):
+    import center_car.protocolo as protocolo
+
+    monkeypatch.setattr(protocolo, "MASCARA_TAMANHO", 15)
+    assert protocolo.frame(b"x" * 15) == (15).to_bytes(4, "big") + b"x" * 15
+    with pytest.raises(protocolo.FrameGrandeDemais):
+        protocolo.frame(b"x" * 16)
+
+
+def test_servidor_recusa_frame_grande(monkeypatch):
+    monkeypatch.setattr(srv, "MAX_REQUISICAO_BYTES", 16)
+    conn = FakeConn(_frame({"tool": "search_cars", "args": {"marca": "uma marca bem comprida"}}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    msg = json.loads(conn.sent[4:].decode("utf-8"))
+    assert msg["error"]["code"] == "INVALID_HEADER"
+
+
+def test_compressao_negociada_acima_do_limiar(monkeypatch):
+    """Com "compressao" no envelope, respostas grandes saem com flag no header e voltam idênticas."""
+    import zlib
+
+    from center_car.protocolo import FLAG_ZLIB, MASCARA_TAMANHO, le_frame
+
+    monkeypatch.setattr(srv, "obter_sessao", lambda: FakeSession([_V(id=i) for i in range(1, 301)]))
+    monkeypatch.setattr(srv, "aplicar_filtros", lambda q, f: q)
+
+    conn = FakeConn(_frame({"tool": "search_cars", "args": {}, "compressao": ["brotli", "zlib"]}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    header = int.from_bytes(conn.sent[:4], "big")
+    assert header & FLAG_ZLIB
+    assert header & MASCARA_TAMANHO == len(conn.sent) - 4
+    corpo = json.loads(zlib.decompress(conn.sent[4:]))
+    assert [v["id"] for v in corpo["result"]] == list(range(1, 301))
+    assert json.loads(le_frame(FakeConn(conn.sent)))["result"] == corpo["result"]
+
+    # sem negociação (ou abaixo do limiar) o header continua sendo o tamanho puro
+    conn = FakeConn(_frame({"tool": "search_cars", "args": {}}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    assert int.from_bytes(conn.sent[:4], "big") == len(conn.sent) - 4
+
+    monkeypatch.setattr(srv, "obter_sessao", lambda: FakeSession([_V(id=1)]))
+    conn = FakeConn(_frame({"tool": "search_cars", "args": {}, "compressao": ["zlib"]}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    assert int.from_bytes(conn.sent[:4], "big") == len(conn.sent) - 4
+
+
+def test_descompressao_respeita_maximo():
+    """Um frame comprimido pequeno que expande além do máximo é recusado (frame-bomba)."""
+    import lzma
+
+    from center_car.protocolo import FLAG_LZMA, FrameGrandeDemais, FrameInvalido, frame, le_frame
+
+    bomba = frame(lzma.compress(b"0" * 100_000), FLAG_LZMA)
+    with pytest.raises(FrameGrandeDemais):
+        le_frame(FakeConn(bomba), max_bytes=10_000)
+    assert le_frame(FakeConn(bomba), max_bytes=100_000) == b"0" * 100_000
+
+    with pytest.raises(FrameInvalido):
+        le_frame(FakeConn(frame(b"nao comprimido", FLAG_LZMA)))
+
+
+def test_limitador_taxa_token_bucket_por_cliente():
+    from servidor.agendador import LimitadorTaxa
+
+    agora = [0.0]
+    lim = LimitadorTaxa(taxa=2, rajada=2, relogio=lambda: agora[0])
+    assert lim.verifica("a") == 0 and lim.verifica("a") == 0
+    assert lim.verifica("a") == pytest.approx(0.5)  # sem token: meio segundo até o próximo (2/s)
+    assert lim.verifica("b") == 0  # outro cliente tem o próprio balde
+    agora[0] = 0.5
+    assert lim.verifica("a") == 0
+    assert LimitadorTaxa(taxa=0, rajada=1).verifica("a") == 0  # taxa 0 = desligado
+
+
+def test_agendador_justo_intercala_clientes():
+    """Com um worker ocupado e 5 tarefas do lote na fila, a tarefa do agente roda logo após a primeira do lote."""
+    import threading
+    import time
+
+    from servidor.agendador import AgendadorJusto
+
+    ag = AgendadorJusto(n_workers=1)
+    ordem, libera = [], threading.Event()
+    bloqueio = threading.Thread(target=ag.executa, args=("lote", libera.wait))
+    bloqueio.start()
+    while ag.pendentes():  # espera o worker pegar a tarefa que bloqueia
+        time.sleep(0.001)
+
+    threads = [
+        threading.Thread(target=ag.executa, args=("lote", lambda i=i: ordem.append(f"lote{i}"))) for i in range(5)
+    ]
+    threads.append(threading.Thread(target=ag.executa, args=("agente", lambda: ordem.append("agente"))))
+    for t in threads:
+        t.start()
+        while t.is_alive() and sum(ag.pendentes().values()) < threads.index(t) + 1:
+            time.sleep(0.001)
+    libera.set()
+    for t in threads + [bloqueio]:
+        t.join(2)
+    assert ordem[:2] == ["lote0", "agente"]
+    assert sorted(ordem[2:]) == ["lote1", "lote2", "lote3", "lote4"]
+
+
+def test_server_stats_mostra_fila_por_cliente_sem_expor_a_chave(monkeypatch):
+    class Agendador:
+        def pendentes(self):
+            return {"key:lote-segredo": 7, "ip:10.0.0.9": 2}
+
+    monkeypatch.setattr(srv, "AGENDADOR", Agendador())
+    conn = FakeConn(_frame({"tool": "server_stats", "args": {}}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    stats = json.loads(conn.sent[4:].decode("utf-8"))["result"]
+    assert stats["fila_por_cliente"] == {"key:lote…": 7, "ip:10.0.0.9": 2}
+
+    conn = FakeConn(_frame({"tool": "server_stats", "args": {"formato": "texto"}}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    texto = json.loads(conn.sent[4:].decode("utf-8"))["result"]
+    assert 'centercar_fila_pendentes{cliente="ip:10.0.0.9"} 2' in texto
+    assert "segredo" not in texto
+
+
+def test_servidor_responde_rate_limited(monkeypatch):
+    from servidor.agendador import LimitadorTaxa
+
+    monkeypatch.setattr(srv, "LIMITADOR", LimitadorTaxa(taxa=1, rajada=1, relogio=lambda: 0.0))
+    monkeypatch.setattr(srv, "obter_sessao", lambda: FakeSession([_V(id=1)]))
+    monkeypatch.setattr(srv, "aplicar_filtros", lambda q, f: q)
+
+    respostas = []
+    for _ in range(2):
+        conn = FakeConn(_frame({"tool": "search_cars", "args": {}}))
+        srv.trata_cliente(conn, ("10.0.0.1", 1))
+        respostas.append(json.loads(conn.sent[4:].decode("utf-8")))
+    assert respostas[0]["ok"] is True
+    assert respostas[1]["error"]["code"] == "RATE_LIMITED"
+    assert respostas[1]["error"]["retry_after_ms"] == 1000
+
+    # chave desconhecida não vira cliente novo: trocar de chave a cada requisição continua no balde do IP
+    for chave in ("k1", "k2"):
+        conn = FakeConn(_frame({"tool": "search_cars", "args": {}, "api_key": chave}))
+        srv.trata_cliente(conn, ("10.0.0.1", 1))
+        assert json.loads(conn.sent[4:].decode("utf-8"))["error"]["code"] == "RATE_LIMITED"
+
+    # chave da lista do servidor (mesmo IP) tem o próprio limite
+    monkeypatch.setattr(srv, "CHAVES_CLIENTES", frozenset({"agente"}))
+    conn = FakeConn(_frame({"tool": "search_cars", "args": {}, "api_key": "agente"}))
+    srv.trata_cliente(conn, ("10.0.0.1", 1))
+    assert json.loads(conn.sent[4:].decode("utf-8"))["ok"] is True
+
+
+def test_indice_fuzzy_tolera_erros_e_reconstroi_quando_versao_muda():
+    import time
+
+    from servidor.indice_fuzzy import IndiceFuzzy
+
+    dados = {"versao": 1, "marca": ["Volkswagen", "Chevrolet", "Citroën", "Toyota"], "modelo": ["Renegade"]}
+    indice = IndiceFuzzy(lambda: dados["versao"], lambda: (dados["versao"], dados), intervalo=0)
+
+    assert indice.resolve("marca", "volksvagem") == "Volkswagen"
+    assert indice.resolve("marca", "chevrolé") == "Chevrolet"
+    assert indice.resolve("marca", "CITROEN") == "Citroën"  # exato depois de normalizar
+    assert indice.resolve("marca", "xyz") is None
+    assert indice.indice("modelo").contem("ren") and indice.indice("modelo").contem("egad")
+    assert indice.indice("modelo").contem("R") and not indice.indice("modelo").contem("rena")
+
+    dados.update(versao=2, marca=dados["marca"] + ["Peugeot"])
+    indice.indice("marca")  # agenda a reconstrução em segundo plano
+    for _ in range(200):
+        if indice.versao_indice == 2:
+            break
+        time.sleep(0.005)
+    assert indice.resolve("marca", "pegeout") == "Peugeot"
+
+
+def test_snapshot_restaura_indice_so_se_os_dados_batem(tmp_path):
+    from servidor.indice_fuzzy import IndiceFuzzy
+    from servidor.snapshot_caches import SnapshotCaches
+
+    dados = {"versao": 7, "marca": ["Volkswagen"], "modelo": ["Gol"]}
+    identidade = {"atual": (7, ("base.db", 100, 1))}
+
+    def sobe():
+        carregadas = []
+        indice = IndiceFuzzy(lambda: dados["versao"], lambda: carregadas.append(1) or (dados["versao"], dados))
+        snap = SnapshotCaches(str(tmp_path / "snap.bin"), lambda: identidade["atual"])
+        snap.registra("indice_fuzzy", indice.exporta, indice.importa)
+        return indice, snap, carregadas
+
+    indice, snap, carregadas = sobe()
+    assert snap.carrega() == []  # ainda não há arquivo
+    assert snap.salva() == []  # índice não construído: nada a gravar
+    indice.constroi()
+    assert snap.salva() == ["indice_fuzzy"]
+
+    indice, snap, carregadas = sobe()
+    assert snap.carrega() == ["indice_fuzzy"]
+    assert indice.resolve("marca", "volksvagem") == "Volkswagen" and not carregadas
+
+    identidade["atual"] = (7, ("base.db", 200, 2))  # mesmo nº de escritas, outro arquivo
+    indice, snap, carregadas = sobe()
+    assert snap.carrega() == []
+    assert indice.resolve("marca", "volksvagem") == "Volkswagen" and carregadas
+
+
+def test_registro_de_tools_e_validacao_do_get_cars_by_ids(monkeypatch):
+    # tool nova entra no despacho só registrando a função
+    monkeypatch.setitem(srv.FERRAMENTAS, "eco", lambda ch: ch.responde(srv.codifica({"ok": True, "result": ch.args})))
+    conn = FakeConn(_frame({"tool": "eco", "args": {"a": 1}}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    assert json.loads(conn.sent[4:].decode("utf-8")) == {"ok": True, "result": {"a": 1}}
+
+    for args in ({}, {"ids": []}, {"ids": ["1"]}, {"ids": [True]}, {"ids": list(range(srv.MAX_IDS_POR_CHAMADA + 1))}):
+        conn = FakeConn(_frame({"tool": "get_cars_by_ids", "args": args}))
+        srv.trata_cliente(conn, ("127.0.0.1", 1))
+        assert json.loads(conn.sent[4:].decode("utf-8"))["error"]["code"] == "INVALID_REQUEST"
+
+
+def test_suggest_e_search_cars_fuzzy(monkeypatch):
+    from servidor.indice_fuzzy import IndiceFuzzy
+
+    dados = {"marca": ["Volkswagen", "Jeep"], "modelo": ["Renegade", "Gol"]}
+    monkeypatch.setattr(srv, "INDICE_FUZZY", IndiceFuzzy(lambda: 1, lambda: (1, dados)))
+    recebidos = []
+    monkeypatch.setattr(srv, "obter_sessao", lambda: FakeSession([_V(id=1)]))
+    monkeypatch.setattr(srv, "aplicar_filtros", lambda q, f: recebidos.append(dict(f)) or q)
+
+    conn = FakeConn(_frame({"tool": "suggest", "args": {"termo": "renegad"}}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    msg = json.loads(conn.sent[4:].decode("utf-8"))
+    assert msg["result"][0] == {"campo": "modelo", "valor": "Renegade", "score": msg["result"][0]["score"]}
+
+    conn = FakeConn(_frame({"tool": "suggest", "args": {"termo": "x", "campo": "cor"}}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    assert json.loads(conn.sent[4:].decode("utf-8"))["error"]["code"] == "INVALID_REQUEST"
+
+    args = {"marca": "Volksvagem", "modelo": "Reneagde", "fuzzy": True}
+    conn = FakeConn(_frame({"tool": "search_cars", "args": args}))
+    srv.trata_cliente(conn, ("127.0.0.1", 1))
+    msg = json.loads(conn.sent[4:].decode("utf-8"))
+    assert msg["ok"] is True and msg["resolvido"] == {"marca": "Volkswagen", "modelo": "Renegade"}
+    assert recebidos[-1]["marca"] == "Volkswagen" and recebidos[-1]["modelo"] == "Renegade"
+
+    # parte do nome continua indo para o LIKE; sem "fuzzy", nada muda
+    for args in ({"modelo": "Ren", "fuzzy": True}, {"marca": "Volksvagem"}):
+        srv.trata_cliente(FakeConn(_frame({"tool": "search_cars", "args": args})), ("127.0.0.1", 1))
+        assert recebidos[-1] == {k: v for k, v in args.items() if k != "fuzzy"}
+
+
+def test_escritor_em_grupo_junta_pedidos_e_isola_falha():
+    """Pedidos simultâneos viram um lote (um commit); lote que falha é regravado pedido a pedido."""
+    import threading
+
+    from servidor.escritor import EscritorEmGrupo
+
+    lotes = []
+
+    def aplica(pedidos):
+        lotes.append([itens for _, itens in pedidos])
+        if len(pedidos) > 1 and any(i.get("ruim") for _, itens in pedidos for i in itens):
+            raise ValueError("lote recusado")
+        if any(i.get("ruim") for _, itens in pedidos for i in itens):
+            raise ValueError("item ruim")
+        return [[{"id": i["id"], "status": "atualizado"} for i in itens] for _, itens in pedidos]
+
+    escritor = EscritorEmGrupo(aplica, atraso_max=0.2, max_itens=100)
+    acks, erros = {}, {}
+
+    def escreve(k, ruim=False):
+        try:
+            acks[k] = escritor.submete("update_prices", [{"id": k, "ruim": ruim}])
+        except ValueError as e:
+            erros[k] = str(e)
+
+    threads = [threading.Thread(target=escreve, args=(k,)) for k in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(2)
+    assert len(lotes) == 1 and len(lotes[0]) == 5
+    assert acks == {k: [{"id": k, "status": "atualizado"}] for k in range(5)}
+
+    lotes.clear()
+    threads = [threading.Thread(target=escreve, args=(k, k == 7)) for k in (6, 7, 8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(2)
+    assert len(lotes) == 4  # o lote junto e depois cada pedido sozinho
+    assert erros == {7: "item ruim"} and set(acks) == set(range(5)) | {6, 8}
+
+
+def test_tools_de_escrita_validam_itens(monkeypatch):
+    def chama(tool, args):
+        conn = FakeConn(_frame({"tool": tool, "args": args}))
+        srv.trata_cliente(conn, ("127.0.0.1", 1))
+        return json.loads(conn.sent[4:].decode("utf-8"))
+
+    monkeypatch.setattr(srv, "ESCRITA_HABILITADA", False)
+    assert chama("update_prices", {"itens": [{"id": 1, "preco": 10}]})["error"]["code"] == "FORBIDDEN"
+
+    monkeypatch.setattr(srv, "ESCRITA_HABILITADA", True)
+    for args in ({}, {"itens": []}, {"itens": {"id": 1}}, {"itens": [{}] * (srv.MAX_ITENS_POR_ESCRITA + 1)}):
+        assert chama("upsert_cars", args)["error"]["code"] == "INVALID_REQUEST"
+
+    # todos inválidos: acks na hora, sem passar pelo escritor
+    monkeypatch.setattr(srv, "ESCRITOR", None)
+    itens = [
+        {"id": 1, "preco": -5},
+        {"id": True, "preco": 10},
+        {"id": 2, "preco": 10, "cor": "Azul"},
+    ]
+    acks = chama("update_prices", {"itens": itens})["result"]
+    assert [a["status"] for a in acks] == ["invalido"] * 3 and [a["id"] for a in acks] == [1, None, 2]
+    acks = chama("upsert_cars", {"itens": [{"marca": "Fiat"}, {"id": 3, "preço": 1.0}, {"id": 3, "ano": 1800}]})
+    assert [a["status"] for a in acks["result"]] == ["invalido"] * 3
+    assert "campos obrigatórios" in acks["result"][0]["erro"] and "preço" in acks["result"][1]["erro"]